@@ -0,0 +1,177 @@
+"""
+Benchmarks of the statistics core on synthetic DevoirD-shaped data.
+
+    python Benchmark.py --sizes 1000 100000 1000000
+    python Benchmark.py --sizes 100000 --save baseline.json
+    python Benchmark.py --sizes 100000 --compare baseline.json --tolerance 0.25
+
+Every case is timed (best of --repeat runs), then run once more under tracemalloc for its
+peak memory. --compare exits with status 1 when a case got slower (or hungrier) than the
+baseline by more than the tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from SyntheticData import SyntheticData
+
+
+def _fitted(modelClass, frame):
+    model = modelClass()
+    model.initiate(frame[model.XColumnName].to_numpy(), frame["IR"].to_numpy())
+    return model
+
+
+def statsAnalyze(frame, directory):
+    from StatsVoodoo import Stats
+    data = frame["IR"].tolist()
+    return lambda: Stats().analyze(data)
+
+
+def parametersEvaluate(frame, directory):
+    from StatsVoodoo import Parameters
+    X, Y = frame["T"].to_numpy(), frame["IR"].to_numpy()
+    return lambda: Parameters(X, Y).evaluate()
+
+
+def modelFit(modelName):
+    def case(frame, directory):
+        import Models
+        modelClass = getattr(Models, modelName)
+        return lambda: _fitted(modelClass, frame)
+    return case
+
+
+def modelPredict(modelName):
+    def case(frame, directory):
+        import Models
+        model = _fitted(getattr(Models, modelName), frame)
+        X = frame[model.XColumnName].to_numpy()
+        return lambda: (model.predict(X), model.predictUpper(X), model.predictLower(X))
+    return case
+
+
+def exportVarianceTable(frame, directory):
+    from Models import Model6
+    model = _fitted(Model6, frame)
+    Y, X = frame["IR"].to_numpy(), frame["T"].to_numpy()
+    filePath = os.path.join(directory, "varianceTable.csv")
+    return lambda: model.exportVarianceTable(Y, X, filePath)
+
+
+def tTest(frame, directory):
+    from HypothesisTest import Hypothesis
+    dataY1 = frame["IR"][frame["M"] == 0].tolist()
+    dataY2 = frame["IR"][frame["M"] == 1].tolist()
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            Hypothesis().tTest(dataY1, dataY2)
+    return run
+
+
+def evaluateAllModels(frame, directory):
+    from DataInterpreter import DataInterpreter
+    import Models
+    from ResultsSink import ResultsSink
+    interpreter = DataInterpreter(None, 0, dataSet=frame[frame["M"] == 0])
+
+    def run():
+        interpreter.models = [getattr(Models, f"Model{i}")() for i in range(1, 7)]
+        with ResultsSink(os.path.join(directory, "results.jsonl")) as sink:
+            interpreter.evaluateAllModels(outputDir=directory, processes=0, sink=sink)
+    return run
+
+
+# name, largest size it makes sense to run at, case(frame, scratch directory) -> callable
+CASES = [
+    ("Stats.analyze", 10 ** 7, statsAnalyze),
+    ("Parameters.evaluate", 10 ** 7, parametersEvaluate),
+    ("ModelType1 fit", 10 ** 7, modelFit("Model4")),
+    ("ModelType2 fit", 10 ** 7, modelFit("Model5")),
+    ("ModelType3 fit", 10 ** 7, modelFit("Model6")),
+    ("ModelType1 predict", 10 ** 7, modelPredict("Model4")),
+    ("ModelType2 predict", 10 ** 7, modelPredict("Model5")),
+    ("ModelType3 predict", 10 ** 7, modelPredict("Model6")),
+    ("exportVarianceTable", 10 ** 7, exportVarianceTable),
+    ("Hypothesis.tTest", 10 ** 7, tTest),
+    # renders six scatter plots, too slow to be meaningful beyond that
+    ("DataInterpreter.evaluateAllModels", 10 ** 5, evaluateAllModels),
+]
+
+
+def measure(run, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def runBenchmarks(sizes, repeat=3, seed=0, only=None):
+    results = {}
+    generator = SyntheticData(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            frame = generator.generate(n)
+            for name, maxSize, case in CASES:
+                if n > maxSize or (only and not any(word in name for word in only)):
+                    continue
+                seconds, peak = measure(case(frame, directory), repeat)
+                results[f"{name}|{n}"] = {"case": name, "n": n, "seconds": seconds,
+                                          "rowsPerSecond": n / seconds if seconds else float("inf"),
+                                          "peakMB": peak / 2 ** 20}
+                print(f"{name:<36}{n:>10} rows {seconds * 1000:>11.2f} ms {n / seconds:>14.0f} rows/s "
+                      f"{peak / 2 ** 20:>9.1f} MB", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric in ("seconds", "peakMB"):
+            if reference[metric] > 0 and result[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{key}: {metric} {reference[metric]:.4g} -> {result[metric]:.4g}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the statistics core")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 3, 10 ** 4, 10 ** 5])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', default=None, help="only the cases whose name contains one of these")
+    parser.add_argument('--save', default=None, help="write the results to this json baseline")
+    parser.add_argument('--compare', default=None, help="json baseline to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(args.sizes, args.repeat, args.seed, args.only)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
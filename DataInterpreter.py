@@ -1,108 +1,304 @@
-from Grapher import *
-from Models import *
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from Dataset import Dataset
+from Diagnostics import Diagnostics
+from Models import TRANSFORMS, ModelBatch
+from StatsVoodoo import Stats, Parameters
 from HypothesisTest import Hypothesis
+from Profiler import profiler
+
+# Grapher (matplotlib + seaborn) is only imported by the methods that plot, so that
+# computing without plotting doesn't pay for the visualization stack
 
 
 class DataInterpreter:
 
-    def __init__(self, file, classToUse):
-        self.dataSet = pd.read_csv(file)
-        self.dataSet = self.dataSet.drop(self.dataSet[self.dataSet["M"] != classToUse].index)
+    def __init__(self, file, classToUse, dataSet=None):
+        # file is a path or a Dataset handle, either way it is parsed at most once (see Dataset.open)
+        # dataSet lets a caller that already filtered the rows skip the filtering too
+        if dataSet is None:
+            self.dataSet = Dataset.open(file).where("M", classToUse)
+        else:
+            self.dataSet = dataSet
         self.filePath = file
         self.className = classToUse
         self.models = []
+        self._diagnostics = None    # Diagnostics of self.dataSet, its Dataset handle holds the cached sort orders
 
     def getDataSet(self):
         return self.dataSet
 
-    def plotBox(self, xName, title=''):
-        boxPlot = BoxPlot(self.filePath)
+    def diagnostics(self):
+        if self._diagnostics is None or self._diagnostics.handle.frame is not self.dataSet:
+            self._diagnostics = Diagnostics(self.dataSet, 'IR')
+        return self._diagnostics
+
+    def sortedColumn(self, name):
+        # sorted once per column and reused (Stats.analyze, the normal probability plot...)
+        return self.diagnostics().handle.sortedColumn(name)
+
+    def plotBox(self, xName, title='', outputPath=None):
+        # with an outputPath the graph is rendered headless to that file instead of shown
+        from Grapher import BoxPlot
+        boxPlot = BoxPlot(self.filePath, outputPath)
         boxPlot.data = self.dataSet
         boxPlot.render(self.className, xName, title)
 
-    def plotHistogram(self, xName, title=''):
-        histogram = Histogram(self.filePath)
+    def plotHistogram(self, xName, title='', outputPath=None):
+        from Grapher import Histogram
+        histogram = Histogram(self.filePath, outputPath)
         histogram.data = self.dataSet
         histogram.render(xName, 'M', title)
 
     def __findParameters(self, filePath=''):
         stats = Stats(dataloc=filePath)
-        stats.analyze(self.dataSet['IR'])
+        stats.analyze(self.dataSet['IR'], self.sortedColumn('IR'))
         stats.export()
         return stats.mean, stats.variance
 
-    def plotNormalProbabilityPlot(self, xName, title=''):
-        oldDF = self.dataSet.copy(True)
+    def plotNormalProbabilityPlot(self, xName, title='', outputPath=None):
         mean, var = self.__findParameters(f"{title}v1.csv")
-        vals = sorted(self.dataSet[xName].tolist())
-        yValues = [(i - 0.375)/(len(vals) + 0.25) for i in range(0, len(vals))]
-        errors = [(x - mean) / var for x in vals]
-        self.dataSet[xName] = errors
-        self.dataSet["y"] = yValues
-        normalProbPlot = NormalProbPlot(self.filePath)
-        normalProbPlot.data = self.dataSet
+        # the plot gets a two column frame of its own, the data set itself is left alone
+        errors, yValues, _ = self.diagnostics().normalProbability([xName], mean, var)[xName]
+        from Grapher import NormalProbPlot
+        normalProbPlot = NormalProbPlot(self.filePath, outputPath)
+        normalProbPlot.data = pd.DataFrame({xName: errors, "y": yValues}, copy=False)
         normalProbPlot.render(xName, "y", title=title)
-        self.dataSet = oldDF
 
     def addModel(self, model):
         self.models.append(model)
 
-    def evaluateAllModels(self):
+    def evaluateAllModels(self, outputDir=None, processes=None, sink=None, cache=None):
+        """
+        Without an outputDir every comparison graph is shown interactively, one after the other.
+        With one they are rendered headless to <outputDir>/<model>-regression.png, all of them
+        together over a process pool (see Grapher.renderBatch).
+        With a ResultsSink the fits and variance tables go to the sink instead of two csv per model.
+        With a FitCache the fits and variance tables already computed on this data are reused.
+        """
+        from Grapher import plt, sn, PlotJob, RegressionPlot, renderBatch
+        # all the regressions are solved together, sharing the log transforms
+        if cache is None:
+            ModelBatch(self.dataSet, 'IR').fit(self.models)
+        else:
+            cache.fitBatch(self.dataSet, self.models, 'IR')
+        jobs = []
+        diagnostics = self.diagnostics()
+        Y = diagnostics.column('IR')
         for model in self.models:
-            model.initiate(XData=self.dataSet[model.XColumnName].tolist(),
-                           YData=self.dataSet['IR'].tolist())
-            # models
-            Y = model.model(model.XColumnName)
+            X = diagnostics.column(model.XColumnName)
 
-            YUpper = model.upperBoundModel()
-            YLower = model.lowerBoundModel()
-
-            # data
-            YPred = [Y(x) for x in self.dataSet[model.XColumnName].tolist()]
-            YUpperPred = [YUpper(x) for x in self.dataSet[model.XColumnName].tolist()]
-            YLowerPred = [YLower(x) for x in self.dataSet[model.XColumnName].tolist()]
-
-            # set data
-            tempDF = self.dataSet.copy(True)
-            tempDF['Y_hat'] = YPred
-            tempDF['Y_upper'] = YUpperPred
-            tempDF['Y_lower'] = YLowerPred
+            # set data: only the plotted columns, the data set's own ones are shared, not copied
+            with profiler.span("predict", model=type(model).__name__):
+                tempDF = pd.DataFrame({model.XColumnName: X, 'IR': Y, 'Y_hat': model.predict(X),
+                                       'Y_upper': model.predictUpper(X), 'Y_lower': model.predictLower(X)}, copy=False)
+            profiler.count("rows predicted", 3 * len(X))
 
             # plot
-            sns = sn
-            sns.scatterplot(data=tempDF, y='IR', x=model.XColumnName, color='blue')
-            sns.scatterplot(data=tempDF, y='Y_hat', x=model.XColumnName, color='red')
-            sns.scatterplot(data=tempDF, y='Y_upper', x=model.XColumnName, color='gray')
-            sns.scatterplot(data=tempDF, y='Y_lower', x=model.XColumnName, color='gray')
+            if outputDir is None:
+                with profiler.span("plot", model=type(model).__name__):
+                    sns = sn
+                    sns.scatterplot(data=tempDF, y='IR', x=model.XColumnName, color='blue')
+                    sns.scatterplot(data=tempDF, y='Y_hat', x=model.XColumnName, color='red')
+                    sns.scatterplot(data=tempDF, y='Y_upper', x=model.XColumnName, color='gray')
+                    sns.scatterplot(data=tempDF, y='Y_lower', x=model.XColumnName, color='gray')
 
-            plt.title(f"{type(model)} regression comp")
-            plt.show()
+                    plt.title(f"{type(model)} regression comp")
+                plt.show()
+            else:
+                jobs.append(PlotJob(RegressionPlot, tempDF, os.path.join(outputDir, f"{type(model).__name__}-regression.png"),
+                                    model.XColumnName, 'IR', f"{type(model)} regression comp"))
 
-            model.export(f"{type(model)}.csv")
-            model.exportVarianceTable(tempDF["IR"].tolist(), tempDF[model.XColumnName].tolist(), f"{type(model)}-varianceTable.csv")
+            # the predictions are already there, no need to evaluate the model again
+            if model.F_0 == -1:
+                model.evaluateVarianceTable(Y, YPred=tempDF['Y_hat'].to_numpy(), fittedData=True)
+                if cache is not None:
+                    cache.update(model)
+            if sink is None:
+                model.export(f"{type(model)}.csv")
+                model.writeVarianceTable(f"{type(model)}-varianceTable.csv")
+            else:
+                sink.addModel(model, material=self.className)
 
-    def testResidues(self):
-        Ydata = self.dataSet['IR'].tolist()
-        for model in self.models:
-            modelFunction = model.model(model.XColumnName)
-            Xdata = self.dataSet[model.XColumnName].tolist()
+        return renderBatch(jobs, processes)
 
+    def testResidues(self, outputDir=None, processes=None):
+        # same outputDir / processes behaviour as evaluateAllModels, files are <model>-residues.png
+        from Grapher import plt, sn, PlotJob, ScatterPlot, renderBatch
+        jobs = []
+        # the residues of every model in one stacked pass
+        residuals = self.diagnostics().residuals(self.models)
+        profiler.count("rows predicted", sum(len(result.X) for result in residuals))
+        for model, result in zip(self.models, residuals):
             # hypothesis  test:
             print(f"for model {type(model)}")
-            hypothesis = Hypothesis()
-            hypothesis.fTest(model.F_0, 1, len(Xdata))
+            with profiler.span("test", model=type(model).__name__):
+                hypothesis = Hypothesis()
+                hypothesis.fTest(model.F_0, 1, len(result.X))
             print("\n====================\n")
 
-            tempDF = self.dataSet.copy(True)
-            residues = [Ydata[i] - modelFunction(Xdata[i]) for i in range(len(Xdata))]
+            tempDF = pd.DataFrame({model.XColumnName: result.X, 'residues': result.residuals}, copy=False)
+
+            if outputDir is None:
+                with profiler.span("plot", model=type(model).__name__):
+                    sns = sn
+                    sns.scatterplot(data=tempDF, y='residues', x=model.XColumnName, color='violet')
+
+                    plt.title(f"Residues of {type(model)}")
+                plt.show()
+            else:
+                jobs.append(PlotJob(ScatterPlot, tempDF, os.path.join(outputDir, f"{type(model).__name__}-residues.png"),
+                                    model.XColumnName, 'residues', f"Residues of {type(model)}", 'violet'))
+
+        return renderBatch(jobs, processes)
+
+
+class GroupedDataInterpreter:
+    """
+    Grouped mode of DataInterpreter: the csv is read once and partitioned by a key column
+    (the material class M by default). Stats and model fits are then computed for every
+    group together with bincount reductions over the whole column instead of one
+    DataInterpreter (and one csv parse) per class. When there are many large groups the
+    groups are sharded over a process pool instead.
+    """
+    poolMinRows = 2_000_000  # below this many rows a single vectorized pass is always faster
+    poolMinGroups = 64
+
+    def __init__(self, file, keyColumn='M', YColumnName='IR', alphaError=0.05, dataSet=None):
+        self.dataSet = Dataset.open(file).frame if dataSet is None else dataSet
+        self.filePath = file
+        self.keyColumn = keyColumn
+        self.YColumnName = YColumnName
+        self.alpha = alphaError
+        self.keys, self.groupIndex = np.unique(self.dataSet[keyColumn].to_numpy(), return_inverse=True)
+        self.counts = np.bincount(self.groupIndex, minlength=len(self.keys))
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+        self._order = np.argsort(self.groupIndex, kind='stable')   # rows sorted by group, original order kept inside a group
+        self._columns = {}  # (columnName, transform) -> (group means, centered values)
+
+    def groups(self):
+        return self.keys.tolist()
+
+    def getGroup(self, key):
+        g = self.__groupOf(key)
+        return self.dataSet.iloc[self._order[self.starts[g]:self.starts[g] + self.counts[g]]]
+
+    def interpreter(self, key):
+        return DataInterpreter(self.filePath, key, dataSet=self.getGroup(key))
+
+    def __checkSizes(self, minimum, what):
+        # like Stats.analyze / Parameters on a single group, instead of nan and inf for the small ones
+        small = self.keys[self.counts < minimum]
+        if len(small):
+            raise Exception(f'{what} needs at least {minimum} observations per group, '
+                            f'{self.keyColumn} = {small.tolist()} have fewer')
+
+    def __groupOf(self, key):
+        g = np.searchsorted(self.keys, key)
+        if g >= len(self.keys) or self.keys[g] != key:
+            raise Exception(f'No group {key} in column {self.keyColumn}')
+        return g
+
+    def column(self, columnName, transform="identity"):
+        key = (columnName, transform)
+        if key not in self._columns:
+            values = TRANSFORMS[transform](self.dataSet[columnName].to_numpy(dtype=np.float64))
+            means = np.bincount(self.groupIndex, weights=values, minlength=len(self.keys)) / self.counts
+            self._columns[key] = (means, values - means[self.groupIndex])
+        return self._columns[key]
+
+    def analyzeAll(self, columnName='IR'):
+        """
+        Stats of columnName for every group: returns {key: Stats}
+        """
+        self.__checkSizes(2, 'Stats')
+        means, centered = self.column(columnName)
+        variances = np.bincount(self.groupIndex, weights=centered * centered, minlength=len(self.keys)) / (self.counts - 1)
+        values = self.dataSet[columnName].to_numpy(dtype=np.float64)
+        # one lexsort sorts every group at once, group g then lives in [starts[g], starts[g] + counts[g])
+        sortedValues = values[np.lexsort((values, self.groupIndex))]
+        n = self.counts
+
+        def at(offset):
+            # python-style wrap around so tiny groups behave exactly like Stats.analyze
+            return sortedValues[self.starts + offset % n]
+
+        even = n % 2 == 0
+        median = np.where(even, (at(n // 2 - 1) + at(n // 2)) / 2, at(n // 2))
+        Q1 = np.where(even, (at(n // 4 - 1) + at(n // 4)) / 2, at(n // 4))
+        Q3 = np.where(even, (at((3 * n) // 4 - 1) + at((3 * n) // 4)) / 2, at((3 * n) // 4))
+
+        results = {}
+        for g, key in enumerate(self.keys.tolist()):
+            stats = Stats(self.alpha)
+            stats.n = int(n[g])
+            stats.mean, stats.variance = float(means[g]), float(variances[g])
+            stats.stD = math.sqrt(stats.variance)
+            stats.CI = 1.96 * (stats.stD / math.sqrt(stats.n))
+            stats.Q1, stats.median, stats.Q3 = float(Q1[g]), float(median[g]), float(Q3[g])
+            results[key] = stats
+        return results
+
+    def fitAll(self, modelClasses, processes=None):
+        """
+        Fits every model class on every group: returns {key: [fitted models]}.
+        processes=None lets the interpreter decide, 0 forces the single vectorized pass.
+        """
+        self.__checkSizes(3, 'A regression')
+        if processes is None:
+            useful = len(self.keys) >= self.poolMinGroups and len(self.dataSet) >= self.poolMinRows
+            processes = os.cpu_count() if useful else 0
+        if processes and processes > 1:
+            return self.__fitAllInPool(modelClasses, processes)
 
-            tempDF['residues'] = residues
+        prototypes = [modelClass() for modelClass in modelClasses]
+        pairs = list(dict.fromkeys(((p.XColumnName, p.xTransform), (self.YColumnName, p.yTransform)) for p in prototypes))
+        fitsPerPair = {}
+        for xKey, yKey in pairs:
+            xMeans, dx = self.column(*xKey)
+            yMeans, dy = self.column(*yKey)
+            sums = [np.bincount(self.groupIndex, weights=product, minlength=len(self.keys))
+                    for product in (dx * dx, dx * dy, dy * dy)]
+            fitsPerPair[(xKey, yKey)] = Parameters.fromSums(self.counts, xMeans, yMeans, *sums, self.alpha)
 
-            sns = sn
-            sns.scatterplot(data=tempDF, y='residues', x=model.XColumnName, color='violet')
+        results = {key: [] for key in self.keys.tolist()}
+        for p, modelClass in zip(prototypes, modelClasses):
+            fits = fitsPerPair[((p.XColumnName, p.xTransform), (self.YColumnName, p.yTransform))]
+            for key, parameters in zip(results, fits):
+                model = modelClass()
+                model.initiateFromParameters(parameters)
+                results[key].append(model)
+        return results
 
-            plt.title(f"Residues of {type(model)}")
-            plt.show()
+    def __fitAllInPool(self, modelClasses, processes):
+        prototypes = [modelClass() for modelClass in modelClasses]
+        neededColumns = list(dict.fromkeys([self.keyColumn, self.YColumnName] + [p.XColumnName for p in prototypes]))
+        # deal the groups out largest first so the shards end up about the same size
+        shards = [[] for _ in range(processes)]
+        load = np.zeros(processes)
+        for g in np.argsort(-self.counts, kind='stable'):
+            target = int(load.argmin())
+            shards[target].append(g)
+            load[target] += self.counts[g]
 
+        results = {}
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = []
+            for shard in shards:
+                if not shard:
+                    continue
+                rows = np.concatenate([self._order[self.starts[g]:self.starts[g] + self.counts[g]] for g in shard])
+                part = self.dataSet[neededColumns].iloc[rows]
+                futures.append(pool.submit(_fitGroupShard, part, self.keyColumn, self.YColumnName, self.alpha, modelClasses))
+            for future in futures:
+                results.update(future.result())
+        return {key: results[key] for key in self.keys.tolist()}
 
 
+def _fitGroupShard(dataSet, keyColumn, YColumnName, alphaError, modelClasses):
+    # runs in a worker process, fits its share of the groups in one vectorized pass
+    grouped = GroupedDataInterpreter(None, keyColumn, YColumnName, alphaError, dataSet=dataSet)
+    return grouped.fitAll(modelClasses, processes=0)
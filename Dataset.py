@@ -0,0 +1,162 @@
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from Profiler import profiler
+
+
+# explicit dtypes of the known columns, so pandas never has to guess them (and M/V stay smaller
+# than int64). pandas wraps integers that don't fit without any error, so these are wide enough
+# for thousands of material classes (an int8 M turned class 300 into 44)
+DTYPES = {
+    "M": np.int32,
+    "V": np.int32,
+    "T": np.float64,
+    "IR": np.float64,
+}
+
+# path -> Dataset, every handle is only valid for the (mtime, size) it was loaded with. Only the
+# CACHE_SIZE last used ones are kept, a long running process (the Server) opens any number of files
+CACHE_SIZE = 16
+_cache = OrderedDict()
+
+
+class Dataset:
+    """
+    Handle on a parsed data set, shared by the DataInterpreters and the Graphers so that a
+    file is only parsed once per process. Dataset.open() caches handles on the file path and
+    reuses them until the file's mtime or size changes (or CACHE_SIZE other files were opened since).
+
+    A csv can also be converted once to a binary columnar copy (one .npy per column, memory
+    mapped when opened, or Parquet if pyarrow is installed). open() then reads that copy
+    instead of the csv for as long as it is newer than the csv.
+    """
+
+    def __init__(self, frame, path=None):
+        self.frame = frame
+        self.path = path
+        self._orders = {}   # column name -> (argsort, sorted values), computed the first time they're needed
+
+    @staticmethod
+    def open(path, dtypes=None):
+        if isinstance(path, Dataset):
+            return path
+        path = os.path.abspath(path)
+        signature = Dataset.__signature(path)
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _cache.move_to_end(path)
+            return cached[1]
+        with profiler.span("load", path=path):
+            dataset = Dataset(Dataset.__read(path, dtypes), path)
+        profiler.count("rows loaded", len(dataset.frame))
+        _cache[path] = (signature, dataset)
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)  # least recently used first
+        return dataset
+
+    @staticmethod
+    def clearCache():
+        _cache.clear()
+
+    @staticmethod
+    def __signature(path):
+        status = os.stat(path)
+        return status.st_mtime_ns, status.st_size
+
+    @staticmethod
+    def columnsDirectory(path):
+        return os.path.splitext(path)[0] + ".columns"
+
+    @staticmethod
+    def parquetPath(path):
+        return os.path.splitext(path)[0] + ".parquet"
+
+    @staticmethod
+    def __read(path, dtypes=None):
+        if path.endswith(".parquet"):
+            return pd.read_parquet(path)
+        source = os.stat(path).st_mtime_ns
+        columns = Dataset.columnsDirectory(path)
+        if os.path.isfile(os.path.join(columns, "columns.json")) and os.stat(os.path.join(columns, "columns.json")).st_mtime_ns >= source:
+            return Dataset.readColumns(columns)
+        parquet = Dataset.parquetPath(path)
+        if os.path.isfile(parquet) and os.stat(parquet).st_mtime_ns >= source:
+            return pd.read_parquet(parquet)
+        return Dataset.readCsv(path, dtypes)
+
+    @staticmethod
+    def readCsv(path, dtypes=None, **kwargs):
+        # only pass dtypes for the columns the file really has
+        dtypes = DTYPES if dtypes is None else dtypes
+        header = pd.read_csv(path, nrows=0).columns
+        return pd.read_csv(path, dtype={name: dtype for name, dtype in dtypes.items() if name in header}, **kwargs)
+
+    @staticmethod
+    def readColumns(directory):
+        # the .npy columns are memory mapped, only the pages that are used get read
+        with open(os.path.join(directory, "columns.json")) as f:
+            names = json.load(f)
+        return pd.DataFrame({name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in names},
+                            copy=False)
+
+    @staticmethod
+    def convert(path, fileFormat="npy"):
+        """
+        Writes the binary copy of a csv next to it (<name>.columns/ or <name>.parquet)
+        :return: path of what was written
+        """
+        path = os.path.abspath(path)
+        frame = Dataset.readCsv(path)
+        if fileFormat == "parquet":
+            target = Dataset.parquetPath(path)
+            frame.to_parquet(target, index=False)   # needs pyarrow (or fastparquet)
+            return target
+        if fileFormat != "npy":
+            raise Exception(f'Unknown format {fileFormat}, use npy or parquet')
+        return Dataset.writeColumns(frame, Dataset.columnsDirectory(path))
+
+    @staticmethod
+    def writeColumns(frame, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in frame.columns:
+            np.save(os.path.join(directory, f"{name}.npy"), frame[name].to_numpy())
+        # written last: its mtime is what marks the copy as up to date
+        with open(os.path.join(directory, "columns.json"), 'w') as f:
+            json.dump(list(frame.columns), f)
+        return directory
+
+    def column(self, name):
+        return self.frame[name].to_numpy()
+
+    def order(self, name):
+        """
+        Stable argsort of a column, sorted once per handle and shared by every later consumer
+        (read only, like the sorted view)
+        """
+        return self.__sorted(name)[0]
+
+    def sortedColumn(self, name):
+        return self.__sorted(name)[1]
+
+    def __sorted(self, name):
+        if name not in self._orders:
+            with profiler.span("sort", column=name):
+                values = self.frame[name].to_numpy()
+                order = np.argsort(values, kind='stable')
+                sortedValues = values[order]
+            order.flags.writeable = False
+            sortedValues.flags.writeable = False
+            self._orders[name] = (order, sortedValues)
+        return self._orders[name]
+
+    def where(self, columnName, value):
+        """
+        Rows whose columnName equals value, as a plain DataFrame
+        """
+        return self.frame[self.frame[columnName].to_numpy() == value]
+
+    def __len__(self):
+        return len(self.frame)
@@ -0,0 +1,135 @@
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from Dataset import Dataset
+from Models import TRANSFORMS
+from Profiler import profiler
+
+
+@lru_cache(maxsize=16)
+def plottingPositions(n):
+    # (i - 0.375) / (n + 0.25), Blom's estimate of the probability of the i-th smallest of n normal values
+    positions = (np.arange(n) - 0.375) / (n + 0.25)
+    positions.flags.writeable = False
+    return positions
+
+
+@lru_cache(maxsize=16)
+def normalQuantiles(n):
+    # theoretical N(0, 1) quantiles of the n order statistics, the x axis of a Q-Q plot
+    from scipy.special import ndtri
+    quantiles = ndtri((np.arange(1, n + 1) - 0.375) / (n + 0.25))
+    quantiles.flags.writeable = False
+    return quantiles
+
+
+class ModelDiagnostics:
+    """
+    Residual analysis of one fitted model, as arrays aligned with the rows of the data:
+    fitted values, residuals, standardized residuals and leverage (shared between the
+    models that regress on the same transformed column). Nothing of the data set is copied.
+    fitted and residuals are in the original scale of Y; the standardized residuals, like the
+    leverage and MSE, are the regression's (lnY - (B0 + B1 * lnX) for a power model...).
+    """
+
+    def __init__(self, model, X, fitted, residuals, leverage, regressionResiduals, MSE):
+        self.model = model
+        self.X = X
+        self.fitted = fitted
+        self.residuals = residuals
+        self.leverage = leverage
+        self.MSE = MSE
+        self.standardized = regressionResiduals / np.sqrt(MSE * (1 - leverage))
+
+    def frame(self, *columns):
+        """
+        A DataFrame of the requested arrays ("X" is named after the model's column) without copying them,
+        for the plotting code
+        """
+        data = {}
+        for column in columns or ("X", "fitted", "residuals", "standardized", "leverage"):
+            data[self.model.XColumnName if column == "X" else column] = getattr(self, column)
+        return pd.DataFrame(data, copy=False)
+
+
+class Diagnostics:
+    """
+    Normal probability and residual diagnostics for a data set and any number of models,
+    computed in stacked array operations. Sorts go through a Dataset handle so that a
+    column is sorted once whatever the number of plots, and the results only hold
+    references to the columns of the data set (or small arrays of their own), never
+    a copy of the frame.
+
+        diagnostics = Diagnostics(interpreter.dataSet)
+        for result in diagnostics.residuals(interpreter.models):
+            result.standardized, result.leverage ...
+    """
+
+    def __init__(self, dataSet, YColumnName='IR'):
+        self.handle = dataSet if isinstance(dataSet, Dataset) else Dataset(dataSet)
+        self.YColumnName = YColumnName
+        self._leverages = {}    # (columnName, transform, fit) -> leverage of every row
+
+    def column(self, name):
+        return self.handle.column(name)
+
+    def normalProbability(self, columns, mean=None, scale=None):
+        """
+        For every column: its sorted values (standardized with mean / scale when given, for
+        each column both default to its own mean and standard deviation), their plotting
+        positions and the theoretical normal quantiles.
+        :return: {column: (values, positions, quantiles)}
+        """
+        results = {}
+        with profiler.span("normal scores", columns=len(columns)):
+            for name in columns:
+                values = self.handle.sortedColumn(name)
+                n = len(values)
+                center = float(values.mean()) if mean is None else mean
+                spread = float(values.std(ddof=1)) if scale is None else scale
+                results[name] = ((values - center) / spread, plottingPositions(n), normalQuantiles(n))
+        return results
+
+    def leverage(self, model):
+        """
+        h = 1/n + (x - x̄)² / SXX on the model's transformed X, the weight of each row in its own fit
+        """
+        parameters = model.parameters
+        key = (model.XColumnName, model.xTransform, parameters.n, parameters.xMean, parameters.SXX)
+        if key not in self._leverages:
+            x = TRANSFORMS[model.xTransform](np.asarray(self.column(model.XColumnName), dtype=np.float64))
+            dx = x - parameters.xMean
+            self._leverages[key] = 1 / parameters.n + dx * dx / parameters.SXX
+        return self._leverages[key]
+
+    def residuals(self, models):
+        """
+        Residuals of every model against Y in the original scale, all models at once, and
+        against the transformed Y in the regression's scale for the standardized ones
+        :return: a ModelDiagnostics per model, in order
+        """
+        y = np.asarray(self.column(self.YColumnName), dtype=np.float64)
+        transformed = {}    # (columnName, transform) -> values, each computed once
+
+        def column(name, transform):
+            if (name, transform) not in transformed:
+                transformed[(name, transform)] = TRANSFORMS[transform](np.asarray(self.column(name), dtype=np.float64))
+            return transformed[(name, transform)]
+
+        with profiler.span("residuals", models=len(models)):
+            fitted = np.vstack([model.predict(self.column(model.XColumnName)) for model in models])
+            residuals = y - fitted
+            regressionResiduals = np.vstack([
+                column(self.YColumnName, model.yTransform)
+                - (model.parameters.beta0 + model.parameters.beta1 * column(model.XColumnName, model.xTransform))
+                for model in models])
+            MSE = np.einsum('ij,ij->i', regressionResiduals, regressionResiduals) / (len(y) - 2)
+            return [ModelDiagnostics(model, self.column(model.XColumnName), fitted[i], residuals[i],
+                                     self.leverage(model), regressionResiduals[i], float(MSE[i]))
+                    for i, model in enumerate(models)]
+
+    def residualsVsFit(self, models):
+        """
+        :return: {model: (fitted values, residuals)}
+        """
+        return {result.model: (result.fitted, result.residuals) for result in self.residuals(models)}
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import weakref
+from collections import OrderedDict
+import numpy as np
+from Models import ModelBatch
+from Profiler import profiler
+from StatsVoodoo import Parameters
+
+# bump when what a fit stores (or how it is computed) changes, older entries then just stop matching
+FORMAT_VERSION = 1
+
+# what is kept of a fit, everything else is derived back by Model.initiateFromParameters
+PARAMETER_FIELDS = ["alpha", "n", "xMean", "yMean", "beta0", "beta1", "beta0Interval", "beta1Interval",
+                    "SXX", "SXY", "SYY", "MSE", "SSE", "SSR"]
+VARIANCE_TABLE_FIELDS = ["SSE", "SSR", "n", "F_0"]
+
+
+class FitCache:
+    """
+    Memoizes model fits. A fit is keyed on a content hash of its X and Y columns, the model
+    class (which fixes the column and the transforms) and alpha, so re-running the same
+    analysis on an unchanged data set gets the Parameters and the model state back without
+    refitting. A variance table evaluated on the fitted data is remembered with the fit.
+
+    The last maxEntries fits are kept in memory (least recently used ones are dropped first).
+    With a directory every fit is also written there as a small json file, which later runs
+    (or other processes) pick up.
+
+        cache = FitCache(directory=".fits")
+        cache.fitBatch(dataSet, [Model1(), Model4()])
+    """
+
+    def __init__(self, maxEntries=256, directory=None):
+        self.maxEntries = maxEntries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> state, oldest first
+        self._keys = weakref.WeakKeyDictionary()    # model -> key it was fitted under
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def digest(data):
+        # hash of the values as float64, so the same column read as int or float gives the same key
+        values = np.ascontiguousarray(data, dtype=np.float64)
+        return hashlib.blake2b(memoryview(values).cast('B'), digest_size=16).hexdigest()
+
+    @staticmethod
+    def key(modelClass, xDigest, yDigest, alphaError=0.05):
+        name = f"{modelClass.__module__}.{modelClass.__qualname__}"
+        text = f"{FORMAT_VERSION}|{name}|{alphaError!r}|{xDigest}|{yDigest}"
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def get(self, key):
+        state = self._entries.get(key)
+        if state is not None:
+            self._entries.move_to_end(key)
+            return state
+        state = self.__load(key)
+        if state is not None:
+            self.__remember(key, state)
+        return state
+
+    def put(self, key, state):
+        self.__remember(key, state)
+        if self.directory is not None:
+            path = self.__path(key)
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, 'w') as f:
+                json.dump(state, f)
+            os.replace(temporary, path)     # readers never see a half written file
+
+    def fit(self, model, XData, YData, alphaError=0.05):
+        """
+        Fits one model on XData / YData (its untransformed columns), or restores the fit
+        """
+        key = FitCache.key(type(model), FitCache.digest(XData), FitCache.digest(YData), alphaError)
+        if not self.__restore(model, key):
+            model.initiate(XData, YData, alphaError)
+            self.__store(model, key)
+        return model
+
+    def fitBatch(self, dataSet, models, YColumnName='IR', alphaError=0.05):
+        """
+        Same as ModelBatch(dataSet, YColumnName, alphaError).fit(models), only the models
+        that aren't cached yet are fitted (together, in one ModelBatch)
+        """
+        digests = {}
+
+        def digestOf(columnName):
+            if columnName not in digests:
+                digests[columnName] = FitCache.digest(dataSet[columnName])
+            return digests[columnName]
+
+        missing = []
+        for model in models:
+            key = FitCache.key(type(model), digestOf(model.XColumnName), digestOf(YColumnName), alphaError)
+            if not self.__restore(model, key):
+                missing.append((model, key))
+        if missing:
+            ModelBatch(dataSet, YColumnName, alphaError).fit([model for model, _ in missing])
+            for model, key in missing:
+                self.__store(model, key)
+        return models
+
+    def update(self, model):
+        """
+        Stores the model's state again (e.g. once its variance table was evaluated). A model
+        refitted by a NonlinearFit since is left out, its key is the one of the regression.
+        """
+        key = self._keys.get(model)
+        if key is not None and model.nonlinear is None:
+            self.put(key, FitCache.state(model))
+
+    def clear(self, disk=False):
+        self._entries.clear()
+        if disk and self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def state(model):
+        parameters = model.parameters
+        state = {"parameters": {name: getattr(parameters, name) for name in PARAMETER_FIELDS}}
+        if model.F_0 != -1:
+            state["varianceTable"] = {name: getattr(model, name) for name in VARIANCE_TABLE_FIELDS}
+        return state
+
+    def __restore(self, model, key):
+        state = self.get(key)
+        if state is None:
+            self.misses += 1
+            profiler.count("fit cache misses")
+            return False
+        self.hits += 1
+        profiler.count("fit cache hits")
+        parameters = Parameters(None, None, state["parameters"]["alpha"])
+        for name, value in state["parameters"].items():
+            setattr(parameters, name, value)
+        model.initiateFromParameters(parameters)
+        if "varianceTable" in state:
+            table = state["varianceTable"]
+            model.setVarianceTable(table["SSE"], table["SSR"], table["n"])
+        self._keys[model] = key
+        return True
+
+    def __store(self, model, key):
+        self._keys[model] = key
+        self.put(key, FitCache.state(model))
+
+    def __remember(self, key, state):
+        self._entries[key] = state
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+
+    def __path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def __load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.__path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None     # not there, or unreadable: refit
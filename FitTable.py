@@ -0,0 +1,158 @@
+import json
+import numpy as np
+import Models
+from NonlinearFit import NonlinearParameters
+from StatsVoodoo import Parameters
+
+# one float64 array per scalar result of a fit, the Parameters ones (regression scale) then the
+# model's variance table (original scale of Y, F_0 is -1 until the table was evaluated).
+# The rows of a NonlinearFit (nonlinear = 1) hold its NonlinearParameters instead, in the original
+# scale, and nan for what only a regression has (xMean, yMean, SXX, SXY, SYY)
+PARAMETER_COLUMNS = ["alpha", "n", "xMean", "yMean", "beta0", "beta1", "beta0Interval", "beta1Interval",
+                     "SXX", "SXY", "SYY", "MSE", "SSE", "SSR"]
+VARIANCE_TABLE_COLUMNS = {"tableSSE": "SSE", "tableSSR": "SSR", "tableN": "n", "F_0": "F_0"}
+
+
+class FitTable:
+    """
+    Compact storage of many fitted models, as a struct of arrays: one float64 column per
+    scalar result (ß0, ß1, their intervals, the sums of squares, the errors, F_0...) and the
+    index of the model class, so a fit costs about 150 bytes instead of a Model, its
+    Parameters and their dicts. Nothing of the data is kept.
+
+    Rows are found by position or by the key they were added under, and turned back into
+    regular, fitted Model objects when needed.
+
+        table = FitTable()
+        for material in materials:
+            for model in ModelBatch(frame[frame.M == material]).fit([Model1(), Model4()]):
+                table.append(model, key=(material, type(model).__name__))
+        table.column("beta1"), table.model(table.row((0, "Model4"))).predict(X)
+    """
+
+    def __init__(self, capacity=1024):
+        capacity = max(capacity, 1)
+        names = PARAMETER_COLUMNS + list(VARIANCE_TABLE_COLUMNS) + ["nonlinear"]
+        self.columns = {name: np.empty(capacity) for name in names}
+        self.classes = np.empty(capacity, dtype=np.int32)   # index in self.classNames
+        self.classNames = []
+        self.keys = []
+        self._rows = {}     # key -> row
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, model, key=None):
+        """
+        Stores a fitted model (its variance table too, if evaluated)
+        :return: its row
+        """
+        fit = model.parameters if model.nonlinear is None else model.nonlinear
+        if fit is None:
+            raise Exception(f'{type(model).__name__} is not fitted, there is nothing to store')
+        if key is not None and key in self._rows:
+            raise Exception(f'There already is a fit for {key!r}')
+        if self.size == len(self.classes):
+            self.__grow(2 * self.size)
+        row = self.size
+        for name in PARAMETER_COLUMNS:
+            self.columns[name][row] = getattr(fit, name, np.nan)
+        self.columns["nonlinear"][row] = model.nonlinear is not None
+        for name, attribute in VARIANCE_TABLE_COLUMNS.items():
+            self.columns[name][row] = getattr(model, attribute)
+        className = type(model).__name__
+        if className not in self.classNames:
+            self.classNames.append(className)
+        self.classes[row] = self.classNames.index(className)
+        self.keys.append(key)
+        if key is not None:
+            self._rows[key] = row
+        self.size += 1
+        return row
+
+    def extend(self, models, keys=None):
+        keys = [None] * len(models) if keys is None else keys
+        return [self.append(model, key) for model, key in zip(models, keys)]
+
+    def row(self, key):
+        if key not in self._rows:
+            raise Exception(f'No fit for {key!r}')
+        return self._rows[key]
+
+    def column(self, name):
+        # a read-only view of the stored rows
+        values = self.columns[name][:self.size]
+        values.flags.writeable = False
+        return values
+
+    def className(self, row):
+        return self.classNames[self.classes[row]]
+
+    def parameters(self, row):
+        # Parameters, or NonlinearParameters for a row of a NonlinearFit
+        self.__check(row)
+        if self.columns["nonlinear"][row]:
+            fit = NonlinearParameters(*(float(self.columns[name][row]) for name in NonlinearParameters.__slots__))
+            fit.n = int(fit.n)
+            return fit
+        parameters = Parameters(None, None, float(self.columns["alpha"][row]))
+        for name in PARAMETER_COLUMNS:
+            setattr(parameters, name, float(self.columns[name][row]))
+        parameters.n = int(parameters.n)
+        return parameters
+
+    def model(self, row):
+        """
+        :return: a fitted instance of the stored model class, as if it was just fitted
+        """
+        self.__check(row)
+        model = getattr(Models, self.className(row))()
+        if self.columns["nonlinear"][row]:
+            return self.parameters(row).apply(model)     # with its variance table, but no regression to update
+        model.initiateFromParameters(self.parameters(row))
+        if self.columns["F_0"][row] != -1:
+            model.setVarianceTable(float(self.columns["tableSSE"][row]), float(self.columns["tableSSR"][row]),
+                                   int(self.columns["tableN"][row]))
+        return model
+
+    def models(self):
+        for row in range(self.size):
+            yield self.model(row)
+
+    def save(self, filePath):
+        # keys are stored as json, tuples come back as tuples
+        np.savez(filePath, classes=self.classes[:self.size], classNames=np.array(self.classNames, dtype=str),
+                 keys=np.array([json.dumps(key) for key in self.keys], dtype=str),
+                 **{name: values[:self.size] for name, values in self.columns.items()})
+
+    @staticmethod
+    def load(filePath):
+        with np.load(filePath) as data:
+            table = FitTable(len(data["classes"]))
+            table.size = len(data["classes"])
+            for name in table.columns:
+                # files saved before the nonlinear column only have regressions
+                table.columns[name][:table.size] = data[name] if name in data.files else 0
+            table.classes[:table.size] = data["classes"]
+            table.classNames = data["classNames"].tolist()
+            table.keys = [_tupled(json.loads(key)) for key in data["keys"].tolist()]
+        table._rows = {key: row for row, key in enumerate(table.keys) if key is not None}
+        return table
+
+    def __check(self, row):
+        if not 0 <= row < self.size:
+            raise Exception(f'No row {row}, the table has {self.size}')
+
+    def __grow(self, capacity):
+        for name, values in self.columns.items():
+            grown = np.empty(capacity)
+            grown[:self.size] = values[:self.size]
+            self.columns[name] = grown
+        classes = np.empty(capacity, dtype=np.int32)
+        classes[:self.size] = self.classes[:self.size]
+        self.classes = classes
+
+
+def _tupled(value):
+    return tuple(_tupled(item) for item in value) if isinstance(value, list) else value
@@ -1,21 +1,45 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import seaborn as sn
-import pandas as pd
+from Dataset import Dataset
+from Profiler import profiler
 
 
 class Grapher (ABC):
-
-    def __init__(self, dataFilePath):
+    """
+    Without an outputPath the graph is drawn with pyplot and shown interactively (plt.show()).
+    With an outputPath it is headless: it draws on its own Figure object, never touches the
+    global pyplot state, and is saved straight to the file (the extension picks PNG, SVG...).
+    dataFilePath can be a path or a Dataset handle, the file is only parsed if no handle on it
+    is cached yet.
+    """
+
+    def __init__(self, dataFilePath, outputPath=None):
         self.plot = plt
         self.sns = sn
-        self.data = pd.read_csv(dataFilePath, delimiter=',')
+        self.outputPath = outputPath
+        self.figure = None
+        self.axes = None
+        if outputPath is not None:
+            self.figure = Figure()
+            self.axes = self.figure.add_subplot()
+        self.data = Dataset.open(dataFilePath).frame if dataFilePath is not None else None
 
     @abstractmethod
     def render(self, axisX, axisY, title='', color=''):
         pass
 
     def plotGraph(self, axisX='', axisY='', title=''):
+        if self.figure is not None:
+            self.axes.set_xlabel(axisX)
+            self.axes.set_ylabel(axisY)
+            self.axes.set_title(title)
+            with profiler.span("render", file=self.outputPath):
+                self.figure.savefig(self.outputPath)
+            profiler.count("plots rendered")
+            return
         self.plot.xlabel = axisX
         self.plot.ylabel = axisY
         self.plot.title(title)
@@ -24,30 +48,98 @@ class Grapher (ABC):
 
 class BoxPlot (Grapher):
 
-    def __init__(self, dataFilePath):
-        super().__init__(dataFilePath)
+    def __init__(self, dataFilePath, outputPath=None):
+        super().__init__(dataFilePath, outputPath)
 
     def render(self, axisX, axisY, title='', color=''):
-        self.sns.boxplot(x=axisX, y=axisY, data=self.data)
+        self.sns.boxplot(x=axisX, y=axisY, data=self.data, ax=self.axes)
         self.plotGraph(axisX, axisY, title)
 
 
 class Histogram (Grapher):
 
-    def __init__(self, dataFilePath):
-        super().__init__(dataFilePath)
+    def __init__(self, dataFilePath, outputPath=None):
+        super().__init__(dataFilePath, outputPath)
 
     def render(self, axisX, axisY, title='', color=''):
-        self.sns.displot(data=self.data, x=axisX, bins=10, kde=True)
+        if self.axes is not None:
+            # displot always makes its own pyplot figure, histplot can draw on ours
+            self.sns.histplot(data=self.data, x=axisX, bins=10, kde=True, ax=self.axes)
+        else:
+            self.sns.displot(data=self.data, x=axisX, bins=10, kde=True)
         self.plotGraph(axisX, "count", title)
 
 
 class NormalProbPlot (Grapher):
 
-    def __init__(self, dataFilePath):
-        super().__init__(dataFilePath)
+    def __init__(self, dataFilePath, outputPath=None):
+        super().__init__(dataFilePath, outputPath)
+
+    def render(self, axisX, axisY, title='', color=''):
+        self.sns.scatterplot(x=axisX, y=axisY, data=self.data, ax=self.axes)
+        self.plotGraph(axisX, axisY, title)
+
+
+class ScatterPlot (Grapher):
+
+    def __init__(self, dataFilePath, outputPath=None):
+        super().__init__(dataFilePath, outputPath)
 
     def render(self, axisX, axisY, title='', color=''):
-        self.sns.scatterplot(x=axisX, y=axisY, data=self.data)
+        self.sns.scatterplot(x=axisX, y=axisY, data=self.data, color=color or None, ax=self.axes)
         self.plotGraph(axisX, axisY, title)
 
+
+class RegressionPlot (Grapher):
+    """
+    Data against a model's prediction (Y_hat) and its bounds (Y_upper, Y_lower)
+    """
+
+    def __init__(self, dataFilePath, outputPath=None):
+        super().__init__(dataFilePath, outputPath)
+
+    def render(self, axisX, axisY, title='', color=''):
+        self.sns.scatterplot(data=self.data, y=axisY, x=axisX, color='blue', ax=self.axes)
+        self.sns.scatterplot(data=self.data, y='Y_hat', x=axisX, color='red', ax=self.axes)
+        self.sns.scatterplot(data=self.data, y='Y_upper', x=axisX, color='gray', ax=self.axes)
+        self.sns.scatterplot(data=self.data, y='Y_lower', x=axisX, color='gray', ax=self.axes)
+        self.plotGraph(axisX, axisY, title)
+
+
+class PlotJob:
+    """
+    Everything needed to render one headless graph, small enough to be shipped to a worker process
+    """
+
+    def __init__(self, graphType, data, outputPath, axisX, axisY='', title='', color=''):
+        self.graphType = graphType
+        self.data = data
+        self.outputPath = outputPath
+        self.axisX = axisX
+        self.axisY = axisY
+        self.title = title
+        self.color = color
+
+    def run(self):
+        graph = self.graphType(None, self.outputPath)
+        graph.data = self.data
+        graph.render(self.axisX, self.axisY, self.title, self.color)
+        return self.outputPath
+
+
+def _runPlotJob(job):
+    return job.run()
+
+
+def renderBatch(jobs, processes=None):
+    """
+    Renders a batch of PlotJobs to their files, spread over a process pool
+    (processes=None uses every core, 0 renders them one after the other in this process).
+    :return: the written file paths, in the order of the jobs
+    """
+    jobs = list(jobs)
+    if processes == 0 or len(jobs) <= 1:
+        return [job.run() for job in jobs]
+    # the workers' own render spans aren't collected, only the batch as a whole
+    with profiler.span("render", jobs=len(jobs), processes=processes), ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_runPlotJob, jobs))
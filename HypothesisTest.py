@@ -1,6 +1,12 @@
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
-from scipy.stats import shapiro, t, f
+# scipy.stats is imported inside the tests, it is by far the slowest import of the module
+
+# roughly how many values a block of resamples may hold at once (keeps a block around 100MB)
+RESAMPLE_BLOCK_VALUES = 4_000_000
 
 
 class Hypothesis:
@@ -10,6 +16,7 @@ class Hypothesis:
         self.alpha = alpha
 
     def test(self, dataSet):
+        from scipy.stats import shapiro
         w, pVal = shapiro(dataSet)
         print(w)
         self.isNullHypothesis = pVal > self.alpha
@@ -35,6 +42,7 @@ class Hypothesis:
         tVal = abs(meanY1 - meanY2) / math.sqrt(((stDevY1 ** 2) / (len(dataY1) - 1)) + ((stDevY2 ** 2) / (len(dataY2) - 1)))
 
         # two tailed test
+        from scipy.stats import t
         refTVal = t.ppf(1 - self.alpha/2, len(dataY1) + len(dataY2) - 2)
 
         if tVal > refTVal:
@@ -46,6 +54,7 @@ class Hypothesis:
         return tVal, refTVal
 
     def fTest(self, value, degOfFreedom1, degOfFreedom2):
+        from scipy.stats import f
 
         fDist = 1 - f.cdf(value, degOfFreedom1, degOfFreedom2)
         if fDist < self.alpha:
@@ -54,3 +63,216 @@ class Hypothesis:
             print("Null hypothesis can be rejected")
 
         print(f"got p-value of {fDist}")
+
+    """
+    Resampling alternatives to the normal-theory tests, for skewed data.
+    Resamples are drawn and evaluated in blocks of whole matrices (one row per resample).
+    Every block gets its own child of SeedSequence(seed), and blocks are the same size
+    whatever the number of processes, so a seed gives the same result with or without
+    the process pool (processes=0 runs everything here, None uses every core).
+    """
+    def bootstrapMean(self, data, resamples=10000, seed=None, processes=0):
+        """
+        :return: mean, (lower, upper) percentile bootstrap interval at confidence 1 - alpha
+        """
+        data = np.asarray(data, dtype=np.float64)
+        means = _resample('mean', (data,), len(data), resamples, seed, processes)
+        return float(data.mean()), self.__percentileInterval(means)
+
+    def bootstrapBetas(self, XData, YData, model=None, resamples=10000, seed=None, processes=0):
+        """
+        Pairs bootstrap of the linear regression. With a model its transforms are applied first
+        and ß0 is given in the model's scale (e^B0 for the models fitted on lnY).
+        :return: {"beta0": (lower, upper), "beta1": (lower, upper)}
+        """
+        XData = np.asarray(XData, dtype=np.float64)
+        YData = np.asarray(YData, dtype=np.float64)
+        if model is not None:
+            from Models import TRANSFORMS
+            XData = TRANSFORMS[model.xTransform](XData)
+            YData = TRANSFORMS[model.yTransform](YData)
+        betas = _resample('betas', (XData, YData), len(XData), resamples, seed, processes)
+        if model is not None and model.yTransform == "log":
+            betas[:, 0] = np.exp(betas[:, 0])
+        return {"beta0": self.__percentileInterval(betas[:, 0]), "beta1": self.__percentileInterval(betas[:, 1])}
+
+    def permutationTest(self, dataY1, dataY2, resamples=10000, seed=None, processes=0):
+        """
+        Two sided permutation test of the difference of the means (e.g. m0 against m1).
+        :return: observed difference of the means, p-value
+        """
+        dataY1 = np.asarray(dataY1, dtype=np.float64)
+        dataY2 = np.asarray(dataY2, dtype=np.float64)
+        observed = float(dataY1.mean() - dataY2.mean())
+        pooled = np.concatenate((dataY1, dataY2))
+        differences = _resample('permutation', (pooled, len(dataY1)), len(pooled), resamples, seed, processes)
+        pVal = (np.count_nonzero(np.abs(differences) >= abs(observed)) + 1) / (resamples + 1)
+        self.isNullHypothesis = pVal > self.alpha
+        return observed, float(pVal)
+
+    def batchTest(self, dataSet, columns=None, groupColumn='M', pairs=None, correction='holm', processes=0):
+        """
+        Runs every normality (Shapiro) and mean difference (t) test of a sweep at once, without
+        printing anything, and returns a single pandas DataFrame with one row per test:
+        test, column, group1, group2, statistic, pValue, pAdjusted, reject.
+
+        dataSet is a DataFrame or a 2D array (one column per variable). With a groupColumn each
+        column is tested in every group and between every pair of groups (or only the given
+        pairs); without one the columns themselves are compared two by two.
+        The t statistics are the same as tTest's, computed for every pair in one vectorized
+        operation. The Shapiro tests run over a process pool (processes=0 runs them here).
+        p-values are corrected for multiple testing within each kind of test with
+        correction = 'holm', 'bonferroni', 'fdr_bh' (Benjamini-Hochberg) or None.
+        """
+        import pandas as pd
+        if not isinstance(dataSet, pd.DataFrame):
+            dataSet = pd.DataFrame(np.asarray(dataSet))
+            groupColumn = None
+        if columns is None:
+            columns = [column for column in dataSet.columns if column != groupColumn]
+
+        if groupColumn is None:
+            samples = {(column, None): dataSet[column].to_numpy(dtype=np.float64) for column in columns}
+            pairs = [(a, b) for i, a in enumerate(columns) for b in columns[i + 1:]] if pairs is None else pairs
+            tPairs = [((a, None), (b, None)) for a, b in pairs]
+        else:
+            keys, groupIndex = np.unique(dataSet[groupColumn].to_numpy(), return_inverse=True)
+            order = np.argsort(groupIndex, kind='stable')
+            bounds = np.concatenate(([0], np.cumsum(np.bincount(groupIndex, minlength=len(keys)))))
+            samples = {}
+            for column in columns:
+                values = dataSet[column].to_numpy(dtype=np.float64)[order]
+                for g, key in enumerate(keys.tolist()):
+                    samples[(column, key)] = values[bounds[g]:bounds[g + 1]]
+            keys = keys.tolist()
+            pairs = [(a, b) for i, a in enumerate(keys) for b in keys[i + 1:]] if pairs is None else pairs
+            tPairs = [((column, a), (column, b)) for column in columns for a, b in pairs]
+
+        normality = self.__batchShapiro(samples, processes)
+        normality['pAdjusted'] = adjustPValues(normality['pValue'].to_numpy(), correction)
+        means = self.__batchT(samples, tPairs)
+        means['pAdjusted'] = adjustPValues(means['pValue'].to_numpy(), correction)
+        table = pd.concat([normality, means], ignore_index=True)
+        table['reject'] = table['pAdjusted'] < self.alpha
+        return table
+
+    def __batchShapiro(self, samples, processes):
+        import pandas as pd
+        keys = list(samples)
+        if processes == 0:
+            results = [_shapiro(samples[key]) for key in keys]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_shapiro, [samples[key] for key in keys], chunksize=max(1, len(keys) // 64)))
+        return pd.DataFrame({
+            'test': 'shapiro',
+            'column': [column for column, _ in keys],
+            'group1': [group for _, group in keys],
+            'group2': None,
+            'statistic': [w for w, _ in results],
+            'pValue': [pVal for _, pVal in results],
+        })
+
+    def __batchT(self, samples, tPairs):
+        import pandas as pd
+        from scipy.stats import t
+        keys = list(samples)
+        n = np.array([len(samples[key]) for key in keys], dtype=np.float64)
+        means = np.array([samples[key].mean() if len(samples[key]) else np.nan for key in keys])
+        variances = np.array([samples[key].var(ddof=1) if len(samples[key]) > 1 else np.nan for key in keys])
+        position = {key: i for i, key in enumerate(keys)}
+        first = np.array([position[a] for a, _ in tPairs], dtype=np.intp)
+        second = np.array([position[b] for _, b in tPairs], dtype=np.intp)
+        # same statistic as tTest, for every pair at once
+        tVals = np.abs(means[first] - means[second]) / np.sqrt(variances[first] / (n[first] - 1) + variances[second] / (n[second] - 1))
+        degreesOfFreedom = n[first] + n[second] - 2
+        return pd.DataFrame({
+            'test': 't',
+            'column': [a[0] if a[0] == b[0] else f"{a[0]} - {b[0]}" for a, b in tPairs],
+            'group1': [a[1] for a, _ in tPairs],
+            'group2': [b[1] for _, b in tPairs],
+            'statistic': tVals,
+            'pValue': 2 * t.sf(tVals, degreesOfFreedom),
+        })
+
+    def __percentileInterval(self, values):
+        lower, upper = np.quantile(values, [self.alpha / 2, 1 - self.alpha / 2])
+        return float(lower), float(upper)
+
+
+def _shapiro(data):
+    from scipy.stats import shapiro
+    if len(data) < 3:
+        return math.nan, math.nan
+    w, pVal = shapiro(data)
+    return float(w), float(pVal)
+
+
+def adjustPValues(pValues, correction='holm'):
+    """
+    Multiple testing correction of an array of p-values (NaN are left out of the family)
+    """
+    pValues = np.asarray(pValues, dtype=np.float64)
+    if correction is None or pValues.size == 0:
+        return pValues.copy()
+    adjusted = np.full_like(pValues, np.nan)
+    valid = ~np.isnan(pValues)
+    p = pValues[valid]
+    m = p.size
+    if m == 0:
+        return adjusted
+    if correction == 'bonferroni':
+        adjusted[valid] = np.minimum(p * m, 1)
+        return adjusted
+    order = np.argsort(p)
+    ranked = p[order]
+    if correction == 'holm':
+        stepped = np.minimum(np.maximum.accumulate(ranked * (m - np.arange(m))), 1)
+    elif correction == 'fdr_bh':
+        stepped = np.minimum(np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1], 1)
+    else:
+        raise Exception(f'Unknown correction {correction}')
+    result = np.empty(m)
+    result[order] = stepped
+    adjusted[valid] = result
+    return adjusted
+
+
+def _resample(kind, payload, n, resamples, seed, processes):
+    blockSize = max(1, RESAMPLE_BLOCK_VALUES // max(n, 1))
+    sizes = [min(blockSize, resamples - start) for start in range(0, resamples, blockSize)]
+    blocks = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+    if processes == 0 or len(blocks) == 1:
+        return _resampleBlocks(kind, payload, blocks)
+    # processes=None means every core, like ProcessPoolExecutor, and there is no point in more workers than blocks
+    workers = min(processes or os.cpu_count() or 1, len(blocks))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # contiguous shards keep the blocks, and so the results, in order
+        shards = [blocks[i * len(blocks) // workers:(i + 1) * len(blocks) // workers] for i in range(workers)]
+        results = pool.map(_resampleBlocks, [kind] * workers, [payload] * workers, shards)
+        return np.concatenate([result for result in results if len(result)])
+
+
+def _resampleBlocks(kind, payload, blocks):
+    results = []
+    for seedSequence, size in blocks:
+        rng = np.random.default_rng(seedSequence)
+        if kind == 'mean':
+            data, = payload
+            results.append(data[rng.integers(0, len(data), (size, len(data)))].mean(axis=1))
+        elif kind == 'betas':
+            XData, YData = payload
+            index = rng.integers(0, len(XData), (size, len(XData)))
+            X, Y = XData[index], YData[index]
+            xMean, yMean = X.mean(axis=1), Y.mean(axis=1)
+            X -= xMean[:, None]
+            Y -= yMean[:, None]
+            beta1 = np.einsum('ij,ij->i', X, Y) / np.einsum('ij,ij->i', X, X)
+            results.append(np.column_stack((yMean - xMean * beta1, beta1)))
+        elif kind == 'permutation':
+            pooled, n1 = payload
+            shuffled = rng.permuted(np.tile(pooled, (size, 1)), axis=1)
+            results.append(shuffled[:, :n1].mean(axis=1) - shuffled[:, n1:].mean(axis=1))
+    if not results:
+        return np.empty(0)
+    return np.concatenate(results)
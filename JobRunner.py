@@ -0,0 +1,363 @@
+"""
+Runs a whole analysis described by a spec file instead of an edited main.py:
+
+    {
+        "datasets": ["DevoirD_A23.csv"],
+        "materials": [0, 1],
+        "models": [1, 2, 3, 4, 5, 6],
+        "tasks": ["summary", "fit", "normality", "ttest", "bootstrap"],
+        "output": "results.jsonl"
+    }
+
+The spec (JSON, or YAML when PyYAML is installed) is expanded into independent tasks, one
+per dataset x material x model (fit) or dataset x material (summary, bootstrap) or dataset
+(normality and ttest, every material of the data set at once). The tasks are scheduled on a
+process pool, each with a timeout and a number of retries, and their records are gathered in
+a ResultsSink (and returned).
+
+Other keys: key (column of the materials, "M"), column ("IR"), alpha (0.05), correction
+("holm"), resamples (10000), seed (0), processes (every core, 0 runs everything here),
+timeout (seconds per task attempt, none by default) and retries (0).
+A material can be null for the whole data set, and materials defaults to every class found.
+A Task can also be given a list of materials, their rows are then analyzed together.
+Relative dataset and output paths in a spec file are taken from the file's directory.
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from Profiler import profiler
+
+TASK_KINDS = ("summary", "fit", "normality", "ttest", "bootstrap")
+KILL_GRACE = 1.0    # seconds past its timeout before the worker of a task stuck in a C call is killed
+
+DEFAULTS = {
+    "key": "M", "column": "IR", "materials": None, "models": [1, 2, 3, 4, 5, 6], "tasks": list(TASK_KINDS),
+    "alpha": 0.05, "correction": "holm", "resamples": 10000, "seed": 0,
+    "processes": None, "timeout": None, "retries": 0, "output": None,
+}
+
+
+class Task:
+    """
+    One independent piece of a job, small enough to be sent to a worker process:
+    run() opens the data set there (Dataset caches it for the next tasks of the same worker)
+    and returns plain records, tagged with what the task was about.
+    """
+
+    def __init__(self, kind, dataset, material=None, model=None, options=None):
+        self.kind = kind
+        self.dataset = dataset
+        self.material = material
+        self.model = model
+        self.options = options or {}
+
+    def name(self):
+        parts = [self.kind, os.path.basename(self.dataset)]
+        if self.material is not None:
+            parts.append(f"{self.options['key']}={self.material}")
+        if self.model is not None:
+            parts.append(f"Model{self.model}")
+        return " ".join(parts)
+
+    def tags(self):
+        return {"dataset": self.dataset, "material": self.material}
+
+    def frame(self):
+        from Dataset import Dataset
+        handle = Dataset.open(self.dataset)
+        if self.material is None:
+            return handle.frame
+        if isinstance(self.material, (list, tuple)):
+            # a subset of the materials, pooled together
+            return handle.frame[handle.frame[self.options['key']].isin(self.material)]
+        return handle.where(self.options['key'], self.material)
+
+    def run(self):
+        with profiler.span(self.kind):
+            records = getattr(self, f"_{self.kind}")()
+        for record in records:
+            record.update(self.tags())
+        return records
+
+    def _summary(self):
+        from StatsVoodoo import Stats
+        from ResultsSink import statsRecord
+        stats = Stats(self.options['alpha']).analyze(self.frame()[self.options['column']])
+        record = statsRecord(stats)
+        record["column"] = self.options['column']
+        return [record]
+
+    def _fit(self):
+        import Models
+        from ResultsSink import modelRecords
+        frame = self.frame()
+        model = getattr(Models, f"Model{self.model}")()
+        Models.ModelBatch(frame, self.options['column'], self.options['alpha']).fit([model])
+        model.evaluateVarianceTable(frame[self.options['column']].to_numpy(), frame[model.XColumnName].to_numpy(),
+                                    fittedData=True)
+        return modelRecords(model)
+
+    def _bootstrap(self):
+        from HypothesisTest import Hypothesis
+        mean, (low, high) = Hypothesis(self.options['alpha']).bootstrapMean(
+            self.frame()[self.options['column']], self.options['resamples'], self.options['seed'])
+        return [{"kind": "bootstrap", "column": self.options['column'], "mean": mean, "low": low, "high": high}]
+
+    def _normality(self):
+        return self.__tests("shapiro")
+
+    def _ttest(self):
+        return self.__tests("t")
+
+    def __tests(self, test):
+        from HypothesisTest import Hypothesis
+        key, column = self.options['key'], self.options['column']
+        frame = self.frame()
+        materials = self.options.get('materials')
+        if materials is not None:
+            frame = frame[frame[key].isin([m for m in materials if m is not None])]
+        table = Hypothesis(self.options['alpha']).batchTest(frame[[column, key]], columns=[column], groupColumn=key,
+                                                           correction=self.options['correction'])
+        table = table[table['test'] == test]
+        return [dict(record, kind="test") for record in table.to_dict('records')]
+
+
+def _timeUp(signum, frame):
+    raise TimeoutError('Task timed out')
+
+
+_started = None     # in a JobRunner worker, the queue telling the runner which process runs which task
+
+
+def _initWorker(started):
+    global _started
+    _started = started
+
+
+def _runTask(task, timeout=None, taskId=None):
+    # the timeout is an alarm in the process running the task: python code (and numpy between
+    # two calls) is interrupted, a single long C call only once it returns (a JobRunner then
+    # kills the worker, KILL_GRACE later)
+    if _started is not None and taskId is not None:
+        _started.put((taskId, os.getpid()))
+    if not timeout or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        return task.run()
+    previous = signal.signal(signal.SIGALRM, _timeUp)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return task.run()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _kill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL if hasattr(signal, "SIGKILL") else signal.SIGTERM)
+    except OSError:
+        pass    # it just ended
+
+
+class JobRunner:
+    """
+    Expands a spec into Tasks and runs them, see the top of this file for the spec.
+    run() returns every record gathered; the tasks that still failed after their retries are
+    in self.failures as (task name, error).
+    """
+
+    def __init__(self, spec, progress=True):
+        unknown = set(spec) - set(DEFAULTS) - {"datasets"}
+        if unknown:
+            raise Exception(f'Unknown keys in the spec: {sorted(unknown)}')
+        if not spec.get("datasets"):
+            raise Exception('The spec needs a list of datasets')
+        self.spec = dict(DEFAULTS, **spec)
+        badKinds = set(self.spec["tasks"]) - set(TASK_KINDS)
+        if badKinds:
+            raise Exception(f'Unknown tasks {sorted(badKinds)}, use some of {TASK_KINDS}')
+        self.progress = progress
+        self.failures = []
+
+    @staticmethod
+    def load(filePath):
+        # relative dataset paths are relative to the spec file, not to where it is run from
+        with open(filePath) as f:
+            if filePath.endswith((".yaml", ".yml")):
+                import yaml     # only needed for YAML specs
+                spec = yaml.safe_load(f)
+            else:
+                import json
+                spec = json.load(f)
+        directory = os.path.dirname(os.path.abspath(filePath))
+        spec["datasets"] = [os.path.join(directory, dataset) for dataset in spec.get("datasets") or []]
+        if spec.get("output") is not None:
+            spec["output"] = os.path.join(directory, spec["output"])
+        return spec
+
+    @staticmethod
+    def fromFile(filePath, progress=True):
+        return JobRunner(JobRunner.load(filePath), progress)
+
+    def tasks(self):
+        spec = self.spec
+        options = {name: spec[name] for name in ("key", "column", "alpha", "correction", "resamples", "seed", "materials")}
+        tasks = []
+        for dataset in spec["datasets"]:
+            dataset = os.path.abspath(dataset)
+            materials = spec["materials"]
+            if materials is None:
+                from Dataset import Dataset
+                materials = sorted(Dataset.open(dataset).frame[spec["key"]].unique().tolist())
+            for kind in spec["tasks"]:
+                if kind in ("normality", "ttest"):
+                    tasks.append(Task(kind, dataset, options=options))
+                elif kind == "fit":
+                    tasks.extend(Task(kind, dataset, material, model, options) for material in materials for model in spec["models"])
+                else:
+                    tasks.extend(Task(kind, dataset, material, options=options) for material in materials)
+        return tasks
+
+    def run(self, sink=None):
+        """
+        :param sink: ResultsSink the records are added to as they come, by default the spec's output (if any)
+        """
+        from ResultsSink import ResultsSink
+        spec = self.spec
+        ownSink = sink is None and spec["output"] is not None
+        if ownSink:
+            sink = ResultsSink(spec["output"], tags=("dataset", "material"))
+        tasks = self.tasks()
+        self.failures = []
+        records = []
+        try:
+            processes = spec["processes"]
+            if processes == 0:
+                self.__runHere(tasks, records, sink)
+            else:
+                self.__runInPool(tasks, records, sink, processes or os.cpu_count())
+        finally:
+            if ownSink:
+                sink.close()
+        return records
+
+    def __runHere(self, tasks, records, sink):
+        for done, task in enumerate(tasks, 1):
+            for attempt in range(self.spec["retries"] + 1):
+                start = time.perf_counter()
+                try:
+                    result = _runTask(task, self.spec["timeout"])
+                except Exception as error:
+                    self.__failed(task, attempt, error, done, len(tasks), start)
+                else:
+                    self.__gather(task, result, records, sink, done, len(tasks), start)
+                    break
+
+    def __runInPool(self, tasks, records, sink, processes):
+        timeout = self.spec["timeout"]
+        pending = deque((task, 0) for task in tasks)
+        running = {}    # future -> (task, attempt, submitted at, pool generation, task id)
+        done = 0
+        # the workers say which task they start, so the process of one stuck past its timeout can be killed
+        started = multiprocessing.Queue()
+        workers = {}    # task id -> (pid, started at)
+        killed = {}     # task id -> pool generation, of the tasks whose worker was killed
+
+        def newPool():
+            return ProcessPoolExecutor(max_workers=processes, initializer=_initWorker, initargs=(started,))
+
+        pool, generation = newPool(), 0
+        taskId = 0
+        try:
+            while pending or running:
+                # a few more tasks than workers queued, so no worker waits on this loop
+                while pending and len(running) < 2 * processes:
+                    task, attempt = pending.popleft()
+                    running[pool.submit(_runTask, task, timeout, taskId)] = \
+                        (task, attempt, time.perf_counter(), generation, taskId)
+                    taskId += 1
+                finished, _ = wait(running, timeout=self.__killOverdue(started, workers, killed, running, timeout),
+                                   return_when=FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    task, attempt, start, submittedTo, runningId = running.pop(future)
+                    workers.pop(runningId, None)
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        # the other tasks of a broken pool fail too, it is only replaced once
+                        broken = broken or (isinstance(error, BrokenProcessPool) and submittedTo == generation)
+                        if runningId in killed:
+                            error = TimeoutError(f'Task timed out, its worker was killed after {timeout + KILL_GRACE:g}s')
+                        elif isinstance(error, BrokenProcessPool) and submittedTo in killed.values():
+                            pending.appendleft((task, attempt))     # lost with a killed worker, not its own fault
+                            continue
+                        if attempt < self.spec["retries"]:
+                            self.__failed(task, attempt, error, done, len(tasks), start)
+                            pending.append((task, attempt + 1))
+                        else:
+                            done += 1
+                            self.__failed(task, attempt, error, done, len(tasks), start)
+                    else:
+                        done += 1
+                        self.__gather(task, result, records, sink, done, len(tasks), start)
+                if broken:
+                    # a worker died (killed, out of memory...): the pool can't be used anymore
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool, generation = newPool(), generation + 1
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            started.close()
+
+    @staticmethod
+    def __killOverdue(started, workers, killed, running, timeout):
+        """
+        Kills the worker of every task still running KILL_GRACE after its timeout (its alarm couldn't
+        interrupt it, it is stuck in a C call), which breaks the pool
+        :return: how long to wait before looking again, None without a timeout
+        """
+        while True:
+            try:
+                taskId, pid = started.get_nowait()
+            except queue.Empty:
+                break
+            workers[taskId] = (pid, time.perf_counter())
+        if not timeout:
+            return None
+        now = time.perf_counter()
+        deadlines = []
+        for task, attempt, submitted, generation, taskId in running.values():
+            if taskId not in workers or taskId in killed:
+                continue
+            pid, start = workers[taskId]
+            if now - start > timeout + KILL_GRACE:
+                killed[taskId] = generation
+                _kill(pid)
+            else:
+                deadlines.append(start + timeout + KILL_GRACE)
+        # the tasks not started yet are looked at again soon
+        return min(deadlines, default=now + KILL_GRACE) - now + 0.01
+
+    def __gather(self, task, result, records, sink, done, total, start):
+        records.extend(result)
+        if sink is not None:
+            for record in result:
+                sink.add(record)
+        self.__report(f"[{done}/{total}] {task.name()} ok {time.perf_counter() - start:.2f}s")
+
+    def __failed(self, task, attempt, error, done, total, start):
+        final = attempt >= self.spec["retries"]
+        if final:
+            self.failures.append((task.name(), repr(error)))
+        what = "failed" if final else f"failed (attempt {attempt + 1}, retrying)"
+        self.__report(f"[{done}/{total}] {task.name()} {what} {time.perf_counter() - start:.2f}s: {error!r}")
+
+    def __report(self, line):
+        if self.progress:
+            print(line, file=sys.stderr, flush=True)
@@ -0,0 +1,125 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Models import TRANSFORMS, INVERSE_TRANSFORMS, ModelBatch, HIGHER_IS_BETTER
+from Profiler import profiler
+from Sampling import rowKeys
+
+CRITERIA = ("cvMSE", "press", "SSE", "R2", "aic", "bic")
+
+
+class ModelSelection:
+    """
+    Scores fitted models so that they can be compared and sorted (see Model.__gt__):
+
+        SSE, R2, aic, bic   in-sample, on Y in its original scale (so a log(Y) model is
+                            judged on the same errors as the others)
+        cvMSE               mean squared error of k-fold cross-validation
+        press               leave-one-out sum of squared errors (PRESS)
+
+    Everything is computed per distinct (X, transform, Y transform) regression, not per model.
+    One pass gives the sums of every fold (bincounts over the fold of each row); the fit
+    without fold f is the totals minus fold f, so the k fold fits cost O(1) each, and a single
+    vectorized pass predicts every row with the fit that didn't see it. Leave-one-out comes
+    from the leverage of each row (e / (1 - h) is the exact leave-one-out residual of a
+    linear regression), without any refit at all.
+
+        selection = ModelSelection(dataSet, folds=10, seed=0)
+        best = selection.rank(models, "cvMSE")[0]
+    """
+
+    def __init__(self, dataSet, YColumnName='IR', folds=10, seed=0, alphaError=0.05):
+        self.dataSet = dataSet
+        self.YColumnName = YColumnName
+        self.folds = folds
+        self.seed = seed
+        self.alpha = alphaError
+
+    def foldOf(self):
+        # balanced folds in a seeded random order, rowKeys makes them the same whatever reads the data
+        n = len(self.dataSet)
+        fold = np.empty(n, dtype=np.intp)
+        fold[np.argsort(rowKeys(self.seed, np.arange(n)), kind='stable')] = np.arange(n) % self.folds
+        return fold
+
+    def evaluate(self, models, processes=0):
+        """
+        Fits the models that aren't fitted yet and fills model.scores, for every criterion
+        :param processes: the distinct regressions (the model families) are spread over a
+            process pool, 0 computes them here
+        """
+        unfitted = [model for model in models if model.parameters is None]
+        if unfitted:
+            ModelBatch(self.dataSet, self.YColumnName, self.alpha).fit(unfitted)
+        pairs = list(dict.fromkeys((model.XColumnName, model.xTransform, model.yTransform) for model in models))
+        y = np.asarray(self.dataSet[self.YColumnName], dtype=np.float64)
+        fold = self.foldOf()
+        jobs = [(np.asarray(self.dataSet[column], dtype=np.float64), xTransform, y, yTransform, fold, self.folds)
+                for column, xTransform, yTransform in pairs]
+        with profiler.span("model selection", regressions=len(pairs)):
+            if processes and processes > 1 and len(jobs) > 1:
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    results = list(pool.map(_scoreRegression, *zip(*jobs)))
+            else:
+                results = [_scoreRegression(*job) for job in jobs]
+        scores = dict(zip(pairs, results))
+        for model in models:
+            model.scores = dict(scores[(model.XColumnName, model.xTransform, model.yTransform)])
+        return models
+
+    def rank(self, models, criterion="cvMSE", processes=0):
+        """
+        :return: the models sorted best first on criterion, always scored again on this data set and folds
+            (scores left by an earlier evaluate may be of other data, refitting a model clears them)
+        """
+        if criterion not in CRITERIA:
+            raise Exception(f'Unknown criterion {criterion}, use one of {CRITERIA}')
+        self.evaluate(models, processes)
+        sign = -1 if criterion in HIGHER_IS_BETTER else 1
+        return sorted(models, key=lambda model: sign * model.scores[criterion])
+
+
+def _scoreRegression(X, xTransform, Y, yTransform, fold, folds):
+    # runs in a worker process when there is a pool
+    x = TRANSFORMS[xTransform](X)
+    y = TRANSFORMS[yTransform](Y)
+    inverse = INVERSE_TRANSFORMS[yTransform]
+    n = len(x)
+    # centered once on the global means so the raw sums below don't lose precision
+    x = x - x.mean()
+    yShift = y.mean()
+    y = y - yShift
+
+    def sums(index, count):
+        # n, Σx, Σy, Σx², Σxy of every part
+        return [np.bincount(index, weights=w, minlength=count) for w in (None, x, y, x * x, x * y)]
+
+    nF, sxF, syF, sxxF, sxyF = sums(fold, folds)
+    nT, sxT, syT, sxxT, sxyT = (part.sum() - part for part in (nF, sxF, syF, sxxF, sxyF))
+    # fit without fold f, for every f at once
+    xMean, yMean = sxT / nT, syT / nT
+    beta1 = (sxyT - nT * xMean * yMean) / (sxxT - nT * xMean * xMean)
+    beta0 = yMean - beta1 * xMean
+    heldOut = inverse(beta0[fold] + beta1[fold] * x + yShift)
+    cvErrors = Y - heldOut
+
+    # fit on everything (the data is centered, so its intercept is 0 before the shift)
+    SXX = float(x @ x)
+    slope = float(x @ y) / SXX
+    residuals = y - slope * x
+    fitted = inverse(slope * x + yShift)
+    leverage = 1 / n + x * x / SXX
+    looErrors = Y - inverse(y - residuals / (1 - leverage) + yShift)
+
+    errors = Y - fitted
+    SSE = float(errors @ errors)
+    deviations = Y - Y.mean()
+    parameters = 2
+    return {
+        "SSE": SSE,
+        "R2": 1 - SSE / float(deviations @ deviations),
+        "aic": n * math.log(SSE / n) + 2 * parameters,
+        "bic": n * math.log(SSE / n) + parameters * math.log(n),
+        "cvMSE": float(cvErrors @ cvErrors) / n,
+        "press": float(looErrors @ looErrors),
+    }
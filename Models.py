@@ -1,13 +1,32 @@
 import csv
 import math
 from abc import ABC, abstractmethod
-from StatsVoodoo import Stats, Parameters
+import numpy as np
+from StatsVoodoo import Parameters, SlidingWindowRegression
+from Profiler import profiler
+
+
+# transforms applied to the X and Y columns before the linear regression
+TRANSFORMS = {
+    "identity": lambda data: data,
+    "log": lambda data: np.log(np.abs(data)),
+}
+# back from the regression's scale of Y to the original one
+INVERSE_TRANSFORMS = {
+    "identity": lambda data: data,
+    "log": np.exp,
+}
+
+# the model selection criteria where bigger is better, lower is better for all the others (errors, aic, bic)
+HIGHER_IS_BETTER = {"R2"}
 
 
 class Model(ABC):
+    xTransform = "identity"
+    yTransform = "identity"
+    criterion = "cvMSE"     # what __gt__ compares, one of the scores of ModelSelection
 
     def __init__(self):
-        self.stats = Stats()
         self.parameters = None  # uninitialized
         self.XColumnName = ":)"
         self.beta0 = -1  # uninitialized
@@ -17,13 +36,56 @@ class Model(ABC):
         self.beta0Interval = [-1, -1]   # uninitialized
         self.beta1Interval = [-1, -1]   # uninitialized
         self.SSE = -1   # uninitialized
+        self.SSR = -1   # uninitialized
+        self.n = -1     # uninitialized
         self.F_0 = -1   # uninitialized
-
-    def initiate(self, XData, YData):
-        self.parameters = Parameters(XData=XData, YData=YData)
-        self.parameters.evaluate()
+        self.scores = {}    # criterion -> value, filled by ModelSelection.evaluate
+        self.nonlinear = None   # NonlinearParameters, once fitted by a NonlinearFit
+
+    def initiate(self, XData, YData, alphaError=0.05):
+        with profiler.span("transform", model=type(self).__name__):
+            parameters = Parameters(XData=TRANSFORMS[self.xTransform](np.asarray(XData, dtype=np.float64)),
+                                    YData=TRANSFORMS[self.yTransform](np.asarray(YData, dtype=np.float64)),
+                                    alphaError=alphaError)
+        parameters.evaluate()
+        self.initiateFromParameters(parameters)
+
+    def initiateFromParameters(self, parameters):
+        # parameters must come from a regression on the transformed columns of this model
+        self.parameters = parameters
+        # the variance table, the scores and a NonlinearFit result were of the previous fit, if any
+        self.SSE = self.SSR = self.n = self.F_0 = -1
+        self.scores = {}
+        self.nonlinear = None
         self.beta0Bound = self.parameters.beta0Interval
         self.beta1Bound = self.parameters.beta1Interval
+        self.deriveCoefficients()
+
+    def add(self, XData, YData):
+        """
+        Folds new observations (untransformed) into the fit in O(k), see Parameters.add.
+        The variance table is of the old data, it is reset until evaluated again.
+        """
+        self.__checkRegression()
+        self.parameters.add(TRANSFORMS[self.xTransform](np.asarray(XData, dtype=np.float64)),
+                            TRANSFORMS[self.yTransform](np.asarray(YData, dtype=np.float64)))
+        self.initiateFromParameters(self.parameters)
+
+    def remove(self, XData, YData):
+        self.__checkRegression()
+        self.parameters.remove(TRANSFORMS[self.xTransform](np.asarray(XData, dtype=np.float64)),
+                               TRANSFORMS[self.yTransform](np.asarray(YData, dtype=np.float64)))
+        self.initiateFromParameters(self.parameters)
+
+    def __checkRegression(self):
+        # a NonlinearFit result read back from a FitTable has no regression to update
+        if self.parameters is None:
+            raise Exception(f'{type(self).__name__} has no regression to update')
+
+    @abstractmethod
+    def deriveCoefficients(self):
+        # goes from the regression parameters back to ß0, ß1 and their intervals in the model's own scale
+        pass
 
     @abstractmethod
     def model(self, columnName):
@@ -38,17 +100,43 @@ class Model(ABC):
     def lowerBoundModel(self):
         pass
 
+    """
+    Array API: predict, predictUpper and predictLower take a scalar, a list, a numpy array or a
+    pandas Series of X values and return a numpy array of the same shape, evaluated in one
+    vectorized operation (model(), upperBoundModel() and lowerBoundModel() return these too).
+    """
+    @abstractmethod
+    def predict(self, X):
+        pass
+
+    @abstractmethod
+    def predictUpper(self, X):
+        pass
+
+    @abstractmethod
+    def predictLower(self, X):
+        pass
+
+    def predictGrid(self, start, stop, num=1000):
+        """
+        Evaluates the model and its bounds on a dense, evenly spaced grid (for plotting bands)
+        :return: X, Y, YUpper, YLower
+        """
+        X = np.linspace(start, stop, num)
+        return X, self.predict(X), self.predictUpper(X), self.predictLower(X)
+
     def export(self, filePath):
         data = [
             ["beta0", "beta1", "beta0 interval (+/-)", "beta1 interval (+/-)"],
             [self.beta0, self.beta1, (self.beta0Interval[1] - self.beta0Interval[0]) / 2, (self.beta1Interval[1] - self.beta1Interval[0]) / 2]
         ]
-        with open(filePath, 'w') as f:
+        with profiler.span("export", file=filePath), open(filePath, 'w') as f:
             writer = csv.writer(f)
             # header
             writer.writerow(data[0])
             # rest of the file
             writer.writerow(data[1])
+            profiler.count("bytes written", f.tell())
 
     def exportVarianceTable(self, targetYVals, XVals, filePath=''):
         """
@@ -63,52 +151,94 @@ class Model(ABC):
         |--------------------|------------------|----------------------|-------------------|----------------------|
 
         """
-        modelFunction = self.model(self.XColumnName)
-        self.SSE = sum([(targetYVals[i] - modelFunction(XVals[i])) ** 2 for i in range(len(XVals))])
-        averageY = sum(targetYVals) / len(targetYVals)
-        SSR = sum([(modelFunction(x) - averageY) ** 2 for x in XVals])
-        self.F_0 = SSR / (self.SSE / (len(XVals) - 2))
-        data = [
+        self.evaluateVarianceTable(targetYVals, XVals)
+        self.writeVarianceTable(filePath)
+
+    def evaluateVarianceTable(self, targetYVals, XVals=None, YPred=None, fittedData=False):
+        """
+        Fills SSE, SSR and F_0 (original scale of Y) of the model on targetYVals / XVals, from the
+        predictions (pass YPred when they were already computed). fittedData says these are the
+        data the model was fitted on: when the regression was on the untransformed columns
+        Parameters then already computed them.
+        """
+        if fittedData and self.xTransform == "identity" and self.yTransform == "identity":
+            self.setVarianceTable(self.parameters.SSE, self.parameters.SSR, self.parameters.n)
+            return
+        with profiler.span("variance table", model=type(self).__name__):
+            targetYVals = np.asarray(targetYVals, dtype=np.float64)
+            if YPred is None:
+                YPred = self.model(self.XColumnName)(XVals)
+            residuals = targetYVals - YPred
+            SSE = float(residuals @ residuals)
+            averageY = targetYVals.mean()
+            deviations = YPred - averageY
+            SSR = float(deviations @ deviations)
+        self.setVarianceTable(SSE, SSR, len(targetYVals))
+
+    def setVarianceTable(self, SSE, SSR, n):
+        # SSE and SSR in the original scale of Y (not the regression's, for the log models)
+        self.SSE = SSE
+        self.SSR = SSR
+        self.n = n
+        self.F_0 = SSR / (SSE / (n - 2))
+
+    def varianceTable(self):
+        return [
             ["source de variation", "somme des carrés", "nb de deg de liberté", "moyenne des carrés", "F_0"],
-            ["regression", SSR, 1, SSR, self.F_0],
-            ["résidus", self.SSE, (len(XVals) - 2), self.SSE / (len(XVals) - 2), None],
-            ["total", SSR + self.SSE, (len(XVals) - 1), None, None]
+            ["regression", self.SSR, 1, self.SSR, self.F_0],
+            ["résidus", self.SSE, (self.n - 2), self.SSE / (self.n - 2), None],
+            ["total", self.SSR + self.SSE, (self.n - 1), None, None]
         ]
 
-        with open(filePath, 'w') as f:
+    def writeVarianceTable(self, filePath):
+        data = self.varianceTable()
+        with profiler.span("export", file=filePath), open(filePath, 'w') as f:
             writer = csv.writer(f)
             # header
             writer.writerow(data[0])
             # rest of the file
             for i in range(1, len(data)):
                 writer.writerow(data[i])
+            profiler.count("bytes written", f.tell())
 
 
     def __gt__(self, other):
-        # this is to automate sorting the models eventually
-        pass
+        # a model is greater than another when it fits better on Model.criterion,
+        # so sorted(models, reverse=True) puts the best model first
+        mine, theirs = self.score(), other.score()
+        if self.criterion in HIGHER_IS_BETTER:
+            return mine > theirs
+        return mine < theirs
+
+    def score(self):
+        if self.criterion not in self.scores:
+            raise Exception(f'No {self.criterion} score for {type(self).__name__}, run ModelSelection.evaluate first')
+        return self.scores[self.criterion]
 
 
 class ModelType1(Model, ABC):
+    curve = "linear"    # see NonlinearFit
+
     def __init__(self):
         super().__init__()
 
-    def model(self, columnName):
+    def deriveCoefficients(self):
         """
             Y = ß0 + ß1 * X
             regression gives us directly ß0 and ß1, so nothing to do
         """
-        super().model(columnName)
         self.beta0 = self.parameters.beta0
         self.beta1 = self.parameters.beta1
 
         self.beta0Interval = [self.beta0 - self.beta0Bound, self.beta0 + self.beta0Bound]
         self.beta1Interval = [self.beta1 - self.beta1Bound, self.beta1 + self.beta1Bound]
 
-        def Y(X):
-            return self.beta0 + (self.beta1 * X)
+    def model(self, columnName):
+        super().model(columnName)
+        return self.predict
 
-        return Y
+    def predict(self, X):
+        return self.beta0 + (self.beta1 * np.asarray(X, dtype=np.float64))
 
     def upperBoundModel(self):
         """
@@ -116,7 +246,10 @@ class ModelType1(Model, ABC):
             Y = [ß0 + ß0int] + [ß1 + ß1int] * X
         """
 
-        return lambda X: self.beta0Interval[1] + self.beta1Interval[1] * X
+        return self.predictUpper
+
+    def predictUpper(self, X):
+        return self.beta0Interval[1] + self.beta1Interval[1] * np.asarray(X, dtype=np.float64)
 
     def lowerBoundModel(self):
         """
@@ -124,19 +257,22 @@ class ModelType1(Model, ABC):
             Y = [ß0 - ß0int] + [ß1 - ß1int] * X
         """
 
-        return lambda X: self.beta0Interval[0] + self.beta1Interval[0] * X
+        return self.predictLower
+
+    def predictLower(self, X):
+        return self.beta0Interval[0] + self.beta1Interval[0] * np.asarray(X, dtype=np.float64)
 
 
 class ModelType2(Model, ABC):
+    # lnY = lnß0 + (lnX) * ß1
+    xTransform = "log"
+    yTransform = "log"
+    curve = "power"
+
     def __init__(self):
         super().__init__()
 
-    def initiate(self, XData, YData):
-        lnYData = [math.log(abs(y), math.e) for y in YData]
-        lnXData = [math.log(abs(x), math.e) for x in XData]
-        super().initiate(lnXData, lnYData)
-
-    def model(self, columnName):
+    def deriveCoefficients(self):
         """
             Y = ß0 * X^ß1 * e^𝛆
             lnY = lnß0 + (lnX) * ß1
@@ -147,18 +283,18 @@ class ModelType2(Model, ABC):
             Y = e^lnß0 * X^ß1 * e^𝛆
 
         """
-
-        super().model(columnName)
         self.beta0 = math.e ** self.parameters.beta0
         self.beta1 = self.parameters.beta1
 
         self.beta0Interval = [self.beta0 / self.beta0Bound, self.beta0 * self.beta0Bound]
         self.beta1Interval = [self.beta1 - self.beta1Bound, (self.beta1 + self.beta1Bound)]
 
-        def Y(X):
-            return self.beta0 * (X ** self.beta1)
+    def model(self, columnName):
+        super().model(columnName)
+        return self.predict
 
-        return Y
+    def predict(self, X):
+        return self.beta0 * np.power(np.asarray(X, dtype=np.float64), self.beta1)
 
     def upperBoundModel(self):
         """
@@ -169,7 +305,10 @@ class ModelType2(Model, ABC):
         Y = (ß0 * ß0int) * X ^ (ß1 + ß1int)
         """
 
-        return lambda X: self.beta0Interval[1] * (X ** self.beta1Interval[1])
+        return self.predictUpper
+
+    def predictUpper(self, X):
+        return self.beta0Interval[1] * np.power(np.asarray(X, dtype=np.float64), self.beta1Interval[1])
 
     def lowerBoundModel(self):
         """
@@ -179,19 +318,21 @@ class ModelType2(Model, ABC):
 
             Y = (ß0 / ß0int) * X ^ (ß1 - ß1int)
         """
-        return lambda X: self.beta0Interval[0] * (X ** self.beta1Interval[0])
+        return self.predictLower
+
+    def predictLower(self, X):
+        return self.beta0Interval[0] * np.power(np.asarray(X, dtype=np.float64), self.beta1Interval[0])
 
 
 class ModelType3(Model, ABC):
+    # lnY = lnß0 + (ß1 * X)
+    yTransform = "log"
+    curve = "exponential"
 
     def __init__(self):
         super().__init__()
 
-    def initiate(self, XData, YData):
-        lnYData = [math.log(abs(y), math.e) for y in YData]
-        super().initiate(XData, lnYData)
-
-    def model(self, columnName):
+    def deriveCoefficients(self):
         """
             Y = ß0 * e^(ß1*X + 𝛆)
             lnY = lnß0 + (ß1 * X) + 𝛆
@@ -200,18 +341,18 @@ class ModelType3(Model, ABC):
             ß0 = e^B0, ß1 = B1
 
         """
-
-        super().model(columnName)
         self.beta0 = math.e ** self.parameters.beta0
         self.beta1 = self.parameters.beta1
 
         self.beta0Interval = [self.beta0 / self.beta0Bound, self.beta0 * self.beta0Bound]
         self.beta1Interval = [self.beta1 - self.beta1Bound, self.beta1 + self.beta1Bound]
 
-        def Y(X):
-            return self.beta0 * (math.e ** (self.beta1 * X))
+    def model(self, columnName):
+        super().model(columnName)
+        return self.predict
 
-        return Y
+    def predict(self, X):
+        return self.beta0 * np.exp(self.beta1 * np.asarray(X, dtype=np.float64))
 
     def upperBoundModel(self):
         """
@@ -220,7 +361,10 @@ class ModelType3(Model, ABC):
 
         Y = (ß0 * ß1int) * e^(ß1 + ß1int) * X)
         """
-        return lambda X: self.beta0Interval[1] * (math.e ** (self.beta1Interval[1] * X))
+        return self.predictUpper
+
+    def predictUpper(self, X):
+        return self.beta0Interval[1] * np.exp(self.beta1Interval[1] * np.asarray(X, dtype=np.float64))
 
     def lowerBoundModel(self):
         """
@@ -229,7 +373,76 @@ class ModelType3(Model, ABC):
 
             Y = (ß0 / ß1int) * e^((ß1 - ß1int) * X)
         """
-        return lambda X: self.beta0Interval[0] * (math.e ** (self.beta1Interval[0] * X))
+        return self.predictLower
+
+    def predictLower(self, X):
+        return self.beta0Interval[0] * np.exp(self.beta1Interval[0] * np.asarray(X, dtype=np.float64))
+
+
+class ModelBatch:
+    """
+    Fits many models over the same data set at once.
+    Every (column, transform) pair is computed a single time and reduced to its mean and
+    centered values, then the sums of squares of every model are taken from one matrix
+    product between the distinct X and Y columns. Adding a model that reuses columns and
+    transforms already in the batch costs nothing more than a lookup.
+    """
+    def __init__(self, dataSet, YColumnName='IR', alphaError=0.05):
+        self.dataSet = dataSet
+        self.YColumnName = YColumnName
+        self.alpha = alphaError
+        self._columns = {}  # (columnName, transform) -> (mean, centered values)
+
+    def column(self, columnName, transform="identity"):
+        key = (columnName, transform)
+        if key not in self._columns:
+            with profiler.span("transform", column=columnName, transform=transform):
+                values = TRANSFORMS[transform](np.asarray(self.dataSet[columnName], dtype=np.float64))
+                mean = values.mean()
+                self._columns[key] = (mean, values - mean)
+        return self._columns[key]
+
+    def fit(self, models):
+        xKeys = list(dict.fromkeys((model.XColumnName, model.xTransform) for model in models))
+        yKeys = list(dict.fromkeys((self.YColumnName, model.yTransform) for model in models))
+        xMeans, xCentered = zip(*(self.column(*key) for key in xKeys))
+        yMeans, yCentered = zip(*(self.column(*key) for key in yKeys))
+        xCentered = np.vstack(xCentered)
+        yCentered = np.vstack(yCentered)
+
+        with profiler.span("fit", models=len(models)):
+            # every SXX, SYY and SXY of the batch in one go
+            SXX = np.einsum('ij,ij->i', xCentered, xCentered)
+            SYY = np.einsum('ij,ij->i', yCentered, yCentered)
+            SXY = xCentered @ yCentered.T
+
+            xIndex = np.array([xKeys.index((model.XColumnName, model.xTransform)) for model in models])
+            yIndex = np.array([yKeys.index((self.YColumnName, model.yTransform)) for model in models])
+            fits = Parameters.fromSums(np.full(len(models), xCentered.shape[1]),
+                                       np.asarray(xMeans)[xIndex], np.asarray(yMeans)[yIndex],
+                                       SXX[xIndex], SXY[xIndex, yIndex], SYY[yIndex], self.alpha)
+        profiler.count("rows fitted", xCentered.shape[1] * len(models))
+        for model, parameters in zip(models, fits):
+            model.initiateFromParameters(parameters)
+        return models
+
+
+class ModelWindow:
+    """
+    Keeps a model fitted on the last windowSize observations only, for data that keeps
+    coming in: every add() updates the fit in O(k) (see SlidingWindowRegression).
+    """
+    def __init__(self, model, windowSize, alphaError=0.05):
+        self.model = model
+        self.regression = SlidingWindowRegression(windowSize, alphaError)
+
+    def add(self, XData, YData):
+        model = self.model
+        self.regression.add(TRANSFORMS[model.xTransform](np.atleast_1d(np.asarray(XData, dtype=np.float64))),
+                            TRANSFORMS[model.yTransform](np.atleast_1d(np.asarray(YData, dtype=np.float64))))
+        if self.regression.count > 2:
+            model.initiateFromParameters(self.regression.parameters())
+        return model
 
 
 # Model implementations
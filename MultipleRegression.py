@@ -0,0 +1,263 @@
+import csv
+import itertools
+import math
+import re
+import numpy as np
+from Models import TRANSFORMS
+from Profiler import profiler
+from StatsVoodoo import tQuantile
+
+"""
+Terms are written like the columns they come from: "T", a power "T^2", a transform "log(T)",
+and products of those for interactions: "V*T", "log(V)*T^2". The intercept is always there.
+"""
+FACTOR = re.compile(r"^(?:(\w+)\((\w+)\)|(\w+))(?:\^(\d+))?$")
+
+
+def termValues(dataSet, term):
+    values = None
+    for factor in term.split("*"):
+        match = FACTOR.match(factor.strip())
+        if match is None:
+            raise Exception(f'Can\'t read the term {term}, use e.g. T, T^2, log(T) or V*T')
+        transform, transformed, plain, power = match.groups()
+        if transform is not None and transform not in TRANSFORMS:
+            raise Exception(f'Unknown transform {transform} in {term}, known ones are {list(TRANSFORMS)}')
+        column = np.asarray(dataSet[transformed or plain], dtype=np.float64)
+        column = TRANSFORMS[transform or "identity"](column)
+        if power is not None:
+            column = column ** int(power)
+        values = column if values is None else values * column
+    return values
+
+
+def designMatrix(dataSet, terms):
+    # n x (1 + len(terms)), the intercept column first
+    n = len(dataSet)
+    design = np.empty((n, len(terms) + 1))
+    design[:, 0] = 1.0
+    for j, term in enumerate(terms):
+        design[:, j + 1] = termValues(dataSet, term)
+    return design
+
+
+class MultipleRegression:
+    """
+    Linear regression of Y (optionally transformed, like the Model classes) on several terms:
+
+        Y = ß0 + ß1 * term1 + ... + ßp * termp + 𝛆
+
+    Solved through a QR decomposition of the design matrix rather than the normal equations,
+    so correlated terms (T and T^2...) don't lose half the precision. The intervals and the
+    variance table follow the single variable ones: betaBounds holds the +/- half widths (like
+    Parameters.beta0Interval) and betaIntervals the [low, high] pairs (like Model.beta0Interval).
+    """
+
+    def __init__(self, terms, YColumnName='IR', yTransform="identity", alphaError=0.05):
+        self.terms = list(terms)
+        self.YColumnName = YColumnName
+        self.yTransform = yTransform
+        self.alpha = alphaError
+        self.betas = None   # uninitialized, ß0 first
+        self.betaBounds = None  # uninitialized
+        self.betaIntervals = None   # uninitialized
+        self.n = -1     # uninitialized
+        self.p = len(self.terms)
+        self.SSE = -1   # uninitialized
+        self.SSR = -1   # uninitialized
+        self.MSE = -1   # uninitialized
+        self.F_0 = -1   # uninitialized
+        self.R2 = -1    # uninitialized
+
+    def names(self):
+        return ["intercept"] + self.terms
+
+    def fit(self, dataSet):
+        with profiler.span("fit", terms=len(self.terms)):
+            design = designMatrix(dataSet, self.terms)
+            y = TRANSFORMS[self.yTransform](np.asarray(dataSet[self.YColumnName], dtype=np.float64))
+            self.n = design.shape[0]
+            if self.n <= self.p + 1:
+                raise Exception(f'{self.p + 1} coefficients need more than {self.n} observations')
+            Q, R = np.linalg.qr(design)
+            self.betas = np.linalg.solve(R, Q.T @ y)
+            residuals = y - design @ self.betas
+            self.SSE = float(residuals @ residuals)
+            deviations = y - y.mean()
+            self.SSR = float(deviations @ deviations) - self.SSE
+            # (XᵀX)⁻¹ = R⁻¹ R⁻ᵀ, only its diagonal is needed
+            RInverse = np.linalg.solve(R, np.eye(self.p + 1))
+            self.setStatistics(self.SSE, self.SSR, self.n, (RInverse * RInverse).sum(axis=1))
+        profiler.count("rows fitted", self.n)
+        return self
+
+    def setStatistics(self, SSE, SSR, n, inverseDiagonal):
+        # inverseDiagonal: the diagonal of (XᵀX)⁻¹, what the coefficient variances are made of
+        self.SSE, self.SSR, self.n = SSE, SSR, n
+        self.MSE = SSE / (n - self.p - 1)
+        self.F_0 = (SSR / self.p) / self.MSE if self.p else -1
+        self.R2 = SSR / (SSR + SSE)
+        tVal = tQuantile(1 - self.alpha / 2, n - self.p - 1)
+        self.betaBounds = tVal * np.sqrt(self.MSE * inverseDiagonal)
+        self.betaIntervals = [[float(beta - bound), float(beta + bound)] for beta, bound in zip(self.betas, self.betaBounds)]
+
+    def predict(self, dataSet):
+        # in the scale of the regression (log(Y) for yTransform="log")
+        return designMatrix(dataSet, self.terms) @ self.betas
+
+    def export(self, filePath):
+        with open(filePath, 'w') as f:
+            writer = csv.writer(f)
+            # header
+            writer.writerow(["term", "beta", "beta interval (+/-)"])
+            # rest of the file
+            for name, beta, bound in zip(self.names(), self.betas, self.betaBounds):
+                writer.writerow([name, float(beta), float(bound)])
+
+    def varianceTable(self):
+        residualDf = self.n - self.p - 1
+        return [
+            ["source de variation", "somme des carrés", "nb de deg de liberté", "moyenne des carrés", "F_0"],
+            ["regression", self.SSR, self.p, self.SSR / self.p, self.F_0],
+            ["résidus", self.SSE, residualDf, self.SSE / residualDf, None],
+            ["total", self.SSR + self.SSE, (self.n - 1), None, None]
+        ]
+
+    def writeVarianceTable(self, filePath):
+        data = self.varianceTable()
+        with open(filePath, 'w') as f:
+            writer = csv.writer(f)
+            # header
+            writer.writerow(data[0])
+            # rest of the file
+            for i in range(1, len(data)):
+                writer.writerow(data[i])
+
+
+class ModelSearch:
+    """
+    Compares regressions on every subset of a list of candidate terms. The data is only read
+    once: the centered Gram matrix XᵀX of all the candidates, Xᵀy and yᵀy are accumulated block
+    by block, then any subset is solved from its rows and columns of these, which costs
+    O(k³) for k terms instead of a pass over the n rows. The subsets of a same size are
+    solved together in one stacked np.linalg.solve.
+
+        search = ModelSearch(dataSet, ["V", "T", "V*T", "T^2", "log(T)"], yTransform="log")
+        best = search.search(maxTerms=3, criterion="bic")[0]
+        model = search.model(best["terms"])
+    """
+    CRITERIA = ("bic", "aic", "adjustedR2", "R2", "SSE")
+
+    def __init__(self, dataSet, candidateTerms, YColumnName='IR', yTransform="identity", alphaError=0.05,
+                 blockSize=1_000_000):
+        self.dataSet = dataSet
+        self.terms = list(candidateTerms)
+        self.YColumnName = YColumnName
+        self.yTransform = yTransform
+        self.alpha = alphaError
+        with profiler.span("gram matrix", terms=len(self.terms)):
+            self.__accumulate(blockSize)
+
+    def __accumulate(self, blockSize):
+        # two passes over blocks of rows: the means, then the centered cross products
+        m = len(self.terms)
+        n = len(self.dataSet)
+        if n == 0:
+            raise Exception('No rows to search on')
+
+        def block(start):
+            part = self.dataSet[start:start + blockSize]
+            columns = np.column_stack([termValues(part, term) for term in self.terms] +
+                                      [TRANSFORMS[self.yTransform](np.asarray(part[self.YColumnName], dtype=np.float64))])
+            return columns
+
+        sums = np.zeros(m + 1)
+        for start in range(0, n, blockSize):
+            sums += block(start).sum(axis=0)
+        means = sums / n
+        gram = np.zeros((m + 1, m + 1))
+        for start in range(0, n, blockSize):
+            centered = block(start) - means
+            gram += centered.T @ centered
+
+        self.n = n
+        self.xMeans, self.yMean = means[:m], means[m]
+        self.XtX = gram[:m, :m]
+        self.Xty = gram[:m, m]
+        self.SYY = gram[m, m]
+
+    def evaluate(self, subsets):
+        """
+        Fits every subset (tuples of term indices, all of the same size)
+        :return: betas (ß0 first) and SSE of each subset, as arrays
+        """
+        subsets = np.asarray(subsets, dtype=np.intp).reshape(len(subsets), -1)
+        k = subsets.shape[1]
+        if k == 0:
+            return np.full((len(subsets), 1), self.yMean), np.full(len(subsets), self.SYY)
+        gram = self.XtX[subsets[:, :, None], subsets[:, None, :]]
+        xty = self.Xty[subsets]
+        try:
+            slopes = np.linalg.solve(gram, xty[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            # some subset is collinear (e.g. the same term twice), least squares one by one then
+            slopes = np.stack([np.linalg.lstsq(g, c, rcond=None)[0] for g, c in zip(gram, xty)])
+        SSE = np.maximum(self.SYY - np.einsum('ij,ij->i', slopes, xty), 0.0)
+        intercepts = self.yMean - np.einsum('ij,ij->i', slopes, self.xMeans[subsets])
+        return np.column_stack([intercepts, slopes]), SSE
+
+    def search(self, maxTerms=None, criterion="bic", top=10, required=()):
+        """
+        Evaluates every subset of at most maxTerms candidate terms (always including the
+        required ones) and ranks them on criterion, best first.
+        :return: up to top dicts with the terms, betas, SSE, R2, adjustedR2, aic and bic
+        """
+        if criterion not in self.CRITERIA:
+            raise Exception(f'Unknown criterion {criterion}, use one of {self.CRITERIA}')
+        required = [self.terms.index(term) for term in required]
+        optional = [j for j in range(len(self.terms)) if j not in required]
+        maxTerms = len(self.terms) if maxTerms is None else maxTerms
+
+        results = []
+        for size in range(len(required), maxTerms + 1):
+            subsets = [tuple(required) + combination for combination in itertools.combinations(optional, size - len(required))]
+            if not subsets:
+                continue
+            profiler.count("subsets evaluated", len(subsets))
+            betas, SSE = self.evaluate(subsets)
+            for subset, beta, sse in zip(subsets, betas, SSE):
+                results.append(self.__score(subset, beta, float(sse)))
+
+        sign = -1 if criterion in ("adjustedR2", "R2") else 1
+        results.sort(key=lambda result: sign * result[criterion])
+        return results[:top]
+
+    def __score(self, subset, betas, SSE):
+        n, parameters = self.n, len(subset) + 1
+        SSE = max(SSE, 1e-300)  # a perfect fit would make the logs blow up
+        residualDf = n - parameters
+        return {
+            "terms": [self.terms[j] for j in subset],
+            "betas": betas.tolist(),
+            "SSE": SSE,
+            "R2": 1 - SSE / self.SYY,
+            "adjustedR2": 1 - (SSE / residualDf) / (self.SYY / (n - 1)) if residualDf > 0 else -math.inf,
+            "aic": n * math.log(SSE / n) + 2 * parameters,
+            "bic": n * math.log(SSE / n) + parameters * math.log(n),
+        }
+
+    def model(self, terms):
+        """
+        The MultipleRegression of these terms, with its intervals and variance table taken
+        from the cached Gram matrix (no pass over the data)
+        """
+        subset = [self.terms.index(term) for term in terms]
+        betas, SSE = self.evaluate([subset])
+        regression = MultipleRegression(terms, self.YColumnName, self.yTransform, self.alpha)
+        regression.betas = betas[0]
+        # (XᵀX)⁻¹ of the design with an intercept, from the centered Gram matrix of the terms
+        inverse = np.linalg.inv(self.XtX[np.ix_(subset, subset)]) if subset else np.zeros((0, 0))
+        xMeans = self.xMeans[subset]
+        inverseDiagonal = np.concatenate(([1 / self.n + xMeans @ inverse @ xMeans], np.diag(inverse)))
+        regression.setStatistics(float(SSE[0]), float(self.SYY - SSE[0]), self.n, inverseDiagonal)
+        return regression
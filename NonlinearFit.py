@@ -0,0 +1,231 @@
+import numpy as np
+from Models import TRANSFORMS
+from Profiler import profiler
+from StatsVoodoo import Parameters, tQuantile
+
+
+def curveAndJacobian(shape, u, level, rate):
+    """
+    The curve on u and its two partial derivatives (∂f/∂level, ∂f/∂rate), every row with the
+    level / rate of its own problem:
+        "linear"        f = level + rate * u
+        "exponential"   f = level * e^(rate * u)
+    """
+    if shape == "linear":
+        return level + rate * u, np.ones_like(u), u
+    if shape == "exponential":
+        exponential = np.exp(rate * u)
+        fitted = level * exponential
+        return fitted, exponential, fitted * u
+    raise Exception(f'Unknown curve {shape}, use linear or exponential')
+
+
+class NonlinearParameters:
+    """
+    The result of a NonlinearFit, kept on model.nonlinear next to the log-linear regression it
+    started from (model.parameters): ß0 and ß1 in the model's own scale, the half widths of
+    their intervals, and MSE, SSE and SSR in the original scale of Y
+    """
+    __slots__ = ("alpha", "n", "beta0", "beta1", "beta0Interval", "beta1Interval", "MSE", "SSE", "SSR")
+
+    def __init__(self, alpha, n, beta0, beta1, beta0Interval, beta1Interval, MSE, SSE, SSR):
+        self.alpha = alpha
+        self.n = n
+        self.beta0 = beta0
+        self.beta1 = beta1
+        self.beta0Interval = beta0Interval
+        self.beta1Interval = beta1Interval
+        self.MSE = MSE
+        self.SSE = SSE
+        self.SSR = SSR
+
+    def apply(self, model):
+        # the model then predicts with these ß0 and ß1 (and bounds), and its variance table is this fit's
+        model.nonlinear = self
+        model.beta0, model.beta1 = self.beta0, self.beta1
+        model.beta0Bound, model.beta1Bound = self.beta0Interval, self.beta1Interval
+        model.beta0Interval = [self.beta0 - self.beta0Interval, self.beta0 + self.beta0Interval]
+        model.beta1Interval = [self.beta1 - self.beta1Interval, self.beta1 + self.beta1Interval]
+        model.setVarianceTable(self.SSE, self.SSR, self.n)
+        return model
+
+
+class NonlinearFit:
+    """
+    Least squares of the models directly in the original scale of Y, instead of the linear
+    regression on ln|Y| of ModelType2 (Y = ß0 * X^ß1) and ModelType3 (Y = ß0 * e^(ß1 * X)).
+    That regression minimizes the errors of lnY (so the big values of Y count less), takes
+    the absolute value of negative ones and its bounds on ß0 are multiplicative; here SSE is
+    the one of the variance table, and the intervals are the usual asymptotic ones:
+
+        ßj +/- t(1 - alpha/2, n - 2) * sqrt(MSE * [(JᵀJ)⁻¹]jj), J the Jacobian at the solution
+
+    Every problem (a model, or a model on one group of rows) starts from its log-linear fit,
+    which is usually close, and all of them are solved together by one Levenberg-Marquardt
+    loop per kind of curve: the 2x2 normal equations of every problem come from bincounts over
+    the rows, and are solved in closed form in one array operation. ModelType1 models can be
+    given too, their least squares fit is the usual one.
+
+        NonlinearFit(dataSet).fit([Model2(), Model5()])
+        perMaterial = NonlinearFit(dataSet).fitGroups([Model3, Model6], "M")
+
+    A fitted model predicts with the new ß0 and ß1, its variance table is the one of this fit
+    and model.nonlinear holds the rest of it (NonlinearParameters). model.parameters still is the
+    log-linear regression it started from, which add() / remove() update, going back to that fit.
+    """
+
+    def __init__(self, dataSet, YColumnName='IR', alphaError=0.05, maxIterations=100, tolerance=1e-12):
+        self.dataSet = dataSet
+        self.YColumnName = YColumnName
+        self.alpha = alphaError
+        self.maxIterations = maxIterations
+        self.tolerance = tolerance
+        self.iterations = 0
+        self.unconverged = []   # the models still moving after maxIterations
+
+    def fit(self, models):
+        """
+        Fits the models on the whole data set, in place
+        """
+        n = len(self.dataSet)
+        self.__fitProblems(models, [slice(0, n)] * len(models), lambda column: self.__column(column))
+        return models
+
+    def fitGroups(self, modelClasses, groupColumn='M'):
+        """
+        Fits a model of every class on every group of rows (same value of groupColumn)
+        :return: {group: [fitted models, in the order of modelClasses]}
+        """
+        groupValues = np.asarray(self.dataSet[groupColumn])
+        order = np.argsort(groupValues, kind='stable')
+        groups, starts = np.unique(groupValues[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        fits = {group: [modelClass() for modelClass in modelClasses] for group in groups.tolist()}
+        models, rows = [], []
+        for i, group in enumerate(groups.tolist()):
+            models.extend(fits[group])
+            rows.extend([slice(bounds[i], bounds[i + 1])] * len(modelClasses))
+        sortedColumns = {}
+
+        def column(name):
+            # every column sorted by group once, the rows of a group are then a slice
+            if name not in sortedColumns:
+                sortedColumns[name] = self.__column(name)[order]
+            return sortedColumns[name]
+
+        self.__fitProblems(models, rows, column)
+        return fits
+
+    def __column(self, name):
+        return np.asarray(self.dataSet[name], dtype=np.float64)
+
+    def __fitProblems(self, models, rows, column):
+        self.iterations = 0
+        self.unconverged = []
+        y = column(self.YColumnName)
+        for curve in dict.fromkeys(model.curve for model in models):
+            chosen = [i for i, model in enumerate(models) if model.curve == curve]
+            with profiler.span("fit", curve=curve, problems=len(chosen)):
+                self.__fitCurve(curve, [models[i] for i in chosen], [rows[i] for i in chosen], column, y)
+
+    def __fitCurve(self, curve, models, rows, column, y):
+        X = np.concatenate([column(model.XColumnName)[part] for model, part in zip(models, rows)])
+        Y = np.concatenate([y[part] for part in rows])
+        count = len(models)
+        problem = np.repeat(np.arange(count), [part.stop - part.start for part in rows])
+        n = np.bincount(problem, minlength=count).astype(np.float64)
+        if curve == "power" and np.any(X <= 0):
+            raise Exception('A power model needs X > 0 to be fitted in the original scale')
+
+        def total(weights):
+            return np.bincount(problem, weights=weights, minlength=count)
+
+        # the log-linear fits, the same as the models' usual ones, to start from
+        x = TRANSFORMS[models[0].xTransform](X)
+        logY = TRANSFORMS[models[0].yTransform](Y)
+        xMean, yMean = total(x) / n, total(logY) / n
+        dx, dy = x - xMean[problem], logY - yMean[problem]
+        starts = Parameters.fromSums(n, xMean, yMean, total(dx * dx), total(dx * dy), total(dy * dy), self.alpha)
+        for model, parameters in zip(models, starts):
+            model.initiateFromParameters(parameters)
+        beta0 = np.array([model.beta0 for model in models])
+        beta1 = np.array([model.beta1 for model in models])
+
+        # solved on u = X (or lnX for the power law, X^ß1 = e^(ß1 * lnX)) centered on its mean m in
+        # every problem, so the two parameters barely depend on each other: Y = level * e^(ß1 * (u - m))
+        # with level = ß0 * e^(ß1 * m), or Y = level + ß1 * (u - m) with level = ß0 + ß1 * m
+        shape = "linear" if curve == "linear" else "exponential"
+        u = np.log(X) if curve == "power" else X
+        center = total(u) / n
+        u = u - center[problem]
+        level = beta0 + beta1 * center if shape == "linear" else beta0 * np.exp(beta1 * center)
+
+        level, beta1, SSE, (a, b, c), converged = self.__levenbergMarquardt(shape, u, Y, problem, count, level, beta1)
+        profiler.count("rows fitted", len(Y))
+
+        # asymptotic covariance MSE * (JᵀJ)⁻¹ of (level, ß1), and of ß0 through its gradient g (delta method)
+        MSE = SSE / (n - 2)
+        determinant = a * c - b * b
+        levelVariance, covariance, beta1Variance = MSE * c / determinant, -MSE * b / determinant, MSE * a / determinant
+        if shape == "linear":
+            beta0 = level - beta1 * center
+            gLevel = np.ones(count)
+        else:
+            gLevel = np.exp(-beta1 * center)
+            beta0 = level * gLevel
+        gRate = -center if shape == "linear" else -beta0 * center
+        beta0Variance = gLevel * gLevel * levelVariance + 2 * gLevel * gRate * covariance + gRate * gRate * beta1Variance
+        tVal = np.array([tQuantile(1 - self.alpha / 2, int(size) - 2) for size in n])
+        beta0Bound = tVal * np.sqrt(np.maximum(beta0Variance, 0.0))
+        beta1Bound = tVal * np.sqrt(beta1Variance)
+
+        # the variance table in the original scale
+        fitted = curveAndJacobian(shape, u, level[problem], beta1[problem])[0]
+        deviations = fitted - (total(Y) / n)[problem]
+        SSR = total(deviations * deviations)
+        for i, model in enumerate(models):
+            NonlinearParameters(self.alpha, int(n[i]), float(beta0[i]), float(beta1[i]), float(beta0Bound[i]),
+                                float(beta1Bound[i]), float(MSE[i]), float(SSE[i]), float(SSR[i])).apply(model)
+            if not converged[i]:
+                self.unconverged.append(model)
+
+    def __levenbergMarquardt(self, shape, u, Y, problem, count, level, rate):
+        def total(weights):
+            return np.bincount(problem, weights=weights, minlength=count)
+
+        fitted, j0, j1 = curveAndJacobian(shape, u, level[problem], rate[problem])
+        residuals = Y - fitted
+        SSE = total(residuals * residuals)
+        damping = np.full(count, 1e-3)
+        active = np.ones(count, dtype=bool)
+        for iteration in range(self.maxIterations):
+            # JᵀJ = [[a, b], [b, c]] and Jᵀr of every problem
+            a, b, c = total(j0 * j0), total(j0 * j1), total(j1 * j1)
+            g0, g1 = total(j0 * residuals), total(j1 * residuals)
+            dampedA, dampedC = a * (1 + damping), c * (1 + damping)
+            determinant = dampedA * dampedC - b * b
+            step0 = np.where(active, (dampedC * g0 - b * g1) / determinant, 0.0)
+            step1 = np.where(active, (dampedA * g1 - b * g0) / determinant, 0.0)
+
+            trialLevel, trialRate = level + step0, rate + step1
+            trialFitted, trialJ0, trialJ1 = curveAndJacobian(shape, u, trialLevel[problem], trialRate[problem])
+            trialResiduals = Y - trialFitted
+            trialSSE = total(trialResiduals * trialResiduals)
+            better = active & np.isfinite(trialSSE) & (trialSSE <= SSE)
+
+            # converged once a step no longer lowers SSE noticeably, or can't lower it at all
+            done = better & (SSE - trialSSE <= self.tolerance * SSE)
+            done |= active & ~better & (damping >= 1e12)
+            level, rate = np.where(better, trialLevel, level), np.where(better, trialRate, rate)
+            SSE = np.where(better, trialSSE, SSE)
+            rows = better[problem]
+            fitted = np.where(rows, trialFitted, fitted)
+            j0, j1 = np.where(rows, trialJ0, j0), np.where(rows, trialJ1, j1)
+            residuals = np.where(rows, trialResiduals, residuals)
+            damping = np.where(better, damping / 10, damping * 10)
+            active &= ~done
+            self.iterations = max(self.iterations, iteration + 1)
+            if not active.any():
+                break
+        jacobian = (total(j0 * j0), total(j0 * j1), total(j1 * j1))
+        return level, rate, SSE, jacobian, ~active
@@ -0,0 +1,141 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:
+    # what span() hands out when profiling is off: entering and leaving it does nothing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+
+class Profiler:
+    """
+    Timing spans and counters around the stages of the analysis (loading, transforms, fits,
+    predictions, plots, exports). Off by default, where span() returns a shared do-nothing
+    context manager and count() returns immediately, so the instrumentation costs about one
+    method call per stage.
+
+    Turn it on with the PROBSTATS_PROFILE environment variable (or profiler.enable()).
+    At exit the spans are written as a Chrome trace (chrome://tracing, Perfetto) to the
+    PROBSTATS_PROFILE_OUTPUT file if it is set, otherwise a summary is printed on stderr.
+    Only the spans of this process are recorded, not those of pool workers. The summary counts
+    every span, the trace only has the last maxSpans of them (a server records spans forever).
+
+        with profiler.span("fit", model="Model1"):
+            ...
+        profiler.count("rows", len(data))
+    """
+
+    def __init__(self, enabled=False, maxSpans=100_000):
+        self.enabled = enabled
+        self.spans = deque(maxlen=maxSpans)     # (name, start ns, duration ns, thread id, args), the last ones
+        self.counters = {}
+        self._totals = {}   # span name -> (calls, duration ns), of every span
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters = {}
+            self._totals = {}
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, name, start, duration, args=None):
+        with self._lock:
+            self.spans.append((name, start, duration, threading.get_ident(), args or {}))
+            calls, nanoseconds = self._totals.get(name, (0, 0))
+            self._totals[name] = (calls + 1, nanoseconds + duration)
+
+    def totals(self):
+        """
+        :return: {span name: {"calls", "seconds", "meanSeconds"}}, slowest first
+        """
+        with self._lock:
+            ordered = sorted(self._totals.items(), key=lambda item: -item[1][1])
+        return {name: {"calls": calls, "seconds": nanoseconds / 1e9, "meanSeconds": nanoseconds / 1e9 / calls}
+                for name, (calls, nanoseconds) in ordered}
+
+    def summary(self):
+        lines = [f"{'stage':<40}{'calls':>8}{'total (s)':>12}{'mean (ms)':>12}"]
+        for name, total in self.totals().items():
+            lines.append(f"{name:<40}{total['calls']:>8}{total['seconds']:>12.4f}{total['meanSeconds'] * 1000:>12.3f}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<40}{value:>20}")
+        return "\n".join(lines)
+
+    def dumpJson(self, filePath):
+        with open(filePath, 'w') as f:
+            json.dump({"stages": self.totals(), "counters": self.counters}, f, indent=2)
+
+    def dumpChromeTrace(self, filePath):
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "ts": start / 1000, "dur": duration / 1000,
+                   "pid": pid, "tid": tid, "args": {key: str(value) for key, value in args.items()}}
+                  for name, start, duration, tid, args in self.spans]
+        end = max((start + duration for _, start, duration, _, _ in self.spans), default=time.perf_counter_ns())
+        events += [{"name": name, "ph": "C", "ts": end / 1000, "pid": pid, "args": {name: value}}
+                   for name, value in self.counters.items()]
+        with open(filePath, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+profiler = Profiler(os.environ.get("PROBSTATS_PROFILE", "") not in ("", "0"))
+
+
+@atexit.register
+def _report():
+    if not profiler.enabled or not (profiler.spans or profiler.counters):
+        return
+    output = os.environ.get("PROBSTATS_PROFILE_OUTPUT")
+    if output:
+        if output.endswith(".summary.json"):
+            profiler.dumpJson(output)
+        else:
+            profiler.dumpChromeTrace(output)
+    else:
+        print(profiler.summary(), file=sys.stderr)
@@ -0,0 +1,169 @@
+import json
+import os
+import numpy as np
+from Profiler import profiler
+
+
+# every column a record can have, whatever its kind (the Parquet schema needs them up front)
+FIELDS = [
+    "kind", "model", "XColumnName", "source", "method",
+    "beta0", "beta1", "beta0Low", "beta0High", "beta1Low", "beta1High",
+    "beta0Interval", "beta1Interval", "SXX", "SXY", "SYY", "MSE", "SSE", "SSR", "F_0",
+    "sumOfSquares", "degreesOfFreedom", "meanSquare", "n",
+    "Q1", "median", "Q3", "mean", "stD", "CI",
+    "test", "column", "group1", "group2", "statistic", "pValue", "pAdjusted", "reject", "low", "high",
+]
+
+
+class ResultsSink:
+    """
+    Collects the results of many runs (fits, variance tables, descriptive stats) as flat
+    records and appends them in bulk to a single file instead of a small csv per object.
+    Records are built from the statistics the objects already hold, nothing is recomputed.
+
+    The format follows the extension: JSON Lines (.jsonl, one record per line, appended on
+    every flush) or Parquet (.parquet, one row group per flush, needs pyarrow). Either way an
+    existing file is replaced on the first flush. Tags (the material, a run id...) are extra
+    columns; for Parquet their names must be given up front, material always is one.
+
+        with ResultsSink("results.jsonl") as sink:
+            sink.addModel(model, material=0)
+    """
+
+    def __init__(self, filePath, bufferSize=1000, tags=()):
+        self.filePath = filePath
+        self.bufferSize = bufferSize
+        self.tags = list(dict.fromkeys(["material"] + list(tags)))   # DataInterpreter.evaluateAllModels tags its fits
+        self.fileFormat = "parquet" if filePath.endswith(".parquet") else "jsonl"
+        self.written = 0
+        self._records = []
+        self._parquetWriter = None
+
+    def add(self, record, **tags):
+        if self.fileFormat == "parquet" and not set(tags) <= set(self.tags):
+            raise Exception(f'Unknown tags {set(tags) - set(self.tags)}, declare them in ResultsSink(tags=...)')
+        record.update(tags)
+        self._records.append({key: _plain(value) for key, value in record.items()})
+        if len(self._records) >= self.bufferSize:
+            self.flush()
+
+    def addModel(self, model, **tags):
+        """
+        One "fit" record for the model, plus its three "anova" rows if its variance table was evaluated
+        """
+        for record in modelRecords(model):
+            self.add(record, **tags)
+
+    def addParameters(self, parameters, **tags):
+        self.add(parametersRecord(parameters), **tags)
+
+    def addStats(self, stats, **tags):
+        self.add(statsRecord(stats), **tags)
+
+    def flush(self):
+        if not self._records:
+            return
+        with profiler.span("export", file=self.filePath, records=len(self._records)):
+            if self.fileFormat == "parquet":
+                self.__flushParquet()
+            else:
+                lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in self._records)
+                # the first flush starts the file over, running a job again doesn't duplicate its records
+                with open(self.filePath, 'a' if self.written else 'w', encoding='utf-8') as f:
+                    f.write(lines)
+                profiler.count("bytes written", len(lines.encode('utf-8')))
+        self.written += len(self._records)
+        self._records = []
+
+    def __flushParquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        columns = FIELDS + self.tags
+        if self._parquetWriter is None:
+            types = {"kind": pa.string(), "model": pa.string(), "XColumnName": pa.string(), "source": pa.string(),
+                     "method": pa.string(),
+                     "test": pa.string(), "column": pa.string(), "group1": pa.string(), "group2": pa.string(),
+                     "n": pa.int64(), "degreesOfFreedom": pa.int64(), "reject": pa.bool_()}
+            schema = pa.schema([(name, types.get(name, pa.float64())) for name in FIELDS] +
+                               [(name, pa.string()) for name in self.tags])
+            if os.path.exists(self.filePath):
+                os.remove(self.filePath)    # a Parquet file can't be appended to once closed
+            self._parquetWriter = pq.ParquetWriter(self.filePath, schema)
+        rows = [{name: record.get(name) for name in columns} for record in self._records]
+        for row in rows:
+            for name in self.tags + ["group1", "group2"]:
+                row[name] = None if row[name] is None else str(row[name])
+        self._parquetWriter.write_table(pa.Table.from_pylist(rows, schema=self._parquetWriter.schema))
+
+    def close(self):
+        self.flush()
+        if self._parquetWriter is not None:
+            self._parquetWriter.close()
+            self._parquetWriter = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+# the records on their own, for code that builds them away from the sink (e.g. in a worker process)
+
+def modelRecords(model):
+    # method is "regression", or "nonlinear" for a NonlinearFit (which has no SXX, SXY, SYY)
+    name = type(model).__name__
+    record = {
+        "kind": "fit", "model": name, "XColumnName": model.XColumnName,
+        "beta0": model.beta0, "beta1": model.beta1,
+        "beta0Low": model.beta0Interval[0], "beta0High": model.beta0Interval[1],
+        "beta1Low": model.beta1Interval[0], "beta1High": model.beta1Interval[1],
+        "SSE": model.SSE, "SSR": model.SSR, "F_0": model.F_0,
+    }
+    if model.nonlinear is not None:
+        record.update({"method": "nonlinear", "MSE": model.nonlinear.MSE, "n": model.nonlinear.n})
+    else:
+        parameters = model.parameters
+        record.update({"method": "regression", "SXX": parameters.SXX, "SXY": parameters.SXY, "SYY": parameters.SYY,
+                       "MSE": parameters.MSE, "n": parameters.n})
+    records = [record]
+    if model.F_0 != -1:
+        for source, sumOfSquares, degreesOfFreedom, meanSquare, F_0 in model.varianceTable()[1:]:
+            records.append({
+                "kind": "anova", "model": name, "source": source, "sumOfSquares": sumOfSquares,
+                "degreesOfFreedom": degreesOfFreedom, "meanSquare": meanSquare, "F_0": F_0,
+            })
+    return records
+
+
+def parametersRecord(parameters):
+    return {
+        "kind": "parameters", "beta0": parameters.beta0, "beta1": parameters.beta1,
+        "beta0Interval": parameters.beta0Interval, "beta1Interval": parameters.beta1Interval,
+        "SXX": parameters.SXX, "SXY": parameters.SXY, "SYY": parameters.SYY,
+        "SSE": parameters.SSE, "SSR": parameters.SSR, "MSE": parameters.MSE, "n": parameters.n,
+    }
+
+
+def statsRecord(stats):
+    return {
+        "kind": "stats", "Q1": stats.Q1, "median": stats.median, "Q3": stats.Q3,
+        "mean": stats.mean, "stD": stats.stD, "CI": stats.CI, "n": stats.n,
+    }
+
+
+def _plain(value):
+    # numpy scalars aren't json serializable
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def readResults(filePath):
+    """
+    Reads what a ResultsSink wrote back as a pandas DataFrame
+    """
+    import pandas as pd
+    if filePath.endswith(".parquet"):
+        return pd.read_parquet(filePath)
+    return pd.read_json(filePath, lines=True)
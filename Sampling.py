@@ -0,0 +1,239 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from Dataset import Dataset, DTYPES
+from Profiler import profiler
+
+MAX_KEY = np.iinfo(np.uint64).max
+
+
+def splitmix64(values):
+    # the splitmix64 finalizer, numpy's uint64 arithmetic wraps around like the C version
+    z = np.array(values, dtype=np.uint64, ndmin=1) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def rowKeys(seed, rows):
+    """
+    Random but reproducible priority of every row: a hash of (seed, row index). A sample is the
+    rows with the smallest keys, so it only depends on the seed and the rows, never on how the
+    data was read (chunks, order, number of workers).
+    """
+    return splitmix64(splitmix64(seed % 2 ** 64) ^ np.asarray(rows, dtype=np.uint64))
+
+
+def allocate(counts, n, allocation="proportional"):
+    """
+    Sample size of every stratum: proportional to its size (largest remainders get the rounding),
+    n in each one ("equal"), or a {stratum: size} dict. Never more than the stratum has.
+    """
+    strata = sorted(counts)
+    if isinstance(allocation, dict):
+        return {stratum: min(allocation.get(stratum, 0), counts[stratum]) for stratum in strata}
+    if allocation == "equal":
+        return {stratum: min(n, counts[stratum]) for stratum in strata}
+    if allocation != "proportional":
+        raise Exception(f'Unknown allocation {allocation}, use proportional, equal or a dict')
+    total = sum(counts.values())
+    n = min(n, total)
+    exact = {stratum: n * counts[stratum] / total for stratum in strata}
+    sizes = {stratum: int(exact[stratum]) for stratum in strata}
+    remainders = sorted(strata, key=lambda stratum: sizes[stratum] - exact[stratum])    # stable: ties go to the first strata
+    for stratum in remainders[:n - sum(sizes.values())]:
+        sizes[stratum] += 1
+    return sizes
+
+
+class Sampler:
+    """
+    Seeded subsamples of a csv without loading it and without touching it: one streaming pass
+    keeps, in every stratum, the rows with the smallest rowKeys seen so far (a bottom-k
+    reservoir, so memory is bounded by the sample size plus one block of the file).
+
+    With processes the file is cut into line aligned byte ranges: the workers first count
+    the lines of their range (so every row knows its global index), then sample it, and the
+    partial reservoirs are merged. Since a row's key only depends on the seed and its index,
+    the sample is the same whatever the number of workers, and the same as sampleFrame() on
+    the loaded data set. Row indices are line numbers after the header.
+
+        sample = Sampler("big.csv", seed=2194964).reservoir(205)
+        perMaterial = Sampler("big.csv", seed=1).stratified(1000, "M", processes=8)
+    """
+
+    def __init__(self, filePath, seed=0, blockSize=64 * 2 ** 20, dtypes=None):
+        self.filePath = os.path.abspath(filePath)
+        self.seed = seed
+        self.blockSize = blockSize
+        self.names = list(pd.read_csv(self.filePath, nrows=0).columns)
+        dtypes = DTYPES if dtypes is None else dtypes
+        self.dtypes = {name: dtype for name, dtype in dtypes.items() if name in self.names}
+        with open(self.filePath, 'rb') as f:
+            self.dataStart = len(f.readline())
+        self.size = os.path.getsize(self.filePath)
+
+    def reservoir(self, n, processes=0, outputPath=None):
+        """
+        n rows drawn uniformly without replacement, in file order
+        :param outputPath: a directory where the sample is written as .npy columns, it is then
+            returned memory mapped (see Dataset.readColumns)
+        """
+        return self.stratified(n, None, processes=processes, outputPath=outputPath)
+
+    def stratified(self, n, column='M', allocation="proportional", processes=0, outputPath=None):
+        """
+        A sample of every value of column (see allocate for how n is split), in file order
+        """
+        keep = max(allocation.values()) if isinstance(allocation, dict) else n
+        with profiler.span("sample", file=self.filePath):
+            if processes and processes > 1:
+                partial, counts = self.__sampleInPool(keep, column, processes)
+            else:
+                partial, counts = _sampleRange(self.filePath, self.dataStart, self.size, 0, self.names, self.dtypes,
+                                               self.seed, keep, column, self.blockSize)
+        sizes = {None: min(n, counts.get(None, 0))} if column is None else allocate(counts, n, allocation)
+        return _finish(partial, column, sizes, outputPath)
+
+    def ranges(self, parts):
+        # byte ranges covering the data, each starting at the beginning of a line
+        starts = [self.dataStart + (self.size - self.dataStart) * i // parts for i in range(parts)]
+        with open(self.filePath, 'rb') as f:
+            for i in range(1, parts):
+                f.seek(starts[i] - 1)
+                if f.read(1) != b'\n':
+                    f.readline()
+                starts[i] = max(f.tell(), starts[i - 1])
+        bounds = starts + [self.size]
+        return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i] < bounds[i + 1]]
+
+    def __sampleInPool(self, keep, column, processes):
+        ranges = self.ranges(processes)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            lines = list(pool.map(_countLines, [self.filePath] * len(ranges), *zip(*ranges)))
+            firstRows = np.concatenate(([0], np.cumsum(lines)[:-1])).tolist()
+            futures = [pool.submit(_sampleRange, self.filePath, start, end, firstRow, self.names, self.dtypes,
+                                   self.seed, keep, column, self.blockSize)
+                       for (start, end), firstRow in zip(ranges, firstRows)]
+            partials = [future.result() for future in futures]
+        counts = {}
+        for _, partCounts in partials:
+            for stratum, count in partCounts.items():
+                counts[stratum] = counts.get(stratum, 0) + count
+        merged = _bottom(pd.concat([partial for partial, _ in partials], ignore_index=True), keep, column)
+        return merged, counts
+
+    @staticmethod
+    def sampleFrame(frame, n, seed=0, column=None, allocation="proportional"):
+        """
+        The same sample as Sampler(file, seed) would draw from the file frame was read from
+        """
+        keep = max(allocation.values()) if isinstance(allocation, dict) else n
+        candidates = frame.assign(_row=np.arange(len(frame)), _key=rowKeys(seed, np.arange(len(frame))))
+        counts = _strataCounts(candidates, column)
+        sizes = {None: min(n, len(frame))} if column is None else allocate(counts, n, allocation)
+        return _finish(_bottom(candidates, keep, column), column, sizes)
+
+
+def _strataCounts(frame, column):
+    if column is None:
+        return {None: len(frame)}
+    values, counts = np.unique(frame[column].to_numpy(), return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+
+def _bottom(frame, n, column):
+    # the (at most) n rows with the smallest keys, in every stratum
+    keys = frame['_key'].to_numpy()
+    if column is None:
+        if len(frame) <= n:
+            return frame
+        return frame.iloc[np.argpartition(keys, n - 1)[:n]]
+    strata = frame[column].to_numpy()
+    order = np.lexsort((keys, strata))
+    sortedStrata = strata[order]
+    firsts = np.flatnonzero(np.r_[True, sortedStrata[1:] != sortedStrata[:-1]])
+    rank = np.arange(len(order)) - np.repeat(firsts, np.diff(np.r_[firsts, len(order)]))
+    return frame.iloc[order[rank < n]]
+
+
+def _fold(reservoir, block, n, column):
+    # drops the rows of block that can't make it before concatenating, most of them once the reservoir is full
+    if reservoir is not None and len(reservoir):
+        if column is None:
+            if len(reservoir) >= n:
+                block = block[block['_key'].to_numpy() < reservoir['_key'].max()]
+        else:
+            limits = reservoir.groupby(column)['_key'].agg(['max', 'size'])
+            limits = limits[limits['size'] >= n]['max']
+            if len(limits):
+                position = limits.index.get_indexer(block[column])
+                bound = np.full(len(block), MAX_KEY, dtype=np.uint64)
+                bound[position >= 0] = limits.to_numpy(dtype=np.uint64)[position[position >= 0]]
+                block = block[block['_key'].to_numpy() < bound]
+        block = pd.concat([reservoir, block], ignore_index=True)
+    return _bottom(block, n, column)
+
+
+def _countLines(filePath, start, end):
+    lines = 0
+    with open(filePath, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        last = b'\n'
+        while remaining > 0:
+            block = f.read(min(16 * 2 ** 20, remaining))
+            if not block:
+                break
+            lines += block.count(b'\n')
+            last = block[-1:]
+            remaining -= len(block)
+    return lines + (last != b'\n')    # the last line of a file may have no newline
+
+
+def _sampleRange(filePath, start, end, firstRow, names, dtypes, seed, n, column, blockSize):
+    """
+    Bottom-n reservoir (per stratum) of the lines starting in [start, end), and the number of rows per stratum
+    """
+    reservoir = None
+    counts = {}
+    row = firstRow
+    with open(filePath, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            block = f.read(min(blockSize, end - position))
+            if not block:
+                break
+            if not block.endswith(b'\n') and position + len(block) < end:
+                block += f.readline()   # finish the last line, it starts in this range
+            position += len(block)
+            # blank lines are kept (as all-NaN rows) so the row numbers stay line numbers
+            parsed = pd.read_csv(io.BytesIO(block), header=None, names=names, skip_blank_lines=False)
+            rows = np.arange(row, row + len(parsed))
+            row += len(parsed)
+            present = ~parsed.isna().all(axis=1).to_numpy()
+            parsed = parsed[present].astype(dtypes)
+            parsed['_row'] = rows[present]
+            parsed['_key'] = rowKeys(seed, rows[present])
+            for stratum, count in _strataCounts(parsed, column).items():
+                counts[stratum] = counts.get(stratum, 0) + count
+            reservoir = _fold(reservoir, parsed, n, column)
+    if reservoir is None:
+        reservoir = pd.DataFrame({name: pd.Series(dtype=dtypes.get(name, np.float64)) for name in names}).assign(
+            _row=pd.Series(dtype=np.int64), _key=pd.Series(dtype=np.uint64))
+    return reservoir, counts
+
+
+def _finish(partial, column, sizes, outputPath=None):
+    if column is None:
+        sample = _bottom(partial, sizes[None], None)
+    else:
+        kept = [_bottom(partial[partial[column] == stratum], size, None) for stratum, size in sizes.items() if size]
+        sample = pd.concat(kept) if kept else partial.iloc[:0]
+    sample = sample.sort_values('_row').drop(columns=['_row', '_key']).reset_index(drop=True)
+    if outputPath is None:
+        return sample
+    return Dataset.readColumns(Dataset.writeColumns(sample, outputPath))
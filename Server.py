@@ -0,0 +1,456 @@
+"""
+Local analysis server: keeps the parsed data sets, their material subsets, the fitted models
+and the results of previous queries in memory, so that a query costs the analysis itself
+instead of a python start, the imports, a parse of the csv and every fit.
+
+    python cli.py serve --port 8765                 (or --socket /tmp/probstats.sock)
+
+It speaks HTTP/1.1 with JSON bodies (connections are kept alive), over localhost TCP or a
+Unix socket:
+
+    GET  /health
+    POST /summarize  {"dataset": "DevoirD_A23.csv", "materials": [0, 1], "column": "IR"}
+    POST /fit        {"dataset": ..., "materials": 0, "models": [1, 4], "nonlinear": false}
+    POST /predict    {"dataset": ..., "materials": 0, "model": 4, "x": [38.5, 41], "bounds": true}
+    POST /test       {"dataset": ..., "materials": [0, 1], "kind": "ttest"}   (normality, ttest, bootstrap)
+
+Every query also takes key ("M"), column ("IR") and alpha (0.05); test also takes correction,
+resamples and seed like a JobRunner spec. materials is a class, a list of classes (pooled
+together) or null for the whole data set. The answer is {"records": [...]}, the same records
+as a ResultsSink, or {"error": "..."} with a 4xx/5xx status.
+
+The fits, summaries and the bookkeeping of what is resident run on one thread next to the
+event loop (so the FitCache is only ever used from there), the tests, which are the heavy part
+(Shapiro, bootstrap), are JobRunner Tasks sent to a process pool whose workers keep their own
+Dataset cache. Results are dropped with their data set, when its file changes or it leaves the
+Dataset cache (the Dataset.CACHE_SIZE files used last are kept).
+
+    with Server(port=0).startInThread() as server, Client(port=server.port) as client:
+        client.fit("DevoirD_A23.csv", materials=0, models=[4])
+"""
+import asyncio
+import http.client
+import json
+import os
+import signal
+import socket
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from Profiler import profiler
+
+MAX_BODY = 64 * 2 ** 20
+TEST_KINDS = ("normality", "ttest", "bootstrap")
+QUERY_DEFAULTS = {"key": "M", "column": "IR", "alpha": 0.05, "materials": None}
+TEST_DEFAULTS = {"correction": "holm", "resamples": 10000, "seed": 0}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class Server:
+    """
+    See the top of this file. port=0 picks a free port (read it back from self.port once
+    started), socketPath serves on a Unix socket instead of TCP. processes is the size of
+    the pool running the tests (every core by default, 0 runs them on the server's thread),
+    cacheDirectory a FitCache directory shared with earlier runs.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, socketPath=None, processes=None, cacheDirectory=None,
+                 maxResident=1024, timeout=None):
+        from FitCache import FitCache
+        self.host = host
+        self.port = port
+        self.socketPath = socketPath
+        self.processes = os.cpu_count() if processes is None else processes
+        self.maxResident = maxResident
+        self.timeout = timeout     # seconds per test, see JobRunner
+        self.cache = FitCache(directory=cacheDirectory)
+        self.requests = 0
+        self._resident = weakref.WeakKeyDictionary()  # Dataset -> OrderedDict of what was computed on it
+        self._compute = None    # the thread holding the FitCache
+        self._pool = None
+        self._server = None
+        self._connections = {}  # handler task -> its writer, for the connections still open
+        self._loop = None
+        self._stopped = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    async def start(self):
+        self._compute = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compute")
+        self._compute.submit(_warmUp)
+        if self.processes:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        if self.socketPath is not None:
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)  # left by a server that didn't stop cleanly
+            self._server = await asyncio.start_unix_server(self.__connection, path=self.socketPath)
+        else:
+            self._server = await asyncio.start_server(self.__connection, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        # kept alive connections are closed so their handlers end on their own instead of being cancelled
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._compute.shutdown(wait=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        if self.socketPath is not None and os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+
+    def address(self):
+        return self.socketPath if self.socketPath is not None else f"http://{self.host}:{self.port}"
+
+    def serveForever(self):
+        asyncio.run(self.__serve())
+
+    async def __serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        await self.start()
+        if threading.current_thread() is threading.main_thread():
+            self._loop.add_signal_handler(signal.SIGTERM, self._stopped.set)
+        self._ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.stop()
+
+    def startInThread(self):
+        """
+        Serves from a background thread (for tests and notebooks), until shutdown()
+        """
+        self._thread = threading.Thread(target=self.serveForever, name="server", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.shutdown()
+
+    async def __connection(self, reader, writer):
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                try:
+                    request = await _readRequest(reader)
+                except _BadRequest as error:
+                    writer.write(_response(error.status, {"error": str(error)}, keepAlive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.__dispatch(method, path, body)
+                keepAlive = headers.get("connection", "").lower() != "close"
+                writer.write(_response(status, payload, keepAlive))
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass    # the client went away
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+    async def __dispatch(self, method, path, body):
+        self.requests += 1
+        profiler.count("requests")
+        route = path.split("?", 1)[0].strip("/")
+        if method == "GET" and route == "health":
+            return 200, {"status": "ok", "requests": self.requests, "datasets": len(self._resident),
+                         "resident": sum(len(entries) for entries in self._resident.values())}
+        handler = {"summarize": self.summarize, "fit": self.fit, "predict": self.predict, "test": self.test}.get(route)
+        if method != "POST" or handler is None:
+            return 404, {"error": f"No {method} /{route}, see Server.py for the queries"}
+        try:
+            query = json.loads(body or b"{}")
+            if not isinstance(query, dict):
+                raise Exception('The body must be a JSON object')
+            with profiler.span("request", route=route):
+                records = await handler(dict(QUERY_DEFAULTS, **query))
+        except (ValueError, KeyError, TypeError, OSError) as error:
+            return 400, {"error": f"{type(error).__name__}: {error}"}
+        except BrokenProcessPool as error:
+            # a worker died, the next tests get a new pool
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+            return 500, {"error": repr(error)}
+        except Exception as error:
+            # the analysis code reports what's wrong with what it was given as plain Exceptions
+            status = 400 if type(error) is Exception else 500
+            return status, {"error": str(error) if status == 400 else repr(error)}
+        return 200, {"records": records}
+
+    async def summarize(self, query):
+        handle, materials, frame = await self.__subset(query)
+        key = ("summary", query["key"], materials, query["column"], query["alpha"])
+        record = await self.__resident(handle, key, self.__summary, frame, query)
+        return [dict(record, **_tags(handle, materials))]
+
+    def __summary(self, frame, query):
+        from StatsVoodoo import Stats
+        from ResultsSink import statsRecord
+        record = statsRecord(Stats(query["alpha"]).analyze(frame[query["column"]]))
+        record["column"] = query["column"]
+        return record
+
+    async def fit(self, query):
+        handle, materials, models = await self.__models(query, query.get("models", [1, 2, 3, 4, 5, 6]))
+        from ResultsSink import modelRecords
+        tags = _tags(handle, materials)
+        return [dict(record, **tags) for model in models for record in modelRecords(model)]
+
+    async def predict(self, query):
+        if "model" not in query or "x" not in query:
+            raise Exception('predict needs a model (1 to 6) and x values')
+        handle, materials, (model,) = await self.__models(query, [query["model"]])
+        X = np.asarray(query["x"], dtype=np.float64)
+        record = {"kind": "predict", "model": type(model).__name__, "XColumnName": model.XColumnName,
+                  "x": X.tolist(), "y": model.predict(X).tolist()}
+        if query.get("bounds"):
+            record["low"] = model.predictLower(X).tolist()
+            record["high"] = model.predictUpper(X).tolist()
+        return [dict(record, **_tags(handle, materials))]
+
+    async def test(self, query):
+        from JobRunner import Task, _runTask
+        kind = query.get("kind")
+        if kind not in TEST_KINDS:
+            raise Exception(f'Unknown test {kind}, use one of {TEST_KINDS}')
+        query = dict(TEST_DEFAULTS, **query)
+        handle, materials, frame = await self.__subset(query)
+        options = {name: query[name] for name in ("key", "column", "alpha", "correction", "resamples", "seed")}
+        options["materials"] = None if materials is None else list(materials)
+        # a bootstrap is of the pooled subset, normality and ttest are per material of the subset
+        task = Task(kind, handle.path, options["materials"] if kind == "bootstrap" else None, options=options)
+        key = ("test", kind, materials) + tuple(query[name] for name in ("key", "column", "alpha", "correction", "resamples", "seed"))
+        records = await self.__resident(handle, key, _runTask, task, self.timeout,
+                                        executor=self._pool if self._pool is not None else self._compute)
+        return [dict(record, **_tags(handle, materials)) for record in records]
+
+    async def __subset(self, query):
+        from Dataset import Dataset
+        if not query.get("dataset"):
+            raise Exception('Every query needs a dataset')
+        loop = asyncio.get_running_loop()
+        # parsed on the compute thread the first time, then Dataset.open is only a stat of the file
+        handle = await loop.run_in_executor(self._compute, Dataset.open, query["dataset"])
+        materials = _materials(query["materials"])
+        frame = await self.__resident(handle, ("subset", query["key"], materials), _subsetOf, handle, query["key"], materials)
+        if len(frame) == 0:
+            raise Exception(f'No rows with {query["key"]} in {list(materials)}')
+        return handle, materials, frame
+
+    async def __models(self, query, numbers):
+        import Models
+        numbers = [numbers] if isinstance(numbers, int) else list(numbers)
+        for number in numbers:
+            if not hasattr(Models, f"Model{number}"):
+                raise Exception(f'Unknown model {number}, use 1 to 6')
+        handle, materials, frame = await self.__subset(query)
+        options = (query["key"], materials, query["column"], query["alpha"], bool(query.get("nonlinear")))
+        resident = self.__entries(handle)
+        missing = [number for number in dict.fromkeys(numbers) if ("model", number) + options not in resident]
+        if missing:
+            loop = asyncio.get_running_loop()
+            fitted = await loop.run_in_executor(self._compute, self.__fitModels, frame, missing, query)
+            for number, model in zip(missing, fitted):
+                self.__remember(resident, ("model", number) + options, model)
+        models = []
+        for number in numbers:
+            resident.move_to_end(("model", number) + options)
+            models.append(resident[("model", number) + options])
+        return handle, materials, models
+
+    def __fitModels(self, frame, numbers, query):
+        # on the compute thread: the only one using self.cache
+        import Models
+        column, alpha = query["column"], query["alpha"]
+        models = [getattr(Models, f"Model{number}")() for number in numbers]
+        if query.get("nonlinear"):
+            from NonlinearFit import NonlinearFit
+            return NonlinearFit(frame, column, alpha).fit(models)
+        self.cache.fitBatch(frame, models, column, alpha)
+        Y = frame[column].to_numpy()
+        for model in models:
+            if model.F_0 == -1:
+                model.evaluateVarianceTable(Y, frame[model.XColumnName].to_numpy(), fittedData=True)
+                self.cache.update(model)
+        return models
+
+    async def __resident(self, handle, key, compute, *args, executor=None):
+        # what was computed on handle for key, or compute(*args) on the compute thread (or executor)
+        resident = self.__entries(handle)
+        if key not in resident:
+            loop = asyncio.get_running_loop()
+            value = await loop.run_in_executor(executor or self._compute, compute, *args)
+            self.__remember(resident, key, value)
+        resident.move_to_end(key)
+        return resident[key]
+
+    def __entries(self, handle):
+        if handle not in self._resident:
+            self._resident[handle] = OrderedDict()
+        return self._resident[handle]
+
+    def __remember(self, resident, key, value):
+        resident[key] = value
+        resident.move_to_end(key)
+        while len(resident) > self.maxResident:
+            resident.popitem(last=False)
+
+
+def _warmUp():
+    # the slow imports are done while waiting for the first query, not during it
+    import Models, ResultsSink, FitCache, JobRunner
+    from scipy.stats import t
+
+
+def _materials(materials):
+    # null, a class or a list of classes, as a hashable key
+    if materials is None:
+        return None
+    if isinstance(materials, (list, tuple)):
+        return tuple(sorted(set(materials)))
+    return (materials,)
+
+
+def _subsetOf(handle, key, materials):
+    if materials is None:
+        return handle.frame
+    if len(materials) == 1:
+        return handle.where(key, materials[0])
+    return handle.frame[handle.frame[key].isin(materials)]
+
+
+def _tags(handle, materials):
+    return {"dataset": handle.path, "material": None if materials is None else list(materials)}
+
+
+class _BadRequest(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+async def _readRequest(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise _BadRequest('Not an HTTP request')
+    method, path, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise _BadRequest('Bad Content-Length')
+    if length > MAX_BODY:
+        raise _BadRequest(f'Bodies are limited to {MAX_BODY} bytes', 413)
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def _json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _response(status, payload, keepAlive=True):
+    body = json.dumps(payload, default=_json).encode()
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keepAlive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socketPath, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+
+class Client:
+    """
+    Minimal blocking client of a Server, on one kept alive connection:
+
+        with Client(port=8765) as client:
+            client.summarize("DevoirD_A23.csv", materials=[0, 1])
+            client.predict("DevoirD_A23.csv", model=4, x=[38.5, 41.0], materials=0)
+
+    Every call returns the records of the answer, an error answer raises an Exception.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, socketPath=None, timeout=60):
+        if socketPath is not None:
+            self.connection = _UnixConnection(socketPath, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, route, query=None):
+        if query is None:
+            self.connection.request("GET", f"/{route}")
+        else:
+            self.connection.request("POST", f"/{route}", body=json.dumps(query, default=_json),
+                                    headers={"Content-Type": "application/json"})
+        response = self.connection.getresponse()
+        payload = json.loads(response.read() or b"{}")
+        if response.status != 200:
+            raise Exception(f'{response.status} from /{route}: {payload.get("error")}')
+        return payload
+
+    def health(self):
+        return self.request("health")
+
+    def summarize(self, dataset, **options):
+        return self.request("summarize", dict(options, dataset=dataset))["records"]
+
+    def fit(self, dataset, **options):
+        return self.request("fit", dict(options, dataset=dataset))["records"]
+
+    def predict(self, dataset, model, x, **options):
+        return self.request("predict", dict(options, dataset=dataset, model=model, x=x))["records"]
+
+    def test(self, dataset, kind, **options):
+        return self.request("test", dict(options, dataset=dataset, kind=kind))["records"]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
@@ -1,12 +1,105 @@
 import csv
 import math
-from scipy.stats import t
+from functools import lru_cache
+import numpy as np
+from Profiler import profiler
+
+class QuantileSketch:
+    """
+    Bounded-memory, mergeable quantile sketch (a merging t-digest).
+    Values are buffered and periodically collapsed into at most ~compression centroids,
+    small ones near the tails and big ones around the median, so Q1/median/Q3 stay accurate
+    without ever holding the whole column. Two sketches built on different shards can be
+    merged and give (approximately) the same answer as one sketch fed with everything.
+    """
+    def __init__(self, compression=200, bufferSize=5000):
+        # roughly `compression` centroids are kept once more than `bufferSize` values were seen
+        self.compression = compression
+        self.bufferSize = bufferSize
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+        self._buffered = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return self
+        self.count += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._buffer.append(values)
+        self._buffered += values.size
+        if self._buffered >= self.bufferSize:
+            self.compress()
+        return self
+
+    def merge(self, other):
+        self.compress()
+        other.compress()
+        self.means = np.concatenate((self.means, other.means))
+        self.weights = np.concatenate((self.weights, other.weights))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._absorb(self.means, self.weights)
+        return self
+
+    def isExact(self):
+        # as long as nothing was ever collapsed every centroid is a single data point
+        return self.count <= self.bufferSize and bool(np.all(self.weights == 1))
+
+    def compress(self):
+        if self._buffered == 0:
+            return
+        buffered = np.concatenate(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._absorb(np.concatenate((self.means, buffered)),
+                     np.concatenate((self.weights, np.ones(buffered.size))))
+
+    def _absorb(self, means, weights):
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        if self.count <= self.bufferSize:
+            # still small enough to keep every point, keeps small data sets exact
+            self.means, self.weights = means, weights
+            return
+        total = weights.sum()
+        # k1 scale function: k(q) = δ/π * asin(2q - 1), every centroid spans at most one unit of k
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = (self.compression / math.pi) * np.arcsin(2 * q - 1)
+        groups = np.floor(k - k[0]).astype(np.int64)
+        newWeights = np.bincount(groups, weights=weights)
+        keep = newWeights > 0
+        self.means = (np.bincount(groups, weights=means * weights)[keep]) / newWeights[keep]
+        self.weights = newWeights[keep]
+
+    def sortedValues(self):
+        self.compress()
+        return self.means
+
+    def quantile(self, q):
+        self.compress()
+        if self.count == 0:
+            raise Exception('Cannot take a quantile of an empty sketch')
+        cumulative = np.cumsum(self.weights)
+        centers = cumulative - self.weights / 2
+        # anchor the ends on the true extremes
+        xp = np.concatenate(([0.0], centers, [float(self.count)]))
+        fp = np.concatenate(([self.min], self.means, [self.max]))
+        return np.interp(np.asarray(q, dtype=np.float64) * self.count, xp, fp)
+
 
 class Stats:
 
     def __init__(self, alphaError=0.05, dataloc=''):
         self.location = dataloc
         self.alpha = alphaError
+        self.n = 0  # number of observations seen so far
         self.mean = -1  # uninitialized
         self.variance = 0   # uninitialized
         self.stD = 0    # standard deviation, uninitialized
@@ -14,27 +107,152 @@ class Stats:
         self.median = -1    # uninitialized
         self.Q3 = -1    # uninitialized
         self.CI = -1    # confidence interval, uninitialized
+        self.sketch = None  # quantile sketch, only used in online mode
+        self._M2 = 0.0   # running sum of squared deviations (Welford), only used in online mode
 
-    def analyze(self, data):
-        self.mean = sum(data) / len(data)
-        self.variance = sum([(dataPoint - self.mean) ** 2 for dataPoint in data]) / (len(data) - 1) # n-1 degrees of freedom
+    def analyze(self, data, sortedData=None, keep=False):
+        # sortedData: the same data already sorted (e.g. Dataset.sortedColumn), the quartiles are then read off it
+        # keep: also fold the data into a sketch, so that update() / merge() can continue the analysis later
+        data = np.asarray(data, dtype=np.float64)
+        self.n = len(data)
+        self.mean = float(data.mean())
+        deviations = data - self.mean
+        self._M2 = float(deviations @ deviations)
+        self.variance = self._M2 / (len(data) - 1) # n-1 degrees of freedom
         self.stD = math.sqrt(self.variance)
         # confidence interval is calculated as Zscore * std/sqrt(n)
         # confidence level of 95% is given by a Zscore of 1.96
         self.CI = 1.96 * (self.stD / math.sqrt(len(data)))
-        sortedData = sorted(data)
-        if len(data) % 2 == 0:
-            self.median = (sortedData[(len(data) // 2) - 1] + sortedData[len(data)//2]) / 2
-            self.Q1 = (sortedData[(len(data) // 4) - 1] + sortedData[len(data) //4]) / 2
-            self.Q3 = (sortedData[(3 * len(data)) // 4 - 1] + sortedData[(3 * len(data)) // 4]) / 2
+        if sortedData is not None:
+            self.Q1, self.median, self.Q3 = (float(q) for q in Stats.quartilesOfSorted(sortedData))
+        else:
+            self.Q1, self.median, self.Q3 = Stats.quartiles(data)
+        # nothing of the data is held on to, and analyze() alone doesn't pay for a sketch
+        self.sketch = QuantileSketch().add(data) if keep else None
+
+        return self
+
+    @staticmethod
+    def quartiles(data):
+        """
+        Same Q1, median and Q3 as quartilesOfSorted, but with one partition (O(n) selection)
+        of the few order statistics they need instead of sorting the whole column
+        """
+        data = np.asarray(data, dtype=np.float64)
+        n = len(data)
+        if n % 2 == 0:
+            ranks = [n // 4 - 1, n // 4, n // 2 - 1, n // 2, (3 * n) // 4 - 1, (3 * n) // 4]
+        else:
+            ranks = [n // 4, n // 2, (3 * n) // 4]
+        ranks = [rank % n for rank in ranks]    # python-style wrap around, like the sorted list for tiny n
+        selected = Stats.orderStatistics(data, ranks)
+        values = [selected[rank] for rank in ranks]
+        if n % 2 == 0:
+            return (values[0] + values[1]) / 2, (values[2] + values[3]) / 2, (values[4] + values[5]) / 2
+        return values[0], values[1], values[2]
+
+    @staticmethod
+    def orderStatistics(data, ranks):
+        """
+        The values of the given ranks in sorted order, {rank: value}, found by nested selection:
+        partition around the middle rank, then only look for the smaller ranks left of it and
+        the bigger ones right of it (np.partition with several kth is much slower than this)
+        """
+        found = {}
+
+        def select(values, offset, wanted):
+            if not wanted:
+                return
+            if wanted[-1] - offset == len(values) - 1 and len(wanted) == 1:
+                found[wanted[0]] = float(values.max())  # the largest left, typically the lower of two middle values
+                return
+            middle = wanted[len(wanted) // 2]
+            k = middle - offset
+            values.partition(k)     # in place, the two sides below are views of the same copy
+            found[middle] = float(values[k])
+            select(values[:k], offset, wanted[:len(wanted) // 2])
+            select(values[k + 1:], middle + 1, wanted[len(wanted) // 2 + 1:])
+
+        select(np.array(data, dtype=np.float64), 0, sorted(set(ranks)))
+        return found
+
+    @staticmethod
+    def quantiles(data, qs):
+        """
+        Any number of quantiles (linear interpolation between order statistics) in one call,
+        numpy partitions once around all of them instead of sorting
+        """
+        return np.quantile(np.asarray(data, dtype=np.float64), qs)
+
+    @staticmethod
+    def quartilesOfSorted(sortedData):
+        if len(sortedData) % 2 == 0:
+            median = (sortedData[(len(sortedData) // 2) - 1] + sortedData[len(sortedData)//2]) / 2
+            Q1 = (sortedData[(len(sortedData) // 4) - 1] + sortedData[len(sortedData) //4]) / 2
+            Q3 = (sortedData[(3 * len(sortedData)) // 4 - 1] + sortedData[(3 * len(sortedData)) // 4]) / 2
         else:
-            self.median = sortedData[len(data) // 2]
-            self.Q1 = sortedData[len(data) // 4]
-            self.Q3 = sortedData[(3 * len(data)) // 4]
+            median = sortedData[len(sortedData) // 2]
+            Q1 = sortedData[len(sortedData) // 4]
+            Q3 = sortedData[(3 * len(sortedData)) // 4]
+        return Q1, median, Q3
 
+    """
+    Online mode: feed the data chunk by chunk with update() instead of analyze().
+    Mean and variance are kept with Welford/Chan running moments and the quartiles with a
+    QuantileSketch, so memory stays bounded whatever the size of the column. Partial Stats
+    from different workers can be combined with merge(), and so can an analyze(data, keep=True).
+    """
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64).ravel()
+        if chunk.size == 0:
+            return self
+        self.__sketch()
+        chunkMean = float(chunk.mean())
+        chunkM2 = float(((chunk - chunkMean) ** 2).sum())
+        self.__combineMoments(chunk.size, chunkMean, chunkM2)
+        self.sketch.add(chunk)
+        self.__summarize()
+        return self
 
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        otherSketch = other.__sketch()
+        if self.n == 0:
+            self.sketch = QuantileSketch(otherSketch.compression, otherSketch.bufferSize)
+        self.__sketch().merge(otherSketch)
+        self.__combineMoments(other.n, other.mean, other._M2)
+        self.__summarize()
         return self
 
+    def __sketch(self):
+        # the sketch of everything seen so far
+        if self.sketch is None:
+            if self.n:
+                raise Exception('This analysis can\'t be continued, use analyze(data, keep=True) to update or merge it')
+            self.sketch = QuantileSketch()
+        return self.sketch
+
+    def __combineMoments(self, n, mean, M2):
+        # Chan et al. parallel update of (n, mean, M2)
+        if self.n == 0:
+            self.n, self.mean, self._M2 = n, mean, M2
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self._M2 = self._M2 + M2 + delta * delta * self.n * n / total
+        self.n = total
+
+    def __summarize(self):
+        self.variance = self._M2 / (self.n - 1) if self.n > 1 else 0   # n-1 degrees of freedom
+        self.stD = math.sqrt(self.variance)
+        self.CI = 1.96 * (self.stD / math.sqrt(self.n))
+        if self.sketch.isExact():
+            self.Q1, self.median, self.Q3 = (float(q) for q in Stats.quartilesOfSorted(self.sketch.sortedValues()))
+        else:
+            self.Q1, self.median, self.Q3 = (float(q) for q in self.sketch.quantile([0.25, 0.5, 0.75]))
+
     def export(self):
         data = [
             ["Quartile 1", "Médiane", "Quartile 3", "Moyenne", "Écart-type", "Intervale de confiance (95%)"],
@@ -58,12 +276,26 @@ class Stats:
         }.__str__()
 
 
+@lru_cache(maxsize=1024)
+def tQuantile(q, degreesOfFreedom):
+    # t.ppf is by far the slowest step of a scalar fit, and incremental updates ask for the same few df again and again
+    from scipy.stats import t   # scipy is slow to import, only load it when a fit needs it
+    return float(t.ppf(q, degreesOfFreedom))
+
+
 class Parameters:
+    # no per object __dict__, the results of tens of thousands of fits are kept at once (see FitTable)
+    __slots__ = ("X", "Y", "alpha", "filePath", "n", "xMean", "yMean", "beta0", "beta1", "beta0Interval",
+                 "beta1Interval", "SXX", "SXY", "SYY", "MSE", "SSE", "SSR", "_x", "_y")
+
     def __init__(self, XData, YData, alphaError=0.05, dataloc=''):
         self.X = XData
         self.Y = YData
         self.alpha = alphaError
         self.filePath= dataloc
+        self.n = -1     #uninitialized
+        self.xMean = -1   #uninitialized
+        self.yMean = -1   #uninitialized
         self.beta0 = -1   #uninitialized
         self.beta1 = -1   #uninitialized
         self.beta0Interval = -1   #uninitialized
@@ -74,47 +306,147 @@ class Parameters:
         self.MSE = -1     #uninitialized
         self.SSE = -1     #uninitialized
         self.SSR = -1     #uninitialized
+        self._x = None  # contiguous float64 copies of X and Y, only alive during evaluate()
+        self._y = None
 
     """
     This methode allows us to calculate the the confidence interval for the
     ß0 and ß1 parameters for a linear regression, as well as making the appropriate calls
-    to finding ß0, ß1 and all the other parameter 
+    to finding ß0, ß1 and all the other parameter.
+    X and Y are converted once to contiguous numpy arrays so that every step below is
+    a vectorized pass instead of a python loop (and the means are only computed once).
+    Once fitted X and Y are dropped: everything else is derived from the sums (see add / remove),
+    and evaluating again does nothing (give new XData / YData to fit them instead).
     """
     def evaluate(self):
+        if self.X is None or self.Y is None:
+            if self.n != -1:
+                return  # already fitted, the results are still there
+            raise Exception('No X and Y to fit')
         if len(self.Y) != len(self.X):
             # we want to crash the code here because it's not worth continuing
             raise Exception('Y and X are not the same size, dumbass!')
 
-        self.findSumsOfSquares()
-        self.findBeta0And1()
-        self.findSquaredErrors()
-        self.evaluateConfidenceInterval()
+        self._x = np.ascontiguousarray(self.X, dtype=np.float64)
+        self._y = np.ascontiguousarray(self.Y, dtype=np.float64)
+        self.n = self._x.shape[0]
+        profiler.count("rows fitted", self.n)
+        try:
+            with profiler.span("fit"):
+                self.findSumsOfSquares()
+                self.findBeta0And1()
+                self.findSquaredErrors()
+                self.evaluateConfidenceInterval()
+            self.X = None
+            self.Y = None
+        finally:
+            self._x = None
+            self._y = None
 
     def findSumsOfSquares(self):
-        xMean = Stats().analyze(self.X).mean
-        yMean = Stats().analyze(self.Y).mean
+        self.xMean = float(self._x.mean())
+        self.yMean = float(self._y.mean())
+        dx = self._x - self.xMean
+        dy = self._y - self.yMean
 
-        self.SXX = sum([(xi - xMean) ** 2 for xi in self.X])
-        self.SYY = sum([(yi - yMean) ** 2 for yi in self.Y])
-        self.SXY = sum([(self.X[i] - xMean) * (self.Y[i] - yMean) for i in range(len(self.X))])
+        self.SXX = float(dx @ dx)
+        self.SYY = float(dy @ dy)
+        self.SXY = float(dx @ dy)
 
     def findBeta0And1(self):
         self.beta1 = self.SXY / self.SXX
-        xMean = Stats().analyze(self.X).mean
-        yMean = Stats().analyze(self.Y).mean
-        self.beta0 = yMean - (xMean * self.beta1)
+        self.beta0 = self.yMean - (self.xMean * self.beta1)
 
     def findSquaredErrors(self):
         self.SSR = (self.SXY * self.SXY) / self.SXX  # did it like this cuz its painfully slow otherwise
-        self.SSE = sum([(self.Y[i] - (self.beta0 + (self.beta1 * self.X[i]))) ** 2 for i in range(len(self.X))])
-        self.MSE = self.SSE / (len(self.X) - 2)     # MSE ≡ ø^2 = SSE / (n - 2)
+        residuals = self._y - (self.beta0 + (self.beta1 * self._x))
+        self.SSE = float(residuals @ residuals)
+        self.MSE = self.SSE / (self.n - 2)     # MSE ≡ ø^2 = SSE / (n - 2)
 
     def evaluateConfidenceInterval(self):
-        tVal = t.ppf(1 - self.alpha/2, len(self.X) - 2)
-        xMean = Stats().analyze(self.X).mean
-        self.beta0Interval = tVal * math.sqrt(self.MSE * ((1 / len(self.X)) + (xMean * xMean / self.SXX)))
+        from scipy.stats import t   # scipy is slow to import, only load it when a fit needs it
+        tVal = t.ppf(1 - self.alpha/2, self.n - 2)
+        self.beta0Interval = tVal * math.sqrt(self.MSE * ((1 / self.n) + (self.xMean * self.xMean / self.SXX)))
+        self.beta1Interval = tVal * math.sqrt(self.MSE / self.SXX)
+
+    """
+    Incremental updates: add() and remove() fold k observations in (or out of) the running
+    sums in O(k) and re-derive ß0, ß1, the errors and the intervals from the sums alone,
+    without going back over the n rows already fitted. X and Y no longer describe the fitted
+    data afterwards, so they are dropped.
+    """
+    def add(self, XData, YData):
+        sums = self.sufficientStats().update(XData, YData)
+        return self.setSums(sums)
+
+    def remove(self, XData, YData):
+        sums = self.sufficientStats().remove(XData, YData)
+        return self.setSums(sums)
+
+    def sufficientStats(self):
+        sums = SufficientStats()
+        if self.n > 0:
+            sums._combine(self.n, self.xMean, self.yMean, self.SXX, self.SXY, self.SYY)
+        return sums
+
+    def setSums(self, sums):
+        # sums: a scalar SufficientStats, checked before anything changes so a refused update leaves the fit as it was
+        if int(sums.n) <= 2:
+            raise Exception(f'A regression needs at least 3 observations, there would be {int(sums.n)}')
+        self.X = None
+        self.Y = None
+        self.n = int(sums.n)
+        self.xMean, self.yMean = float(sums.xMean), float(sums.yMean)
+        self.SXX, self.SXY, self.SYY = float(sums.SXX), float(sums.SXY), float(sums.SYY)
+        self.deriveFromSums()
+        return self
+
+    def deriveFromSums(self):
+        # scalar version of fromSums, fast enough to run after every small update
+        if self.n <= 2:
+            raise Exception(f'A regression needs at least 3 observations, there are {self.n}')
+        self.beta1 = self.SXY / self.SXX
+        self.beta0 = self.yMean - (self.xMean * self.beta1)
+        self.SSR = (self.SXY * self.SXY) / self.SXX
+        self.SSE = max(self.SYY - self.SSR, 0.0)    # SSE = SYY - ß1 * SXY
+        self.MSE = self.SSE / (self.n - 2)
+        tVal = tQuantile(1 - self.alpha / 2, self.n - 2)
+        self.beta0Interval = tVal * math.sqrt(self.MSE * ((1 / self.n) + (self.xMean * self.xMean / self.SXX)))
         self.beta1Interval = tVal * math.sqrt(self.MSE / self.SXX)
 
+    @staticmethod
+    def fromSums(n, xMean, yMean, SXX, SXY, SYY, alphaError=0.05):
+        """
+        Builds already evaluated Parameters straight from the sufficient statistics of the
+        regression (n, the means and the centered sums of squares), without touching the data.
+        Every argument can also be a numpy array of k regressions, in which case all of them
+        are solved in one stacked array operation and a list of k Parameters is returned.
+        """
+        profiler.count("fits from sums", int(np.size(n)))
+        n, xMean, yMean, SXX, SXY, SYY = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64)
+                                                              for v in (n, xMean, yMean, SXX, SXY, SYY)))
+        beta1 = SXY / SXX
+        beta0 = yMean - (xMean * beta1)
+        SSR = (SXY * SXY) / SXX
+        SSE = np.maximum(SYY - SSR, 0.0)    # SSE = SYY - ß1 * SXY
+        MSE = SSE / (n - 2)
+        from scipy.stats import t
+        tVal = t.ppf(1 - alphaError / 2, n - 2)
+        beta0Interval = tVal * np.sqrt(MSE * ((1 / n) + (xMean * xMean / SXX)))
+        beta1Interval = tVal * np.sqrt(MSE / SXX)
+
+        fits = []
+        for i in np.ndindex(n.shape):
+            parameters = Parameters(None, None, alphaError)
+            parameters.n = int(n[i])
+            parameters.xMean, parameters.yMean = float(xMean[i]), float(yMean[i])
+            parameters.SXX, parameters.SXY, parameters.SYY = float(SXX[i]), float(SXY[i]), float(SYY[i])
+            parameters.beta0, parameters.beta1 = float(beta0[i]), float(beta1[i])
+            parameters.SSR, parameters.SSE, parameters.MSE = float(SSR[i]), float(SSE[i]), float(MSE[i])
+            parameters.beta0Interval, parameters.beta1Interval = float(beta0Interval[i]), float(beta1Interval[i])
+            fits.append(parameters)
+        return fits[0] if n.ndim == 0 else fits
+
     def export(self):
         data = [
             ["ß0", "ß1", "ß0 interval", "ß1 interval", "SXX", "SXY", "SYY", "SSE", "SSR", "MSE"],
@@ -140,4 +472,146 @@ class Parameters:
             "SSE": self.SSE,
             "SSR": self.SSR,
             "MSE": self.MSE
-        }.__str__()
\ No newline at end of file
+        }.__str__()
+
+class SufficientStats:
+    """
+    Running sufficient statistics of a simple linear regression (n, the means and the centered
+    sums SXX, SXY, SYY), updated chunk by chunk with Chan's pairwise formulas so that nothing
+    but these six numbers is kept. Two accumulators built on different chunks/shards merge into
+    the one that would have seen everything. With shape=(k,) it tracks k regressions at once
+    and update() takes (k, m) arrays.
+    """
+    def __init__(self, shape=()):
+        self.n = np.zeros(shape)
+        self.xMean = np.zeros(shape)
+        self.yMean = np.zeros(shape)
+        self.SXX = np.zeros(shape)
+        self.SXY = np.zeros(shape)
+        self.SYY = np.zeros(shape)
+
+    def update(self, XData, YData):
+        XData = np.asarray(XData, dtype=np.float64)
+        YData = np.asarray(YData, dtype=np.float64)
+        m = XData.shape[-1]
+        if m == 0:
+            return self
+        xMean = XData.mean(axis=-1)
+        yMean = YData.mean(axis=-1)
+        dx = XData - xMean[..., None]
+        dy = YData - yMean[..., None]
+        self._combine(m, xMean, yMean, (dx * dx).sum(axis=-1), (dx * dy).sum(axis=-1), (dy * dy).sum(axis=-1))
+        return self
+
+    def merge(self, other):
+        self._combine(other.n, other.xMean, other.yMean, other.SXX, other.SXY, other.SYY)
+        return self
+
+    def remove(self, XData, YData):
+        """
+        Takes observations that were added before back out (the inverse of update)
+        """
+        XData = np.asarray(XData, dtype=np.float64)
+        YData = np.asarray(YData, dtype=np.float64)
+        m = XData.shape[-1]
+        if m == 0:
+            return self
+        xMean = XData.mean(axis=-1)
+        yMean = YData.mean(axis=-1)
+        dx = XData - xMean[..., None]
+        dy = YData - yMean[..., None]
+        self._subtract(m, xMean, yMean, (dx * dx).sum(axis=-1), (dx * dy).sum(axis=-1), (dy * dy).sum(axis=-1))
+        return self
+
+    def _subtract(self, n, xMean, yMean, SXX, SXY, SYY):
+        # _combine solved for what was there before the other part was merged in
+        rest = self.n - n
+        if np.any(rest < 0):
+            raise Exception('Removing more observations than were added')
+        weight = np.divide(n, rest, out=np.zeros_like(rest), where=rest > 0)
+        restXMean = self.xMean + (self.xMean - xMean) * weight
+        restYMean = self.yMean + (self.yMean - yMean) * weight
+        dX = xMean - restXMean
+        dY = yMean - restYMean
+        cross = np.divide(rest * n, self.n, out=np.zeros_like(rest), where=self.n > 0)
+        empty = rest == 0
+        # rounding can leave tiny negative sums of squares, and nothing at all once everything was removed
+        self.SXX = np.where(empty, 0.0, np.maximum(self.SXX - SXX - dX * dX * cross, 0.0))
+        self.SXY = np.where(empty, 0.0, self.SXY - SXY - dX * dY * cross)
+        self.SYY = np.where(empty, 0.0, np.maximum(self.SYY - SYY - dY * dY * cross, 0.0))
+        self.xMean = np.where(empty, 0.0, restXMean)
+        self.yMean = np.where(empty, 0.0, restYMean)
+        self.n = rest
+
+    def _combine(self, n, xMean, yMean, SXX, SXY, SYY):
+        total = self.n + n
+        weight = np.divide(n, total, out=np.zeros_like(total), where=total > 0)
+        dX = xMean - self.xMean
+        dY = yMean - self.yMean
+        cross = self.n * weight   # n_a * n_b / (n_a + n_b)
+        self.SXX = self.SXX + SXX + dX * dX * cross
+        self.SXY = self.SXY + SXY + dX * dY * cross
+        self.SYY = self.SYY + SYY + dY * dY * cross
+        self.xMean = self.xMean + dX * weight
+        self.yMean = self.yMean + dY * weight
+        self.n = total
+
+    def parameters(self, alphaError=0.05):
+        return Parameters.fromSums(self.n, self.xMean, self.yMean, self.SXX, self.SXY, self.SYY, alphaError)
+
+
+class SlidingWindowRegression:
+    """
+    Simple linear regression over the last windowSize observations only. The rows of the
+    window are kept in a ring buffer: adding k rows folds them into the running sums and takes
+    the k oldest ones back out, O(k) whatever the window size. The sums are rebuilt from the
+    buffer once every windowSize added rows, so the rounding of the subtractions can't pile up.
+    """
+    def __init__(self, windowSize, alphaError=0.05):
+        self.windowSize = windowSize
+        self.alpha = alphaError
+        self.X = np.empty(windowSize)
+        self.Y = np.empty(windowSize)
+        self.start = 0  # index of the oldest row in the buffer
+        self.count = 0
+        self.sums = SufficientStats()
+        self._sinceRebuild = 0
+
+    def add(self, XData, YData):
+        XData = np.atleast_1d(np.asarray(XData, dtype=np.float64))
+        YData = np.atleast_1d(np.asarray(YData, dtype=np.float64))
+        k = XData.shape[0]
+        if k >= self.windowSize:
+            # the new rows fill the whole window by themselves
+            self.X[:], self.Y[:] = XData[-self.windowSize:], YData[-self.windowSize:]
+            self.start, self.count = 0, self.windowSize
+            return self.__rebuild()
+
+        evicted = max(0, self.count + k - self.windowSize)
+        if evicted:
+            oldest = (self.start + np.arange(evicted)) % self.windowSize
+            self.sums.remove(self.X[oldest], self.Y[oldest])
+            self.start = (self.start + evicted) % self.windowSize
+            self.count -= evicted
+        slots = (self.start + self.count + np.arange(k)) % self.windowSize
+        self.X[slots], self.Y[slots] = XData, YData
+        self.count += k
+        self.sums.update(XData, YData)
+
+        self._sinceRebuild += k
+        if self._sinceRebuild >= self.windowSize:
+            self.__rebuild()
+        return self
+
+    def window(self):
+        # the rows of the window, oldest first
+        rows = (self.start + np.arange(self.count)) % self.windowSize
+        return self.X[rows], self.Y[rows]
+
+    def __rebuild(self):
+        self.sums = SufficientStats().update(*self.window())
+        self._sinceRebuild = 0
+        return self
+
+    def parameters(self):
+        return Parameters(None, None, self.alpha).setSums(self.sums)
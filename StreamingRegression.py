@@ -0,0 +1,81 @@
+import numpy as np
+from Dataset import Dataset
+from Models import TRANSFORMS
+from StatsVoodoo import SufficientStats
+
+
+class StreamingRegression:
+    """
+    Out-of-core version of DataInterpreter.evaluateAllModels for csv files too big for memory.
+    The file is read chunk by chunk (only the needed columns), filtered on the material class,
+    every distinct (column, transform) is computed once per chunk and folded into running
+    SufficientStats, so peak memory is bounded by chunkSize whatever the size of the file.
+
+    fit() gives the same betas and intervals as the in-memory path. varianceTables() takes a
+    second pass over the file to get SSE/SSR/F_0 in the original scale of Y, like
+    Model.exportVarianceTable does (it needs the fitted betas, hence the second pass).
+    """
+
+    def __init__(self, filePath, models, classToUse=None, keyColumn='M', YColumnName='IR',
+                 chunkSize=1_000_000, alphaError=0.05):
+        self.filePath = filePath
+        self.models = models
+        self.classToUse = classToUse
+        self.keyColumn = keyColumn
+        self.YColumnName = YColumnName
+        self.chunkSize = chunkSize
+        self.alpha = alphaError
+        self.n = 0
+        self.yMean = 0.0    # mean of the untransformed Y, needed by the variance tables
+        self.__pairs = list(dict.fromkeys(self.__pairOf(model) for model in models))
+
+    def __pairOf(self, model):
+        return (model.XColumnName, model.xTransform), (self.YColumnName, model.yTransform)
+
+    def chunks(self):
+        columns = list(dict.fromkeys([self.YColumnName] + [model.XColumnName for model in self.models]))
+        if self.classToUse is not None:
+            columns.append(self.keyColumn)
+        for chunk in Dataset.readCsv(self.filePath, usecols=columns, chunksize=self.chunkSize):
+            if self.classToUse is not None:
+                chunk = chunk[chunk[self.keyColumn].to_numpy() == self.classToUse]
+            if len(chunk):
+                yield chunk
+
+    def fit(self):
+        accumulator = SufficientStats((len(self.__pairs),))
+        n, ySum = 0, 0.0
+        for chunk in self.chunks():
+            transformed = {}
+
+            def column(key):
+                if key not in transformed:
+                    transformed[key] = TRANSFORMS[key[1]](chunk[key[0]].to_numpy(dtype=np.float64))
+                return transformed[key]
+
+            accumulator.update(np.vstack([column(xKey) for xKey, _ in self.__pairs]),
+                               np.vstack([column(yKey) for _, yKey in self.__pairs]))
+            y = column((self.YColumnName, "identity"))
+            n += len(y)
+            ySum += float(y.sum())
+
+        if n == 0:
+            raise Exception('No rows left to fit after filtering')
+        self.n, self.yMean = n, ySum / n
+        fits = dict(zip(self.__pairs, accumulator.parameters(self.alpha)))
+        for model in self.models:
+            model.initiateFromParameters(fits[self.__pairOf(model)])
+        return self.models
+
+    def varianceTables(self):
+        SSE = np.zeros(len(self.models))
+        SSR = np.zeros(len(self.models))
+        for chunk in self.chunks():
+            y = chunk[self.YColumnName].to_numpy(dtype=np.float64)
+            for i, model in enumerate(self.models):
+                YPred = model.predict(chunk[model.XColumnName].to_numpy())
+                SSE[i] += float(((y - YPred) ** 2).sum())
+                SSR[i] += float(((YPred - self.yMean) ** 2).sum())
+        for i, model in enumerate(self.models):
+            model.setVarianceTable(float(SSE[i]), float(SSR[i]), self.n)
+        return self.models
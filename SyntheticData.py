@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from Dataset import DTYPES
+
+
+class SyntheticData:
+    """
+    Generates data sets shaped like DevoirD_A23.csv (M, V, T, IR) of any size, with known effects:
+
+        ln(IR) = intercept + materialEffect * M + VEffect * V + TEffect * T + 𝛆,   𝛆 ~ N(0, noise²)
+
+    The defaults are close to what Model6 finds on the real data set. Generation is done in
+    blocks so that writeCsv can produce files far larger than memory.
+    """
+
+    def __init__(self, seed=0, materials=2, VValues=(6, 10, 15), TMean=41.0, TStD=2.8,
+                 intercept=-3.08, materialEffect=-0.1, VEffect=0.0, TEffect=0.131, noise=0.27):
+        if not 1 <= materials <= np.iinfo(DTYPES["M"]).max + 1:
+            # M would silently wrap around in its dtype and merge classes
+            raise Exception(f'materials must be between 1 and {np.iinfo(DTYPES["M"]).max + 1}, not {materials}')
+        self.seed = seed
+        self.materials = materials
+        self.VValues = np.asarray(VValues)
+        self.TMean = TMean
+        self.TStD = TStD
+        self.intercept = intercept
+        self.materialEffect = materialEffect
+        self.VEffect = VEffect
+        self.TEffect = TEffect
+        self.noise = noise
+
+    def generate(self, n, rng=None):
+        rng = np.random.default_rng(self.seed) if rng is None else rng
+        M = rng.integers(0, self.materials, n)
+        V = rng.choice(self.VValues, n)
+        T = np.round(rng.normal(self.TMean, self.TStD, n), 1)
+        lnIR = (self.intercept + self.materialEffect * M + self.VEffect * V + self.TEffect * T
+                + rng.normal(0, self.noise, n))
+        frame = pd.DataFrame({"M": M, "V": V, "T": T, "IR": np.round(np.exp(lnIR), 1)})
+        return frame.astype({name: dtype for name, dtype in DTYPES.items()})
+
+    def writeCsv(self, filePath, n, blockSize=1_000_000):
+        # one generator for the whole file, the same seed and blockSize always give the same file
+        rng = np.random.default_rng(self.seed)
+        with open(filePath, 'w', newline='') as f:
+            for start in range(0, n, blockSize):
+                block = self.generate(min(blockSize, n - start), rng)
+                block.to_csv(f, index=False, header=start == 0)
+        return filePath
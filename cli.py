@@ -0,0 +1,286 @@
+"""
+Command line entry point for the compute and plot routines.
+
+    python cli.py summarize DevoirD_A23.csv --key M
+    python cli.py fit DevoirD_A23.csv --material 0 --models 1 4
+    python cli.py fit DevoirD_A23.csv --models 2 3 5 6 --nonlinear
+    python cli.py test DevoirD_A23.csv ttest --groups 0 1
+    python cli.py plot DevoirD_A23.csv models --material 0 --out figures
+    python cli.py convert DevoirD_A23.csv --format npy
+    python cli.py fit DevoirD_A23.csv --material 0 --profile trace.json
+    python cli.py run analysis.json --processes 8
+    python cli.py rank DevoirD_A23.csv --material 0 --criterion cvMSE --folds 10
+    python cli.py sample DevoirD_A23.csv -n 205 --seed 2194964 --out sample.csv
+    python cli.py serve --port 8765
+
+Only what a subcommand needs is imported: summarize and fit never load matplotlib/seaborn,
+scipy is only loaded when a confidence interval or a test is actually computed.
+"""
+import argparse
+import os
+import sys
+
+
+def loadInterpreter(args):
+    from DataInterpreter import DataInterpreter
+    return DataInterpreter(args.file, args.material)
+
+
+def loadGroups(args):
+    from DataInterpreter import GroupedDataInterpreter
+    return GroupedDataInterpreter(args.file, args.key, alphaError=args.alpha)
+
+
+def modelClasses(numbers):
+    import Models
+    return [getattr(Models, f"Model{number}") for number in numbers]
+
+
+def summarize(args):
+    if args.material is not None:
+        from StatsVoodoo import Stats
+        stats = Stats(args.alpha).analyze(loadInterpreter(args).dataSet[args.column].tolist())
+        print(f"{args.key}={args.material}: {stats}")
+        return
+    for key, stats in loadGroups(args).analyzeAll(args.column).items():
+        print(f"{args.key}={key}: {stats}")
+
+
+def loadCache(args):
+    if args.cache is None:
+        return None
+    from FitCache import FitCache
+    return FitCache(directory=args.cache)
+
+
+def fit(args):
+    classes = modelClasses(args.models)
+    if args.nonlinear:
+        return fitNonlinear(args, classes)
+    cache = loadCache(args)
+    if args.material is not None:
+        from Models import ModelBatch
+        dataSet = loadInterpreter(args).dataSet
+        if cache is None:
+            fits = {args.material: ModelBatch(dataSet, alphaError=args.alpha).fit([c() for c in classes])}
+        else:
+            fits = {args.material: cache.fitBatch(dataSet, [c() for c in classes], alphaError=args.alpha)}
+    elif cache is not None:
+        groups = loadGroups(args)
+        fits = {key: cache.fitBatch(groups.getGroup(key), [c() for c in classes], alphaError=args.alpha)
+                for key in groups.groups()}
+    else:
+        fits = loadGroups(args).fitAll(classes, args.processes)
+    for key, models in fits.items():
+        for model in models:
+            print(f"{args.key}={key} {type(model).__name__}: {model.parameters}")
+
+
+def fitNonlinear(args, classes):
+    from NonlinearFit import NonlinearFit
+    if args.material is not None:
+        fitter = NonlinearFit(loadInterpreter(args).dataSet, args.column, args.alpha)
+        fits = {args.material: fitter.fit([c() for c in classes])}
+    else:
+        fitter = NonlinearFit(loadGroups(args).dataSet, args.column, args.alpha)
+        fits = fitter.fitGroups(classes, args.key)
+    for key, models in fits.items():
+        for model in models:
+            print(f"{args.key}={key} {type(model).__name__}: ß0={model.beta0} {model.beta0Interval}, "
+                  f"ß1={model.beta1} {model.beta1Interval}, SSE={model.SSE}")
+    for model in fitter.unconverged:
+        print(f"{type(model).__name__} did not converge in {fitter.maxIterations} iterations", file=sys.stderr)
+
+
+def rank(args):
+    from ModelSelection import ModelSelection
+    selection = ModelSelection(loadInterpreter(args).dataSet, args.column, args.folds, args.seed, args.alpha)
+    ranked = selection.rank([c() for c in modelClasses(args.models)], args.criterion, args.processes or 0)
+    for place, model in enumerate(ranked, 1):
+        scores = ", ".join(f"{name}={value:.6g}" for name, value in model.scores.items())
+        print(f"{place}. {type(model).__name__}: {scores}")
+
+
+def test(args):
+    from HypothesisTest import Hypothesis
+    hypothesis = Hypothesis(args.alpha)
+    if args.kind == 'normality':
+        if args.material is not None:
+            data = loadInterpreter(args).dataSet[args.column]
+        else:
+            import pandas as pd
+            data = pd.read_csv(args.file)[args.column]
+        hypothesis.test(data.tolist())
+    elif args.kind == 'ttest':
+        if args.groups is None or len(args.groups) != 2:
+            sys.exit("ttest needs --groups A B")
+        groups = loadGroups(args)
+        hypothesis.tTest(*(groups.getGroup(group)[args.column].tolist() for group in args.groups))
+
+
+def plot(args):
+    os.makedirs(args.out, exist_ok=True)
+    interpreter = loadInterpreter(args)
+    if args.kind == 'box':
+        interpreter.plotBox(args.column, args.title, os.path.join(args.out, f"box-{args.material}.png"))
+    elif args.kind == 'histogram':
+        interpreter.plotHistogram(args.column, args.title, os.path.join(args.out, f"histogram-{args.material}.png"))
+    elif args.kind == 'normal':
+        interpreter.plotNormalProbabilityPlot(args.column, args.title, os.path.join(args.out, f"normal-{args.material}.png"))
+    else:
+        for model in modelClasses(args.models):
+            interpreter.addModel(model())
+        interpreter.evaluateAllModels(args.out, args.processes, cache=loadCache(args))
+        if args.kind == 'residues':
+            interpreter.testResidues(args.out, args.processes)
+
+
+def run(args):
+    from JobRunner import JobRunner
+    spec = JobRunner.load(args.spec)
+    for name in ('processes', 'output', 'timeout', 'retries'):
+        if getattr(args, name) is not None:
+            spec[name] = getattr(args, name)
+    runner = JobRunner(spec, progress=not args.quiet)
+    records = runner.run()
+    print(f"{len(records)} records, {len(runner.failures)} failed tasks", file=sys.stderr)
+    for name, error in runner.failures:
+        print(f"FAILED {name}: {error}", file=sys.stderr)
+    if runner.failures:
+        sys.exit(1)
+
+
+def sample(args):
+    from Sampling import Sampler
+    sampler = Sampler(args.file, seed=args.seed)
+    columnsOut = args.out is not None and not args.out.endswith(".csv")
+    outputPath = args.out if columnsOut else None
+    processes = args.processes or 0
+    if args.stratify is None:
+        drawn = sampler.reservoir(args.n, processes, outputPath)
+    else:
+        drawn = sampler.stratified(args.n, args.stratify, args.allocation, processes, outputPath)
+    if args.out is None:
+        print(drawn.to_csv(index=False), end='')
+    elif not columnsOut:
+        drawn.to_csv(args.out, index=False)
+
+
+def serve(args):
+    from Server import Server
+    server = Server(args.host, args.port, args.socket, args.processes, args.cache, timeout=args.timeout)
+    print(f"serving on {args.socket or f'http://{args.host}:{args.port}'}", file=sys.stderr, flush=True)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+
+
+def convert(args):
+    from Dataset import Dataset
+    print(Dataset.convert(args.file, args.format))
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(description="Statistics and regressions on the IR data sets")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('file', help="csv data set")
+    common.add_argument('--material', '-m', type=int, default=None, help="only use this material class")
+    common.add_argument('--key', default='M', help="column holding the material class")
+    common.add_argument('--column', default='IR', help="column to analyze")
+    common.add_argument('--alpha', type=float, default=0.05)
+    common.add_argument('--processes', type=int, default=None, help="0 disables the process pool")
+    common.add_argument('--cache', default=None, metavar='DIR',
+                        help="reuse the fits stored in DIR (and store the new ones there)")
+    common.add_argument('--profile', nargs='?', const='-', default=None, metavar='TRACE',
+                        help="time every stage, print a summary or write a Chrome trace (.json) to TRACE")
+
+    summarizeParser = subparsers.add_parser('summarize', parents=[common], help="descriptive statistics")
+    summarizeParser.set_defaults(run=summarize)
+
+    fitParser = subparsers.add_parser('fit', parents=[common], help="fit the regression models")
+    fitParser.add_argument('--models', type=int, nargs='+', default=[1, 2, 3, 4, 5, 6])
+    fitParser.add_argument('--nonlinear', action='store_true',
+                           help="least squares in the original scale of Y (see NonlinearFit), not on ln|Y|")
+    fitParser.set_defaults(run=fit)
+
+    rankParser = subparsers.add_parser('rank', parents=[common], help="rank the models (in-sample and cross-validation)")
+    rankParser.add_argument('--models', type=int, nargs='+', default=[1, 2, 3, 4, 5, 6])
+    rankParser.add_argument('--criterion', choices=['cvMSE', 'press', 'SSE', 'R2', 'aic', 'bic'], default='cvMSE')
+    rankParser.add_argument('--folds', type=int, default=10)
+    rankParser.add_argument('--seed', type=int, default=0)
+    rankParser.set_defaults(run=rank)
+
+    testParser = subparsers.add_parser('test', parents=[common], help="hypothesis tests")
+    testParser.add_argument('kind', choices=['normality', 'ttest'])
+    testParser.add_argument('--groups', type=int, nargs=2, default=None, help="material classes compared by ttest")
+    testParser.set_defaults(run=test)
+
+    plotParser = subparsers.add_parser('plot', parents=[common], help="render graphs to files")
+    plotParser.add_argument('kind', choices=['box', 'histogram', 'normal', 'models', 'residues'])
+    plotParser.add_argument('--models', type=int, nargs='+', default=[1, 2, 3, 4, 5, 6])
+    plotParser.add_argument('--out', default='.', help="output directory")
+    plotParser.add_argument('--title', default='')
+    plotParser.set_defaults(run=plot)
+
+    runParser = subparsers.add_parser('run', help="run every task of a JSON/YAML analysis spec over a process pool")
+    runParser.add_argument('spec', help="spec file, see JobRunner.py")
+    runParser.add_argument('--processes', type=int, default=None, help="overrides the spec, 0 runs the tasks here")
+    runParser.add_argument('--output', default=None, help="overrides the spec's results file (.jsonl or .parquet)")
+    runParser.add_argument('--timeout', type=float, default=None, help="seconds per task attempt, overrides the spec")
+    runParser.add_argument('--retries', type=int, default=None, help="overrides the spec")
+    runParser.add_argument('--quiet', action='store_true', help="no progress lines")
+    runParser.add_argument('--profile', nargs='?', const='-', default=None, metavar='TRACE')
+    runParser.set_defaults(run=run)
+
+    sampleParser = subparsers.add_parser('sample', help="seeded subsample of a csv, read in one pass and left untouched")
+    sampleParser.add_argument('file', help="csv data set")
+    sampleParser.add_argument('-n', type=int, required=True, help="sample size")
+    sampleParser.add_argument('--seed', type=int, default=0)
+    sampleParser.add_argument('--stratify', default=None, metavar='COLUMN', help="sample every value of COLUMN")
+    sampleParser.add_argument('--allocation', choices=['proportional', 'equal'], default='proportional')
+    sampleParser.add_argument('--processes', type=int, default=None, help="workers reading parts of the file")
+    sampleParser.add_argument('--out', default=None, help="a .csv, or a directory of .npy columns, stdout otherwise")
+    sampleParser.set_defaults(run=sample)
+
+    serveParser = subparsers.add_parser('serve', help="answer queries from memory, see Server.py")
+    serveParser.add_argument('--host', default='127.0.0.1')
+    serveParser.add_argument('--port', type=int, default=8765)
+    serveParser.add_argument('--socket', default=None, metavar='PATH', help="serve on a Unix socket instead of TCP")
+    serveParser.add_argument('--processes', type=int, default=None, help="workers running the tests, 0 runs them in the server")
+    serveParser.add_argument('--cache', default=None, metavar='DIR', help="FitCache directory, see fit --cache")
+    serveParser.add_argument('--timeout', type=float, default=None, help="seconds per test")
+    serveParser.add_argument('--profile', nargs='?', const='-', default=None, metavar='TRACE')
+    serveParser.set_defaults(run=serve)
+
+    convertParser = subparsers.add_parser('convert', help="write a binary columnar copy of a csv, used by later runs")
+    convertParser.add_argument('file', help="csv data set")
+    convertParser.add_argument('--format', choices=['npy', 'parquet'], default='npy')
+    convertParser.set_defaults(run=convert)
+    return parser
+
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    if args.command == 'plot' and args.material is None:
+        sys.exit("plot needs --material")
+    profile = getattr(args, 'profile', None)
+    if profile is None:
+        args.run(args)
+        return
+    from Profiler import profiler
+    profiler.enable()
+    try:
+        args.run(args)
+    finally:
+        if profile == '-':
+            print(profiler.summary(), file=sys.stderr)
+        else:
+            profiler.dumpChromeTrace(profile)
+        profiler.reset()    # already reported, nothing left for the exit hook
+
+
+if __name__ == '__main__':
+    main()
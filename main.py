@@ -1,32 +1,29 @@
-import Grapher
 from Models import *
 import pandas as pd
 from DataInterpreter import DataInterpreter as di
 import numpy as np
 from HypothesisTest import Hypothesis
+from Sampling import Sampler
 
 """
     Macro (change me)
+    The same analysis, without editing this file: python cli.py run analysis.json
 """
 MATRICULE = 2194964
 
 
 def charger(matricule):
-    np.random.seed(matricule)
-    myData = pd.read_csv("DevoirD_A23.csv", sep=',')
-    myData = myData.sample(n=205, replace=False, random_state=matricule)
-    myData.to_csv("DevoirD_A23.csv", index=False)
-
-    return myData
+    # 205 rows drawn with the matricule as seed, the csv itself is left as it is
+    return Sampler("DevoirD_A23.csv", seed=matricule).reservoir(205)
 
 
 if __name__ == '__main__':
-    charger(MATRICULE)
+    myData = charger(MATRICULE)
 
     # Partie 1 a)
-    dataP1 = di('DevoirD_A23.csv', 0)
-    dataP1.dataSet = pd.read_csv('DevoirD_A23.csv')
+    dataP1 = di('DevoirD_A23.csv', 0, dataSet=myData)
     """
+    import Grapher
     dataP1.plotBox('IR', 'Box Plot all IR')
     dataP1.plotHistogram('IR', 'Distribution of IR in all materials')
     dataP1.plotNormalProbabilityPlot('IR', 'Normal plot for IR values in the entire set')
@@ -39,12 +36,12 @@ if __name__ == '__main__':
 
     # Partie 1 b)
 
-    dataM0 = di('DevoirD_A23.csv', 0)
+    dataM0 = di('DevoirD_A23.csv', 0, dataSet=myData[myData['M'] == 0])
     dataM0.plotBox('IR', 'Box Plot for material 0')
     dataM0.plotHistogram('IR', 'Distribution of IR in material 0')
     dataM0.plotNormalProbabilityPlot('IR', 'Normal plot for IR values in the m0 set')
 
-    dataM1 = di('DevoirD_A23.csv', 1)
+    dataM1 = di('DevoirD_A23.csv', 1, dataSet=myData[myData['M'] == 1])
     dataM1.plotBox('IR', 'Box Plot for material 1')
     dataM1.plotHistogram('IR', 'Distribution of IR in material 1')
     dataM1.plotNormalProbabilityPlot('IR', 'Normal plot for IR values in the m1 set')